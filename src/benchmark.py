@@ -0,0 +1,288 @@
+"""Benchmarks for the scatter and smart save tools that run outside of Maya.
+
+The tools run against fakemaya, which counts every command call and can
+add a fixed cost per call. Results are printed and can be written as JSON
+and compared against a saved baseline:
+
+    python benchmark.py --scales 1000 10000 --output baseline.json
+    python benchmark.py --scales 1000 10000 --baseline baseline.json
+
+A run fails when an entry got slower than the tolerance allows or needs
+more commands per instance than its baseline.
+"""
+import argparse
+import json
+import os
+import platform
+import shutil
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import numpy as np
+
+import fakemaya
+
+cmds = fakemaya.install()
+
+import scatter  # noqa: E402 the fake modules have to be installed first
+import scattercore  # noqa: E402
+import scatterpool  # noqa: E402
+import smartsave  # noqa: E402
+import versionindex  # noqa: E402
+
+SCALES = (1000, 10000, 100000, 1000000)
+
+
+def _grid_points(count):
+    """Returns count points on a flat square grid"""
+    side = max(1, int(count ** 0.5))
+    return [(float(index % side), 0.0, float(index // side))
+            for index in range(count)]
+
+
+def _scatter_tool(count):
+    """Resets the fake scene and returns a tool set up to scatter on count vertices"""
+    cmds.reset()
+    cmds.add_mesh("pPlane1", _grid_points(count))
+    cmds.add_mesh("pCube1", [(0.0, 0.0, 0.0)])
+    tool = scatter.ScatterTool()
+    # the main thread path, bench_parallel_compute times the worker pool
+    tool.workers = 1
+    tool.selected_object = "pCube1"
+    tool.selected_location = scattercore.VertexSet.from_components(
+        ["pPlane1.vtx[0:{}]".format(count - 1)])
+    return tool
+
+
+def measure(setup, memory=True):
+    """Runs what setup returns once for time and calls, once more for memory
+
+    Args:
+        setup (callable): prepares a run outside of the measurement and
+            returns the callable to measure
+        memory (bool): also measure the peak memory the run allocates,
+            traced separately as tracing slows the run down
+
+    Returns:
+        dict: seconds, calls by command, total_calls and peak_mb
+    """
+    run = setup()
+    cmds.reset_counts()
+    start = time.perf_counter()
+    run()
+    seconds = time.perf_counter() - start
+    calls = dict(cmds.call_counts)
+    result = {"seconds": seconds, "calls": calls,
+              "total_calls": sum(calls.values()), "peak_mb": None}
+    if memory:
+        run = setup()
+        tracemalloc.start()
+        try:
+            run()
+            result["peak_mb"] = tracemalloc.get_traced_memory()[1] / 1e6
+        finally:
+            tracemalloc.stop()
+    return result
+
+
+def bench_scatter_each(counts=SCALES, modes=(scatter.OUTPUT_TRANSFORMS,
+                                             scatter.OUTPUT_INSTANCER),
+                       memory=True):
+    """Times ScatterTool.scatter_each onto every vertex of a count vertex mesh
+
+    Returns:
+        list: one dict per count and output mode
+    """
+    results = []
+    for count in counts:
+        for output_mode in modes:
+            def setup():
+                tool = _scatter_tool(count)
+                tool.output_mode = output_mode
+                return tool.scatter_each
+            result = measure(setup, memory)
+            result.update({"name": "scatter_each", "mode": output_mode,
+                           "count": count, "nodes": len(cmds.nodes) - 2,
+                           "calls_per_instance": result["total_calls"] / count})
+            results.append(result)
+    return results
+
+
+def bench_next_available_ver(counts=SCALES, memory=True):
+    """Times SceneFile.next_available_ver in a folder of count versions
+
+    The cold mode lists the folder, the cached mode reuses its index and
+    the catalog mode asks an up to date scene catalog, see
+    SceneFile.catalog_next_ver.
+
+    Returns:
+        list: one dict per count and mode
+    """
+    results = []
+    folder = tempfile.mkdtemp(prefix="smartsave_bench_")
+    catalog = os.path.join(tempfile.mkdtemp(prefix="smartsave_catalog_"),
+                           "catalog.sqlite")
+    try:
+        written = 0
+        for count in sorted(counts):
+            for ver in range(written + 1, count + 1):
+                open(os.path.join(folder, "main_model_v{:03d}.ma".format(ver)),
+                     "w").close()
+            written = count
+            # an index of a folder changed just now is not trusted twice
+            stale = time.time() - 60
+            os.utime(folder, (stale, stale))
+
+            for mode in ("cold", "cached", "catalog"):
+                def setup():
+                    scene_file = smartsave.SceneFile()
+                    scene_file.folder_path = folder
+                    scene_file.ext = ".ma"
+                    scene_file.catalog_path = catalog
+                    versionindex.clear_cache()
+                    if mode == "catalog":
+                        scene_file.catalog_next_ver()
+                        return scene_file.catalog_next_ver
+                    if mode == "cached":
+                        scene_file.next_available_ver()
+                    return scene_file.next_available_ver
+                result = measure(setup, memory)
+                result.update({"name": "next_available_ver", "mode": mode,
+                               "count": count, "calls_per_instance":
+                               result["total_calls"] / count})
+                results.append(result)
+    finally:
+        shutil.rmtree(folder)
+        shutil.rmtree(os.path.dirname(catalog))
+    return results
+
+
+def bench_parallel_compute(count=1000000, target_count=32,
+                           workers=(1, 2, 4, 8, 16)):
+    """Times the matrix compute stage alone on the main thread and across pools
+
+    Needs no scene: count random instances are spread over target_count
+    random meshes and aligned to their normals.
+
+    Returns:
+        list: one dict per worker count, workers 1 being the main thread
+    """
+    rng = np.random.RandomState(0)
+    points_per_target = 4 * count // target_count + 1
+    points = rng.uniform(-100.0, 100.0, (points_per_target * target_count, 3))
+    normals = rng.normal(size=points.shape)
+    normals /= np.linalg.norm(normals, axis=1)[:, np.newaxis]
+    rows = np.sort(rng.choice(len(points), count, replace=False))
+    streams = (rows // points_per_target).astype(np.uint64)
+    counters = (rows % points_per_target).astype(np.uint64)
+    mins, maxs = scatter.ScatterTool().random_ranges()
+    results = []
+    expected = None
+    for worker_count in workers:
+        start = time.time()
+        if worker_count == 1:
+            matrices = scattercore.instance_matrices(
+                1234, streams, counters, points[rows], mins, maxs,
+                normals[rows])
+        else:
+            with scatterpool.ScatterPool(worker_count) as pool:
+                pool.start()
+                start = time.time()
+                matrices = pool.compute(1234, mins, maxs, points, rows,
+                                        streams, counters, normals)
+        seconds = time.time() - start
+        if expected is None:
+            expected = matrices
+        results.append({"count": count, "workers": worker_count,
+                        "seconds": seconds,
+                        "speedup": results[0]["seconds"] / seconds
+                        if results else 1.0,
+                        "matches": bool(np.array_equal(matrices, expected))})
+    return results
+
+
+def compare(results, baseline, tolerance=0.2):
+    """Lists the results that regressed against a baseline run
+
+    Entries are matched by name, mode and count. An entry regresses when it
+    takes more than tolerance longer or makes more calls per instance.
+
+    Returns:
+        list: one message per regression
+    """
+    saved = {(entry["name"], entry["mode"], entry["count"]): entry
+             for entry in baseline["results"]}
+    regressions = []
+    for result in results:
+        base = saved.get((result["name"], result["mode"], result["count"]))
+        if base is None:
+            continue
+        label = "{name} {mode} {count}".format(**result)
+        if result["seconds"] > base["seconds"] * (1.0 + tolerance):
+            regressions.append("{}: {:.3f}s, baseline {:.3f}s".format(
+                label, result["seconds"], base["seconds"]))
+        if result["calls_per_instance"] > base["calls_per_instance"] + 1e-9:
+            regressions.append("{}: {:.3f} calls per instance, baseline "
+                               "{:.3f}".format(label,
+                                               result["calls_per_instance"],
+                                               base["calls_per_instance"]))
+    return regressions
+
+
+def run_suite(scales=SCALES, call_overhead=0.0, memory=True):
+    """Runs every benchmark and returns the results with their environment"""
+    cmds.call_overhead = call_overhead
+    try:
+        results = (bench_scatter_each(scales, memory=memory) +
+                   bench_next_available_ver(scales, memory=memory))
+    finally:
+        cmds.call_overhead = 0.0
+    return {"meta": {"time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+                     "python": platform.python_version(),
+                     "numpy": np.__version__,
+                     "platform": platform.platform(),
+                     "call_overhead": call_overhead},
+            "results": results}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--scales", type=int, nargs="+", default=SCALES)
+    parser.add_argument("--call-overhead", type=float, default=0.0,
+                        help="seconds every fake command takes")
+    parser.add_argument("--no-memory", action="store_true",
+                        help="skip the traced peak memory runs")
+    parser.add_argument("--output", help="write the results to this JSON file")
+    parser.add_argument("--baseline", help="JSON results to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.2)
+    parser.add_argument("--parallel", action="store_true",
+                        help="also time the parallel matrix compute stage")
+    args = parser.parse_args(argv)
+
+    report = run_suite(args.scales, args.call_overhead, not args.no_memory)
+    for result in report["results"]:
+        peak = ("{:9.1f}MB".format(result["peak_mb"])
+                if result["peak_mb"] is not None else "")
+        print("{name:>18} {mode:>12} {count:>8} {seconds:9.3f}s "
+              "{calls_per_instance:7.3f} calls/instance".format(**result) + peak)
+    if args.parallel:
+        for result in bench_parallel_compute():
+            print("{workers:>4} workers {count:>8} matrices {seconds:8.3f}s "
+                  "{speedup:5.2f}x matches {matches}".format(**result))
+    if args.output:
+        with open(args.output, "w") as output:
+            json.dump(report, output, indent=2, sort_keys=True)
+    if args.baseline:
+        with open(args.baseline) as baseline:
+            regressions = compare(report["results"], json.load(baseline),
+                                  args.tolerance)
+        for regression in regressions:
+            print("REGRESSION " + regression)
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
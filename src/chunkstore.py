@@ -0,0 +1,224 @@
+"""Stores files as content defined chunks, so similar files share their storage
+
+A file is cut where a rolling gear hash of the last 32 bytes has its top
+AVERAGE_BITS bits clear, which happens at the same content wherever it
+moved to, so an edit only changes the chunks around it. Every chunk is
+kept once under its sha256 and a file is described by a manifest listing
+its chunks, so storing a new version of a file only writes what changed.
+
+The hash is computed with numpy for a whole block at a time: the gear
+hash of a window is the sum of its bytes' table values, each shifted by
+its distance from the window's end, and five doubling steps add up the
+32 shifted values of every position at once.
+
+Manifests are JSON:
+    version: format version
+    size: file size in bytes
+    sha256: hex digest of the whole file
+    mtime: modification time of the file when it was stored
+    store: absolute path of the ChunkStore root the chunks are in
+    chunks: [digest, size] of every chunk in order
+"""
+import hashlib
+import json
+import logging
+import os
+import uuid
+
+import numpy as np
+
+import fileutil
+
+log = logging.getLogger(__name__)
+
+VERSION = 1
+AVERAGE_BITS = 13
+MIN_SIZE = 2 << 10
+MAX_SIZE = 64 << 10
+BLOCK_SIZE = 16 << 20
+
+# Bytes of the rolling window, the shifts of a uint32 hash drop older ones
+_WINDOW = 32
+_GEAR = np.random.RandomState(0x5CE4E).randint(
+    0, 1 << 32, 256, dtype=np.uint64).astype(np.uint32)
+
+
+def gear_hashes(data, context=b""):
+    """Returns the (n,) uint32 gear hash of the window ending at every byte
+
+    Args:
+        data (bytes): the bytes to hash
+        context (bytes): up to 31 bytes before data, so the first windows
+            are the same as when data was hashed as part of a longer file
+    """
+    context = context[-(_WINDOW - 1):] if context else b""
+    values = _GEAR[np.frombuffer(context + data, dtype=np.uint8)]
+    width = 1
+    while width < _WINDOW:
+        values[width:] += values[:-width] << np.uint32(width)
+        width *= 2
+    return values[len(context):]
+
+
+def cut_points(data, context=b"", final=True, average_bits=AVERAGE_BITS,
+               min_size=MIN_SIZE, max_size=MAX_SIZE):
+    """Returns the offsets chunks of data end at
+
+    Chunks end after a byte whose window hash has its top average_bits
+    bits clear, and are kept between min_size and max_size long.
+
+    Args:
+        data (bytes): the bytes to cut, starting at a chunk start
+        context (bytes): the bytes before data, see gear_hashes
+        final (bool): data ends the file, so its tail is a chunk too;
+            otherwise the tail after the last cut is left for the next
+            block
+    """
+    hashes = gear_hashes(data, context)
+    candidates = np.flatnonzero(
+        (hashes >> np.uint32(32 - average_bits)) == 0) + 1
+    cuts = []
+    start = 0
+    while True:
+        index = np.searchsorted(candidates, start + min_size)
+        limit = start + max_size
+        if index < len(candidates) and candidates[index] <= limit:
+            cut = int(candidates[index])
+        elif limit <= len(data):
+            cut = limit
+        else:
+            break
+        cuts.append(cut)
+        start = cut
+    if final and start < len(data):
+        cuts.append(len(data))
+    return cuts
+
+
+def iter_chunks(stream, block_size=BLOCK_SIZE):
+    """Yields the chunks of a binary stream, reading block_size bytes at a time"""
+    pending = b""
+    context = b""
+    while True:
+        block = stream.read(block_size)
+        data = pending + block
+        start = 0
+        for cut in cut_points(data, context, final=not block):
+            yield data[start:cut]
+            start = cut
+        if not block:
+            return
+        context = (context + data[:start])[-(_WINDOW - 1):]
+        pending = data[start:]
+
+
+class ChunkStore(object):
+    """A folder of chunks named by their sha256
+
+    Attributes:
+        root (str): the store folder, chunks live in root/xx/digest
+        written (int): bytes of new chunks written by this instance
+    """
+
+    def __init__(self, root):
+        self.root = str(root)
+        self.written = 0
+
+    def chunk_path(self, digest):
+        return os.path.join(self.root, digest[:2], digest)
+
+    def has(self, digest):
+        return os.path.exists(self.chunk_path(digest))
+
+    def put(self, data):
+        """Stores a chunk unless it is stored already and returns its digest"""
+        digest = hashlib.sha256(data).hexdigest()
+        path = self.chunk_path(digest)
+        if not os.path.exists(path):
+            _write_atomic(path, [data])
+            self.written += len(data)
+        return digest
+
+    def get(self, digest):
+        with open(self.chunk_path(digest), "rb") as stream:
+            return stream.read()
+
+    def store_file(self, path):
+        """Stores the chunks of a file and returns its manifest"""
+        digest = hashlib.sha256()
+        chunks = []
+        size = 0
+        written = self.written
+        with open(path, "rb") as stream:
+            for chunk in iter_chunks(stream):
+                digest.update(chunk)
+                chunks.append([self.put(chunk), len(chunk)])
+                size += len(chunk)
+        log.info("Stored %s as %d chunks, %d of %d bytes new", path,
+                 len(chunks), self.written - written, size)
+        return {"version": VERSION, "size": size,
+                "sha256": digest.hexdigest(),
+                "mtime": os.path.getmtime(path),
+                "store": os.path.abspath(self.root), "chunks": chunks}
+
+    def has_all(self, manifest):
+        """Returns True if every chunk of a manifest is in this store"""
+        return all(self.has(digest) for digest, _ in manifest["chunks"])
+
+    def restore_file(self, manifest, path):
+        """Rebuilds the file of a manifest at path
+
+        The file is written under a temporary name and checked against the
+        manifest before it replaces path.
+
+        Raises:
+            IOError: if a chunk is missing or the rebuilt file differs
+        """
+        digest = hashlib.sha256()
+
+        def chunks():
+            for chunk_digest, _ in manifest["chunks"]:
+                data = self.get(chunk_digest)
+                digest.update(data)
+                yield data
+        _write_atomic(str(path), chunks(),
+                      check=lambda: digest.hexdigest() == manifest["sha256"])
+
+
+def write_manifest(path, manifest):
+    _write_atomic(str(path), [json.dumps(manifest).encode("utf-8")])
+
+
+def read_manifest(path):
+    """Returns the manifest at path
+
+    Raises:
+        ValueError: if it is of a newer version
+    """
+    with open(str(path)) as stream:
+        manifest = json.load(stream)
+    if manifest.get("version", 0) > VERSION:
+        raise ValueError("Manifest {} is version {}, newer than {}".format(
+            path, manifest["version"], VERSION))
+    return manifest
+
+
+def _write_atomic(path, chunks, check=None):
+    folder = os.path.dirname(path)
+    if not os.path.isdir(folder):
+        try:
+            os.makedirs(folder)
+        except OSError:  # made by another thread or process meanwhile
+            if not os.path.isdir(folder):
+                raise
+    part = "{}.{}.part".format(path, uuid.uuid4().hex)
+    try:
+        with open(part, "wb") as stream:
+            for chunk in chunks:
+                stream.write(chunk)
+        if check is not None and not check():
+            raise IOError("Rebuilt {} does not match its manifest".format(path))
+        fileutil.replace(part, path)
+    finally:
+        if os.path.exists(part):
+            os.remove(part)
@@ -0,0 +1,710 @@
+"""Local stand-in for maya.cmds so the tools can run without a Maya session.
+
+Only the commands the tools use are implemented and only as far as the tools
+need them. Install it before importing a tool:
+
+    import fakemaya
+    fakemaya.install()
+    import scatter
+
+Every command call is counted in cmds.call_counts and can be slowed down by
+cmds.call_overhead seconds to mimic the cost of a real Maya command.
+"""
+import collections
+import fnmatch
+import functools
+import math
+import os
+import re
+import sys
+import time
+import types
+
+import numpy as np
+
+COMPONENT_RE = re.compile(r"^(?P<node>[^.]+)\.vtx\[(?P<start>\*|\d+)(?::(?P<end>\d+))?\]$")
+
+
+def _matrix_multiply(a, b):
+    return [[sum(a[row][k] * b[k][col] for k in range(3)) for col in range(3)]
+            for row in range(3)]
+
+
+def _euler_matrix(rotation):
+    """Returns the 3x3 row vector matrix of xyz rotate order angles in degrees"""
+    rx, ry, rz = [math.radians(value) for value in rotation]
+    rot_x = [[1, 0, 0], [0, math.cos(rx), math.sin(rx)],
+             [0, -math.sin(rx), math.cos(rx)]]
+    rot_y = [[math.cos(ry), 0, -math.sin(ry)], [0, 1, 0],
+             [math.sin(ry), 0, math.cos(ry)]]
+    rot_z = [[math.cos(rz), math.sin(rz), 0], [-math.sin(rz), math.cos(rz), 0],
+             [0, 0, 1]]
+    return _matrix_multiply(_matrix_multiply(rot_x, rot_y), rot_z)
+
+
+class FakeNode(object):
+    """A transform in the fake scene, optionally with a mesh"""
+
+    __slots__ = ("name", "node_type", "translate", "rotate", "scale", "points",
+                 "normals", "triangles", "parent", "arrays", "connections",
+                 "attributes")
+
+    def __init__(self, name, node_type="transform"):
+        self.name = name
+        self.node_type = node_type
+        self.translate = [0.0, 0.0, 0.0]
+        self.rotate = [0.0, 0.0, 0.0]
+        self.scale = [1.0, 1.0, 1.0]
+        self.points = None
+        self.normals = None
+        self.triangles = None
+        self.parent = None
+        self.arrays = {}
+        self.connections = []
+        self.attributes = {}
+
+    def matrix(self):
+        """Returns the flat 16 value matrix of the node relative to its parent"""
+        rotation = _euler_matrix(self.rotate)
+        values = []
+        for row in range(3):
+            values.extend([rotation[row][col] * self.scale[row]
+                           for col in range(3)])
+            values.append(0.0)
+        values.extend(self.translate + [1.0])
+        return values
+
+    def set_matrix(self, values):
+        """Decomposes a flat 16 value matrix into translate, rotate and scale"""
+        from scattercore import matrix_to_euler
+        rows = [values[0:3], values[4:7], values[8:11]]
+        self.scale = [math.sqrt(sum(value * value for value in row))
+                      for row in rows]
+        rotation = [[value / scale for value in row]
+                    for row, scale in zip(rows, self.scale)]
+        self.rotate = matrix_to_euler(rotation)
+        self.translate = list(values[12:15])
+
+
+class FakeCmds(types.ModuleType):
+    """Implements the subset of maya.cmds used by the tools"""
+
+    helpers = ("reset", "reset_counts", "add_mesh", "set_points", "add_camera",
+               "set_key", "set_vertex_colors", "set_uvs", "add_image")
+
+    def __init__(self):
+        super(FakeCmds, self).__init__("maya.cmds")
+        self.nodes = {}
+        self.selection = []
+        self.script_jobs = {}
+        self._script_job_count = 0
+        self._name_counters = {}
+        self.undo_chunks = []
+        self.refresh_suspended = False
+        self.call_counts = collections.Counter()
+        self.call_overhead = 0.0
+        self.workspace_root = os.getcwd()
+        self.scene_name = ""
+        self.images = {}
+
+    # scene helpers, not part of maya.cmds
+
+    def reset(self):
+        self.nodes = {}
+        self.selection = []
+        self.script_jobs = {}
+        self._name_counters = {}
+        self.scene_name = ""
+        self.images = {}
+        self.reset_counts()
+
+    def reset_counts(self):
+        self.call_counts = collections.Counter()
+
+    def add_mesh(self, name, points, normals=None, triangles=None):
+        """Adds a mesh transform with world space points to the scene"""
+        node = FakeNode(name, node_type="mesh")
+        node.points = [list(point) for point in points]
+        node.normals = normals
+        node.triangles = [list(triangle) for triangle in triangles or []]
+        self.nodes[name] = node
+        return node
+
+    def add_camera(self, name, translate=(0.0, 0.0, 0.0), rotate=(0.0, 0.0, 0.0),
+                   focal_length=35.0, horizontal_aperture=1.417,
+                   vertical_aperture=0.945, near=0.1, far=10000.0):
+        """Adds a camera transform and its cameraShape to the scene"""
+        node = FakeNode(name)
+        node.translate = list(translate)
+        node.rotate = list(rotate)
+        shape = FakeNode(name + "Shape", node_type="camera")
+        shape.parent = name
+        shape.attributes.update(
+            focalLength=focal_length, horizontalFilmAperture=horizontal_aperture,
+            verticalFilmAperture=vertical_aperture, nearClipPlane=near,
+            farClipPlane=far)
+        self.nodes[name] = node
+        self.nodes[shape.name] = shape
+        return node
+
+    def set_key(self, attribute, frame, value):
+        """Keys attribute to value on frame, held until the next key"""
+        name, attr = attribute.split(".", 1)
+        keys = self._node(name).attributes.setdefault(attr, {})
+        if not isinstance(keys, dict):
+            keys = self._node(name).attributes[attr] = {}
+        keys[frame] = value
+
+    def set_vertex_colors(self, name, colors):
+        """Paints (n, 4) RGBA vertex colors on a mesh, the same for every color set"""
+        self._node(name).arrays["vertexColors"] = [list(color) for color in colors]
+
+    def set_uvs(self, name, uvs):
+        """Maps one (u, v) per vertex of a mesh, uv id i belonging to vertex i"""
+        self._node(name).arrays["uvs"] = [list(uv) for uv in uvs]
+
+    def add_image(self, path, pixels):
+        """Registers (h, w, 4) uint8 or float32 pixels for MImage to read from path
+
+        float32 pixels are read as a float image, like an EXR.
+
+        Creates an empty file at path too, so it has a modification time.
+        """
+        open(path, "w").close()
+        self.images[path] = pixels
+
+    def set_points(self, name, points):
+        """Replaces the points of a mesh and fires its outMesh script jobs"""
+        self._node(name).points = [list(point) for point in points]
+        attribute = name + "Shape.outMesh"
+        for job, (watched, callback) in sorted(self.script_jobs.items()):
+            if watched == attribute:
+                del self.script_jobs[job]
+                callback()
+
+    def _unique_name(self, name):
+        base = name.rstrip("0123456789") or name
+        index = self._name_counters.get(base, 1)
+        while name in self.nodes:
+            name = "{}{}".format(base, index)
+            index += 1
+        self._name_counters[base] = index
+        return name
+
+    def _node(self, name):
+        if isinstance(name, (list, tuple)):
+            name = name[0]
+        try:
+            return self.nodes[name]
+        except KeyError:
+            raise ValueError("No object matches name: {}".format(name))
+
+    def _world_matrix(self, name):
+        """Returns the flat world matrix of a node, its parents' included"""
+        node = self._node(name)
+        matrix = np.reshape(node.matrix(), (4, 4))
+        while node.parent in self.nodes:
+            node = self.nodes[node.parent]
+            matrix = matrix.dot(np.reshape(node.matrix(), (4, 4)))
+        return matrix.ravel().tolist()
+
+    def _set_world_matrix(self, name, values):
+        matrix = np.reshape(values, (4, 4)).astype(np.float64)
+        parent = self._node(name).parent
+        if parent in self.nodes:
+            matrix = matrix.dot(np.linalg.inv(
+                np.reshape(self._world_matrix(parent), (4, 4))))
+        self._node(name).set_matrix(matrix.ravel().tolist())
+
+    def _bounding_box(self, name):
+        points = self._node(name).points or [(-0.5, -0.5, -0.5), (0.5, 0.5, 0.5)]
+        return ([min(point[axis] for point in points) for axis in range(3)] +
+                [max(point[axis] for point in points) for axis in range(3)])
+
+    def _component_points(self, component):
+        match = COMPONENT_RE.match(component)
+        if not match:
+            raise ValueError("Not a vertex component: {}".format(component))
+        points = self._node(match.group("node")).points
+        if match.group("start") == "*":
+            return points
+        start = int(match.group("start"))
+        end = int(match.group("end") or start)
+        return points[start:end + 1]
+
+    # maya.cmds
+
+    def ls(self, *args, **kwargs):
+        if kwargs.get("selection"):
+            return list(self.selection)
+        if args:
+            names = [args[0]] if isinstance(args[0], str) else args[0]
+            return [name for name in names if name in self.nodes]
+        return list(self.nodes)
+
+    def group(self, *args, **kwargs):
+        node = FakeNode(self._unique_name(kwargs.get("name", "group1")))
+        self.nodes[node.name] = node
+        return node.name
+
+    def parent(self, names, parent, **kwargs):
+        names = [names] if isinstance(names, str) else names
+        for name in names:
+            world = self._world_matrix(name)
+            self._node(name).parent = parent
+            if not kwargs.get("relative"):
+                self._set_world_matrix(name, world)
+        return list(names)
+
+    def select(self, *args, **kwargs):
+        self.selection = list(args[0]) if args else []
+
+    def objExists(self, name):
+        return name in self.nodes
+
+    def instance(self, node, **kwargs):
+        source = self._node(node)
+        copy = FakeNode(self._unique_name(kwargs.get("name", source.name)))
+        copy.translate = list(source.translate)
+        copy.rotate = list(source.rotate)
+        copy.scale = list(source.scale)
+        copy.parent = source.parent
+        self.nodes[copy.name] = copy
+        return [copy.name]
+
+    def delete(self, *names):
+        deleted = set()
+        for name in names:
+            deleted.update([name] if isinstance(name, str) else name)
+        for single in deleted:
+            self.nodes.pop(single, None)
+        for child in [node.name for node in self.nodes.values()
+                      if node.parent in deleted]:
+            self.nodes.pop(child)
+
+    def move(self, x, y, z, name, **kwargs):
+        self._node(name).translate = [x, y, z]
+
+    def rotate(self, x, y, z, name, **kwargs):
+        self._node(name).rotate = [x, y, z]
+
+    def scale(self, x, y, z, name, **kwargs):
+        self._node(name).scale = [x, y, z]
+
+    def xform(self, *names, **kwargs):
+        if kwargs.get("query") or kwargs.get("q"):
+            values = []
+            for name in names:
+                for single in ([name] if isinstance(name, str) else name):
+                    if ".vtx[" in single:
+                        for point in self._component_points(single):
+                            values.extend(point)
+                    elif kwargs.get("matrix") and kwargs.get("worldSpace"):
+                        values.extend(self._world_matrix(single))
+                    elif kwargs.get("matrix"):
+                        values.extend(self._node(single).matrix())
+                    elif kwargs.get("boundingBox"):
+                        values.extend(self._bounding_box(single))
+                    else:
+                        values.extend(self._node(single).translate)
+            return values
+        for name in names:
+            if "matrix" in kwargs and kwargs.get("worldSpace"):
+                self._set_world_matrix(name, kwargs["matrix"])
+            elif "matrix" in kwargs:
+                self._node(name).set_matrix(kwargs["matrix"])
+            if "translation" in kwargs:
+                self._node(name).translate = list(kwargs["translation"])
+
+    def getAttr(self, attribute, **kwargs):
+        name, attr = attribute.split(".", 1)
+        node = self._node(name)
+        if attr in node.arrays:
+            return [tuple(value) for value in node.arrays[attr]]
+        if attr in node.attributes:
+            value = node.attributes[attr]
+            if isinstance(value, dict):
+                frame = kwargs.get("time", min(value))
+                value = value[max([key for key in value if key <= frame] or
+                                  [min(value)])]
+            return value
+        if attr == "worldMatrix":
+            return self._world_matrix(name)
+        axis = "XYZ".index(attr[-1])
+        if attr.startswith("translate"):
+            return node.translate[axis]
+        if attr.startswith("rotate"):
+            return node.rotate[axis]
+        if attr.startswith("scale"):
+            return node.scale[axis]
+        raise ValueError("Unknown attribute: {}".format(attribute))
+
+    def setAttr(self, attribute, *args, **kwargs):
+        name, attr = attribute.split(".", 1)
+        node = self._node(name)
+        if kwargs.get("type") == "vectorArray":
+            node.arrays[attr] = [list(value) for value in args[1:]]
+            return
+        raise ValueError("Unsupported setAttr: {}".format(attribute))
+
+    def addAttr(self, name, **kwargs):
+        self._node(name).arrays.setdefault(kwargs["longName"], [])
+
+    def particle(self, **kwargs):
+        transform = FakeNode(self._unique_name(kwargs.get("name", "particle1")))
+        shape = FakeNode(transform.name + "Shape", node_type="particle")
+        shape.parent = transform.name
+        shape.arrays["position"] = [list(point) for point in kwargs["position"]]
+        self.nodes[transform.name] = transform
+        self.nodes[shape.name] = shape
+        return [transform.name, shape.name]
+
+    def saveInitialState(self, name, **kwargs):
+        node = self._node(name)
+        for attr in list(node.arrays):
+            if attr + "0" in node.arrays:
+                node.arrays[attr + "0"] = [list(value) for value in node.arrays[attr]]
+
+    def particleInstancer(self, name, **kwargs):
+        if kwargs.get("query"):
+            return list(self._node(kwargs["name"]).attributes["objects"])
+        instancer = FakeNode(self._unique_name("instancer1"), node_type="instancer")
+        instancer.attributes["objects"] = [kwargs["object"]]
+        instancer.connections.append(name)
+        self._node(name).connections.append(instancer.name)
+        self.nodes[instancer.name] = instancer
+        return instancer.name
+
+    def listConnections(self, name, **kwargs):
+        connections = [connection for connection in self._node(name).connections
+                       if connection in self.nodes]
+        if "type" in kwargs:
+            connections = [connection for connection in connections
+                           if self.nodes[connection].node_type == kwargs["type"]]
+        return connections or None
+
+    def undoInfo(self, **kwargs):
+        if kwargs.get("openChunk"):
+            self.undo_chunks.append(kwargs.get("chunkName", ""))
+        elif kwargs.get("closeChunk"):
+            self.undo_chunks.pop()
+
+    def refresh(self, **kwargs):
+        if "suspend" in kwargs:
+            self.refresh_suspended = kwargs["suspend"]
+
+    def polyListComponentConversion(self, selection, **kwargs):
+        components = []
+        for name in selection:
+            if ".vtx[" in name:
+                components.append(name)
+            elif self._node(name).points is not None:
+                components.append("{}.vtx[0:{}]".format(
+                    name, len(self._node(name).points) - 1))
+        return components
+
+    def listRelatives(self, name, **kwargs):
+        if isinstance(name, (list, tuple)):
+            name = name[0]
+        if kwargs.get("parent"):
+            parent = self._node(name).parent
+            return [parent] if parent else None
+        if kwargs.get("shapes"):
+            shape = self.nodes.get(name + "Shape")
+            if shape is not None and kwargs.get("type") in (None, shape.node_type):
+                return [shape.name]
+            if self._node(name).points is not None and not kwargs.get("type"):
+                return [name + "Shape"]
+        return None
+
+    def polyEvaluate(self, name, **kwargs):
+        if kwargs.get("vertex"):
+            return len(self._node(name).points)
+        raise ValueError("Unsupported polyEvaluate query")
+
+    def scriptJob(self, **kwargs):
+        if "kill" in kwargs:
+            if kwargs["kill"] not in self.script_jobs:
+                raise RuntimeError("No script job {}".format(kwargs["kill"]))
+            del self.script_jobs[kwargs["kill"]]
+            return None
+        if "exists" in kwargs:
+            return kwargs["exists"] in self.script_jobs
+        self._script_job_count += 1
+        self.script_jobs[self._script_job_count] = tuple(
+            kwargs["attributeChange"])
+        return self._script_job_count
+
+    def pointPosition(self, component, **kwargs):
+        return list(self._component_points(component)[0])
+
+    def workspace(self, *args, **kwargs):
+        return self.workspace_root
+
+
+def _busy_wait(seconds):
+    end = time.perf_counter() + seconds
+    while time.perf_counter() < end:
+        pass
+
+
+def _counted(name, function):
+    """Wraps a fake command so it is counted and costs cmds.call_overhead"""
+
+    @functools.wraps(function)
+    def command(*args, **kwargs):
+        cmds.call_counts[name] += 1
+        if cmds.call_overhead:
+            _busy_wait(cmds.call_overhead)
+        return function(*args, **kwargs)
+    return command
+
+
+for _name, _function in list(vars(FakeCmds).items()):
+    if (callable(_function) and not _name.startswith("_") and
+            _name not in FakeCmds.helpers):
+        setattr(FakeCmds, _name, _counted(_name, _function))
+
+
+class FakePath(str):
+    """The parts of pymel's Path the tools use, on the real file system"""
+
+    def __truediv__(self, other):
+        return FakePath(os.path.join(self, other))
+
+    __div__ = __truediv__
+
+    @property
+    def name(self):
+        return FakePath(os.path.basename(self))
+
+    @property
+    def parent(self):
+        return FakePath(os.path.dirname(self))
+
+    @property
+    def ext(self):
+        return os.path.splitext(self)[1]
+
+    def stripext(self):
+        return FakePath(os.path.splitext(self)[0])
+
+    def fnmatch(self, pattern):
+        return fnmatch.fnmatch(self.name, pattern)
+
+    def exists(self):
+        return os.path.exists(self)
+
+    def files(self, pattern=None):
+        return [self / name for name in os.listdir(self)
+                if os.path.isfile(os.path.join(self, name)) and
+                (pattern is None or fnmatch.fnmatch(name, pattern))]
+
+    def makedirs_p(self):
+        if not os.path.isdir(self):
+            os.makedirs(self)
+        return self
+
+
+def _scene_name():
+    return FakePath(cmds.scene_name)
+
+
+def _save_as(path, **kwargs):
+    """Writes an empty scene file, or fails like Maya when its folder is missing"""
+    path = FakePath(path)
+    if not os.path.isdir(path.parent):
+        raise RuntimeError("Folder does not exist: {}".format(path.parent))
+    open(path, "w").close()
+    cmds.scene_name = str(path)
+    return path
+
+
+def _rename_file(path, **kwargs):
+    cmds.scene_name = str(path)
+    return FakePath(path)
+
+
+class MVector(object):
+
+    def __init__(self, x=0.0, y=0.0, z=0.0):
+        self.x, self.y, self.z = x, y, z
+
+
+class MColor(object):
+
+    def __init__(self, r=0.0, g=0.0, b=0.0, a=1.0):
+        self.r, self.g, self.b, self.a = r, g, b, a
+
+
+class MImage(object):
+    """Reads the pixels registered with FakeCmds.add_image
+
+    pixels returns the address of the pixel data like Maya's does, valid
+    while the image lives.
+    """
+    kUnknown = 0
+    kByte = 1
+    kFloat = 2
+
+    def __init__(self):
+        self._pixels = None
+
+    def readFromFile(self, path, pixelType=kByte):
+        self._pixels = np.ascontiguousarray(cmds.images[path])
+        return self
+
+    def getSize(self):
+        height, width = self._pixels.shape[:2]
+        return [width, height]
+
+    def pixelType(self):
+        return self.kFloat if self._pixels.dtype == np.float32 else self.kByte
+
+    def pixels(self):
+        return self._pixels.ctypes.data
+
+
+class MSpace(object):
+    kObject = 2
+    kWorld = 4
+
+
+class MSelectionList(object):
+
+    def __init__(self):
+        self._names = []
+
+    def add(self, name):
+        cmds._node(name)
+        self._names.append(name)
+        return self
+
+    def getDagPath(self, index):
+        return self._names[index]
+
+
+class MFnMesh(object):
+    """Reads the mesh data of a fake mesh node"""
+
+    def __init__(self, dag_path):
+        self._node = cmds._node(dag_path)
+
+    @property
+    def numVertices(self):
+        return len(self._node.points)
+
+    def getVertexNormals(self, angle_weighted, space=MSpace.kObject):
+        normals = self._node.normals or [(0.0, 1.0, 0.0)] * len(self._node.points)
+        return [MVector(*normal) for normal in normals]
+
+    def getTriangles(self):
+        triangles = self._node.triangles or []
+        return ([1] * len(triangles),
+                [vertex_id for triangle in triangles for vertex_id in triangle])
+
+    def getVertices(self):
+        """Faces are the triangles, one face per triangle"""
+        triangles = self._node.triangles or []
+        return ([3] * len(triangles),
+                [vertex_id for triangle in triangles for vertex_id in triangle])
+
+    def getVertexColors(self, colorSet=""):
+        colors = self._node.arrays.get("vertexColors")
+        if colors is None:
+            return [MColor(-1.0, -1.0, -1.0, -1.0)] * len(self._node.points)
+        return [MColor(*color) for color in colors]
+
+    def getUVs(self, uvSet=""):
+        uvs = self._node.arrays.get("uvs", [])
+        return [uv[0] for uv in uvs], [uv[1] for uv in uvs]
+
+    def getAssignedUVs(self, uvSet=""):
+        if "uvs" not in self._node.arrays:
+            return [0] * len(self._node.triangles or []), []
+        return self.getVertices()
+
+
+def _stub_module(name, **attributes):
+    module = types.ModuleType(name)
+    module.__dict__.update(attributes)
+    return module
+
+
+class _QtStubType(type):
+    """Lets class level attributes such as QtCore.Qt.DisplayRole resolve"""
+
+    def __getattr__(cls, name):
+        if name.startswith("__"):
+            raise AttributeError(name)
+        return _QtStub
+
+
+class _QtStubBase(object):
+    """Accepts any construction, call or attribute access"""
+
+    def __init__(self, *args, **kwargs):
+        pass
+
+    def __call__(self, *args, **kwargs):
+        if len(args) == 1 and callable(args[0]) and not kwargs:
+            return args[0]
+        return _QtStub()
+
+    def __getattr__(self, name):
+        if name.startswith("__"):
+            raise AttributeError(name)
+        return _QtStub()
+
+
+_QtStub = _QtStubType("_QtStub", (_QtStubBase,), {})
+
+
+class _QtModule(types.ModuleType):
+
+    def __getattr__(self, name):
+        if name.startswith("__"):
+            raise AttributeError(name)
+        return _QtStub
+
+
+cmds = FakeCmds()
+
+
+def install():
+    """Registers the fake maya, PySide2 and pymel modules in sys.modules"""
+    maya = _stub_module("maya", cmds=cmds)
+    maya.OpenMayaUI = _stub_module("maya.OpenMayaUI", MQtUtil=_QtStub())
+    maya.api = _stub_module("maya.api")
+    maya.api.OpenMaya = _stub_module(
+        "maya.api.OpenMaya", MVector=MVector, MSpace=MSpace,
+        MSelectionList=MSelectionList, MFnMesh=MFnMesh, MColor=MColor,
+        MImage=MImage)
+    qt_widgets = _QtModule("PySide2.QtWidgets")
+    qt_core = _QtModule("PySide2.QtCore")
+    qt_gui = _QtModule("PySide2.QtGui")
+    pyside = _stub_module("PySide2", QtWidgets=qt_widgets, QtCore=qt_core,
+                          QtGui=qt_gui)
+    pymel = _stub_module("pymel")
+    pymel.core = _stub_module("pymel.core")
+    pymel.core.system = _stub_module(
+        "pymel.core.system", Path=FakePath,
+        sceneName=_counted("sceneName", _scene_name),
+        saveAs=_counted("saveAs", _save_as),
+        renameFile=_counted("renameFile", _rename_file))
+    sys.modules.update({
+        "maya": maya,
+        "maya.cmds": cmds,
+        "maya.OpenMayaUI": maya.OpenMayaUI,
+        "maya.api": maya.api,
+        "maya.api.OpenMaya": maya.api.OpenMaya,
+        "PySide2": pyside,
+        "PySide2.QtWidgets": qt_widgets,
+        "PySide2.QtCore": qt_core,
+        "PySide2.QtGui": qt_gui,
+        "shiboken2": _stub_module("shiboken2", wrapInstance=_QtStub()),
+        "pymel": pymel,
+        "pymel.core": pymel.core,
+        "pymel.core.system": pymel.core.system,
+    })
+    return cmds
@@ -0,0 +1,40 @@
+"""File system helpers shared by the scene saving modules
+
+Nothing here imports Maya.
+"""
+import os
+
+try:
+    from os import scandir
+except ImportError:  # Python 2 based Maya versions
+    scandir = None
+
+# os.replace renames over an existing file on Windows too, Python 2 has none
+replace = getattr(os, "replace", os.rename)
+
+# A folder changed this soon before it was listed may change again without
+# its mtime changing on file systems with coarse timestamps, so a listing
+# of such a folder is not trusted for a second lookup
+RACY_SECONDS = 2.0
+
+
+def dotted(ext):
+    """Returns a file extension with its leading dot, an empty one as it is"""
+    return ext if not ext or ext.startswith(".") else "." + ext
+
+
+def list_folder(folder):
+    """Returns the file and folder names in folder"""
+    files = []
+    subfolders = []
+    if scandir is None:
+        for name in os.listdir(folder):
+            is_dir = os.path.isdir(os.path.join(folder, name))
+            (subfolders if is_dir else files).append(name)
+        return files, subfolders
+    for entry in scandir(folder):
+        if entry.is_dir(follow_symlinks=False):
+            subfolders.append(entry.name)
+        elif entry.is_file():
+            files.append(entry.name)
+    return files, subfolders
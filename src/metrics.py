@@ -0,0 +1,277 @@
+"""Times the phases of save and scatter operations and counts what they did
+
+An operation, a save or a scatter, collects a Record while it runs:
+
+    with metrics.operation("save", folder=folder):
+        with metrics.phase("write"):
+            ...
+        metrics.count("bytes_written", size)
+
+Phases of the same name add up, so a phase entered once per instance
+reports its total, and a phase's time includes the phases inside it. An
+operation started inside another one on the same thread adds to the
+outer one instead of writing a record of its own.
+
+When the outermost operation ends its record is written as one JSON line
+to a file rotated by logging.handlers.RotatingFileHandler:
+
+    {"operation": "save", "time": ..., "seconds": 1.52, "host": ...,
+     "user": ..., "phases": {"write": 1.31, ...},
+     "counters": {"bytes_written": 81234567}, "folder": ...}
+
+Metrics are off until enable is called, or the SFA_METRICS environment
+variable names the file when this module is imported. While off every
+call returns at once after one check of a global, and operation and
+phase return a shared do nothing context.
+"""
+import getpass
+import json
+import logging
+import logging.handlers
+import os
+import platform
+import threading
+import time
+
+log = logging.getLogger(__name__)
+
+ENV_VAR = "SFA_METRICS"
+MAX_BYTES = 10 << 20
+BACKUP_COUNT = 5
+
+_clock = getattr(time, "perf_counter", time.time)
+
+_enabled = False
+_local = threading.local()
+_records = logging.getLogger(__name__ + ".records")
+_records.propagate = False
+_records.setLevel(logging.INFO)
+
+
+class Record(object):
+    """What one operation took and did
+
+    Attributes:
+        name (str): the operation, such as "save" or "scatter"
+        fields (dict): extra values written with the record
+        phases (dict): phase name to total seconds
+        counters (dict): counter name to total
+        started (float): time.time() when the operation started
+        seconds (float): how long the operation took, once it ended
+    """
+
+    def __init__(self, name, fields=None):
+        self.name = name
+        self.fields = dict(fields or {})
+        self.phases = {}
+        self.counters = {}
+        self.started = time.time()
+        self.seconds = None
+        self._start = _clock()
+
+    def add_time(self, name, seconds):
+        self.phases[name] = self.phases.get(name, 0.0) + seconds
+
+    def add_count(self, name, value):
+        self.counters[name] = self.counters.get(name, 0) + value
+
+    def end(self):
+        self.seconds = _clock() - self._start
+
+    def as_dict(self):
+        data = {"operation": self.name,
+                "time": time.strftime("%Y-%m-%dT%H:%M:%S",
+                                      time.localtime(self.started)),
+                "seconds": self.seconds, "host": platform.node(),
+                "user": _user(), "phases": self.phases,
+                "counters": self.counters}
+        data.update(self.fields)
+        return data
+
+
+class CountedCommands(object):
+    """Stands in for maya.cmds and counts the commands called as cmds_calls
+
+    While metrics are off a command is handed out as it is.
+    """
+
+    def __init__(self, commands):
+        self._commands = commands
+
+    def __getattr__(self, name):
+        command = getattr(self._commands, name)
+        if not _enabled or not callable(command):
+            return command
+
+        def counted(*args, **kwargs):
+            count("cmds_calls")
+            return command(*args, **kwargs)
+        return counted
+
+
+class _Nothing(object):
+    """The context of operations and phases while metrics are off"""
+    __slots__ = ()
+
+    def __enter__(self):
+        return None
+
+    def __exit__(self, *exc_info):
+        return False
+
+
+_NOTHING = _Nothing()
+
+
+class _Operation(object):
+    __slots__ = ("name", "fields", "record")
+
+    def __init__(self, name, fields):
+        self.name = name
+        self.fields = fields
+        self.record = None
+
+    def __enter__(self):
+        stack = _stack()
+        if stack:
+            stack[-1].fields.update(self.fields)
+            return stack[-1]
+        self.record = Record(self.name, self.fields)
+        stack.append(self.record)
+        return self.record
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if self.record is None:
+            return False
+        _stack().pop()
+        self.record.end()
+        if exc_type is not None:
+            self.record.fields["error"] = exc_type.__name__
+        write(self.record)
+        return False
+
+
+class _Phase(object):
+    __slots__ = ("record", "name", "start")
+
+    def __init__(self, record, name):
+        self.record = record
+        self.name = name
+        self.start = None
+
+    def __enter__(self):
+        self.start = _clock()
+
+    def __exit__(self, *exc_info):
+        self.record.add_time(self.name, _clock() - self.start)
+        return False
+
+
+def enable(path=None, max_bytes=MAX_BYTES, backup_count=BACKUP_COUNT):
+    """Starts writing records to path, by default the one in SFA_METRICS
+
+    Args:
+        path (str): the JSON lines file, kept below max_bytes by rotating
+            it to backup_count numbered backups
+    """
+    global _enabled
+    path = path or os.environ.get(ENV_VAR)
+    if not path:
+        raise ValueError("No metrics file given and {} is not set".format(
+            ENV_VAR))
+    folder = os.path.dirname(os.path.abspath(path))
+    if not os.path.isdir(folder):
+        os.makedirs(folder)
+    disable()
+    handler = logging.handlers.RotatingFileHandler(
+        path, maxBytes=max_bytes, backupCount=backup_count, delay=True)
+    handler.setFormatter(logging.Formatter("%(message)s"))
+    _records.addHandler(handler)
+    _enabled = True
+    log.info("Writing metrics to %s", path)
+
+
+def disable():
+    """Stops collecting records and closes the file"""
+    global _enabled
+    _enabled = False
+    for handler in list(_records.handlers):
+        _records.removeHandler(handler)
+        handler.close()
+
+
+def enabled():
+    return _enabled
+
+
+def operation(name, **fields):
+    """Returns a context collecting the Record of an operation
+
+    Args:
+        name (str): the operation
+        fields: extra values to write with the record, such as the folder
+            saved to
+    """
+    if not _enabled:
+        return _NOTHING
+    return _Operation(name, fields)
+
+
+def phase(name):
+    """Returns a context timing a phase of the current operation"""
+    if not _enabled:
+        return _NOTHING
+    stack = _stack()
+    if not stack:
+        return _NOTHING
+    return _Phase(stack[-1], name)
+
+
+def count(name, value=1):
+    """Adds value to a counter of the current operation"""
+    if not _enabled:
+        return
+    stack = _stack()
+    if stack:
+        stack[-1].add_count(name, value)
+
+
+def annotate(**fields):
+    """Adds values to write with the record of the current operation"""
+    if not _enabled:
+        return
+    stack = _stack()
+    if stack:
+        stack[-1].fields.update(fields)
+
+
+def write(record):
+    """Writes a record as one JSON line, a failed write is logged"""
+    try:
+        _records.info(json.dumps(record.as_dict(), sort_keys=True,
+                                 default=str))
+    except (TypeError, ValueError) as err:
+        log.warning("Could not write metrics of %s: %s", record.name, err)
+
+
+def _stack():
+    try:
+        return _local.records
+    except AttributeError:
+        _local.records = []
+        return _local.records
+
+
+def _user():
+    try:
+        return getpass.getuser()
+    except Exception:  # no user name in the environment
+        return None
+
+
+if os.environ.get(ENV_VAR):
+    try:
+        enable()
+    except (IOError, OSError) as err:
+        log.warning("Could not write metrics to %s: %s",
+                    os.environ[ENV_VAR], err)
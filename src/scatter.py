@@ -1,11 +1,40 @@
-from PySide2 import QtWidgets, QtCore
+from PySide2 import QtWidgets, QtCore, QtGui
 from shiboken2 import wrapInstance
 import maya.OpenMayaUI as omui
-import maya.cmds as cmds
-import pymel.core as pmc
-import random
+from maya import cmds as maya_cmds
+import maya.api.OpenMaya as om
+import ctypes
+import logging
+import multiprocessing
+import os
+import time
+from contextlib import contextmanager
+from functools import partial
 
-random.seed(1234)
+import numpy as np
+
+import metrics
+import scattercache
+import scattercore
+import scattercull
+import scatterpool
+import scattersample
+
+log = logging.getLogger(__name__)
+
+# Counts the commands of every scatter while metrics are on
+cmds = metrics.CountedCommands(maya_cmds)
+
+OUTPUT_TRANSFORMS = "transforms"
+OUTPUT_INSTANCER = "instancer"
+DISTRIBUTE_VERTICES = "vertices"
+DISTRIBUTE_SURFACE = "surface"
+DENSITY_NONE = "none"
+DENSITY_VERTEX_COLOR = "vertex color"
+DENSITY_TEXTURE = "texture"
+
+# Rec. 709 weights that turn a color into the brightness density is read from
+_LUMINANCE = np.array([0.2126, 0.7152, 0.0722])
 
 
 def maya_main_window():
@@ -14,6 +43,32 @@ def maya_main_window():
     return wrapInstance(long(main_window), QtWidgets.QWidget)
 
 
+@contextmanager
+def undo_chunk(name):
+    """Records every command run inside as one undo step and pauses viewport refresh"""
+    cmds.undoInfo(openChunk=True, chunkName=name)
+    cmds.refresh(suspend=True)
+    try:
+        yield
+    finally:
+        cmds.refresh(suspend=False)
+        cmds.undoInfo(closeChunk=True)
+
+
+def check_sources(sources):
+    """Checks (name, weight) sources can be picked from, see ScatterTool.sources
+
+    Raises:
+        ValueError: if a weight is negative or not finite, or all are 0
+    """
+    for name, weight in sources:
+        if not np.isfinite(weight) or weight < 0:
+            raise ValueError("The weight of {} must be a number from 0 up, "
+                             "not {}".format(name, weight))
+    if sources and not sum(weight for _, weight in sources) > 0:
+        raise ValueError("At least one variant needs a weight above 0")
+
+
 class ScatterUI(QtWidgets.QDialog):
     """Scatter UI Class"""
 
@@ -26,74 +81,197 @@ class ScatterUI(QtWidgets.QDialog):
         self.create_ui()
         self.create_connections()
 
+    def closeEvent(self, event):
+        """Stops the worker processes of parallel scatters with the window"""
+        self.scattertool.close_pool()
+        super(ScatterUI, self).closeEvent(event)
+
+    def done(self, result):
+        self.scattertool.close_pool()
+        super(ScatterUI, self).done(result)
+
     def create_ui(self):
         self.title_lbl = QtWidgets.QLabel("Scatter Tool")
         self.title_lbl.setStyleSheet("font: bold 20px")
         self.header_lay = self._create_headers()
         self.percent_lay = self._percent_vertices_ui()
         self.normal_lay = self._normal_checkbox_ui()
+        self.overlap_lay = self._overlap_ui()
+        self.camera_lay = self._camera_ui()
+        self.density_lay = self._density_ui()
+        self.variants_lay = self._variants_ui()
+        self.output_lay = self._output_mode_ui()
+        self.distribution_lay = self._distribution_ui()
         self.line_edit_lay = self._line_edit_ui()
         self.select_btn_lay = self._create_select_buttons()
         self.main_lay = QtWidgets.QVBoxLayout()
         self.main_lay.addWidget(self.title_lbl)
         self.main_lay.addLayout(self.select_btn_lay)
+        self.main_lay.addLayout(self.variants_lay)
         self.main_lay.addLayout(self.percent_lay)
+        self.main_lay.addLayout(self.distribution_lay)
+        self.main_lay.addLayout(self.density_lay)
         self.main_lay.addLayout(self.normal_lay)
+        self.main_lay.addLayout(self.overlap_lay)
+        self.main_lay.addLayout(self.camera_lay)
+        self.main_lay.addLayout(self.output_lay)
         self.scatter_btn = QtWidgets.QPushButton("Scatter")
+        self.bake_btn = QtWidgets.QPushButton("Bake to Transforms")
+        self.progress_lay = self._progress_ui()
+        self.cache_lay = self._cache_ui()
         self.main_lay.addWidget(self.scatter_btn)
+        self.main_lay.addWidget(self.bake_btn)
+        self.main_lay.addLayout(self.cache_lay)
+        self.main_lay.addLayout(self.progress_lay)
         self.setLayout(self.main_lay)
 
     def create_connections(self):
         self.scatter_btn.clicked.connect(self._scatter)
+        self.bake_btn.clicked.connect(self._bake)
+        self.cancel_btn.clicked.connect(self._cancel)
+        self.save_cache_btn.clicked.connect(self._save_cache)
+        self.load_cache_btn.clicked.connect(self._load_cache)
         self.select_what_btn.clicked.connect(self._select_what)
+        self.camera_btn.clicked.connect(self._select_camera)
+        self.add_variants_btn.clicked.connect(self._add_variants)
+        self.remove_variants_btn.clicked.connect(self._remove_variants)
         self.select_where_objects_btn.clicked.connect(self._select_where_object)
         self.select_where_vertices_btn.clicked.connect(self._select_where_vertices)
         self.select_where_obj_vert_btn.clicked.connect(self._select_where_obj_vert)
 
     @QtCore.Slot()
     def _scatter(self):
-        self._set_scattertool_properties_from_ui()
-        self.scattertool.scatter_each()
+        try:
+            self._set_scattertool_properties_from_ui()
+        except ValueError as err:
+            QtWidgets.QMessageBox.warning(self, "Scatter Tool", str(err))
+            return
+        self._cancelled = False
+        self.scatter_btn.setEnabled(False)
+        self.cancel_btn.setEnabled(True)
+        self.progress_bar.setValue(0)
+        try:
+            self.scattertool.scatter_each(progress=self._update_progress)
+        finally:
+            self.scatter_btn.setEnabled(True)
+            self.cancel_btn.setEnabled(False)
+
+    @QtCore.Slot()
+    def _cancel(self):
+        self._cancelled = True
+
+    def _update_progress(self, done, total):
+        """Shows scatter progress and keeps the dialog responsive between chunks
+
+        Returns:
+            bool: False when the user cancelled the scatter
+        """
+        self.progress_bar.setMaximum(total)
+        self.progress_bar.setValue(done)
+        QtWidgets.QApplication.processEvents()
+        return not self._cancelled
+
+    @QtCore.Slot()
+    def _bake(self):
+        self.scattertool.bake_instancer()
+
+    @QtCore.Slot()
+    def _save_cache(self):
+        """Opens a dialog box to save the last scatter to a cache file"""
+        path, _ = QtWidgets.QFileDialog.getSaveFileName(
+            parent=self, caption="Save Scatter Cache",
+            filter="Scatter Cache (*.npz)")
+        if not path:
+            return
+        try:
+            self.scattertool.save_cache(path)
+        except (IOError, OSError, ValueError) as err:
+            QtWidgets.QMessageBox.warning(self, "Scatter Tool", str(err))
+
+    @QtCore.Slot()
+    def _load_cache(self):
+        """Opens a dialog box to rebuild a scatter from a cache file
+
+        The settings the cache restored are shown in the window, so the
+        next scatter uses them.
+        """
+        path, _ = QtWidgets.QFileDialog.getOpenFileName(
+            parent=self, caption="Load Scatter Cache",
+            filter="Scatter Cache (*.npz)")
+        if not path:
+            return
+        self.scattertool.output_mode = self.output_cmb.currentData()
+        self._cancelled = False
+        self.scatter_btn.setEnabled(False)
+        self.load_cache_btn.setEnabled(False)
+        self.cancel_btn.setEnabled(True)
+        self.progress_bar.setValue(0)
+        try:
+            self.scattertool.load_cache(path, progress=self._update_progress)
+        except (IOError, OSError, ValueError) as err:
+            QtWidgets.QMessageBox.warning(self, "Scatter Tool", str(err))
+            return
+        finally:
+            self.scatter_btn.setEnabled(True)
+            self.load_cache_btn.setEnabled(True)
+            self.cancel_btn.setEnabled(False)
+        self._set_ui_from_scattertool_properties()
 
     @QtCore.Slot()
     def _select_what(self):
         selected_obj = cmds.ls(selection=True, transforms=True)
         self.scatter_what_le.setText(selected_obj[0])
 
+    @QtCore.Slot()
+    def _add_variants(self):
+        for name in cmds.ls(selection=True, transforms=True):
+            self._add_variant_row(name, 1.0)
+
+    def _add_variant_row(self, name, weight):
+        row = self.variants_tbl.rowCount()
+        self.variants_tbl.insertRow(row)
+        self.variants_tbl.setItem(row, 0, QtWidgets.QTableWidgetItem(name))
+        self.variants_tbl.setItem(row, 1, QtWidgets.QTableWidgetItem(
+            repr(float(weight))))
+
+    @QtCore.Slot()
+    def _remove_variants(self):
+        rows = {index.row() for index in self.variants_tbl.selectedIndexes()}
+        for row in sorted(rows, reverse=True):
+            self.variants_tbl.removeRow(row)
+
+    @QtCore.Slot()
+    def _select_camera(self):
+        selected_obj = cmds.ls(selection=True, transforms=True)
+        self.camera_le.setText(selected_obj[0] if selected_obj else "")
+
     @QtCore.Slot()
     def _select_where_object(self):
         selected_obj = cmds.ls(selection=True, transforms=True)
-        self.scatter_where_lw.clear()
         self.scattertool.vertices_selected = False
-        for sel_obj in selected_obj:
-            self.scatter_where_lw.addItem(sel_obj)
+        self.scatter_where_model.set_targets(selected_obj)
 
     @QtCore.Slot()
     def _select_where_vertices(self):
-        selection = cmds.ls(selection=True, flatten=True)
-        selected_verts = cmds.polyListComponentConversion(selection, toVertex=True)
-        selected_verts = cmds.filterExpand(selected_verts, selectionMask=31)
-        self.scatter_where_lw.clear()
+        with metrics.operation("scatter_select"), \
+                metrics.phase("selection_expansion"):
+            selection = cmds.ls(selection=True)
+            selected_verts = cmds.polyListComponentConversion(selection,
+                                                              toVertex=True)
+            vertex_set = scattercore.VertexSet.from_components(
+                selected_verts, partial(cmds.polyEvaluate, vertex=True))
+            metrics.count("vertices", len(vertex_set))
         self.scattertool.vertices_selected = True
-        for vert in selected_verts:
-            self.scatter_where_lw.addItem(vert)
+        self.scatter_where_model.set_targets(vertex_set)
 
     @QtCore.Slot()
     def _select_where_obj_vert(self):
-        selection = cmds.ls(selection=True, flatten=True)
-        selected_verts = cmds.polyListComponentConversion(selection, toVertex=True)
-        selected_verts = cmds.filterExpand(selected_verts, selectionMask=31)
-        self.scatter_where_lw.clear()
-        self.scatterool.vertices_selected = True
-        for vert in selected_verts:
-            self.scatter_where_lw.addItem(vert)
+        self._select_where_vertices()
 
     def _set_scattertool_properties_from_ui(self):
         self.scattertool.selected_object = self.scatter_what_le.text()
-        items = []
-        for x in range(self.scatter_where_lw.count()):
-            items.append(self.scatter_where_lw.item(x).text())
-        self.scattertool.selected_location = items
+        self.scattertool.sources = self._variant_sources()
+        self.scattertool.selected_location = self.scatter_where_model.targets
         self.scattertool.scale_x_min = self.scale_min_x_btn.value()
         self.scattertool.scale_y_min = self.scale_min_y_btn.value()
         self.scattertool.scale_z_min = self.scale_min_z_btn.value()
@@ -107,7 +285,31 @@ class ScatterUI(QtWidgets.QDialog):
         self.scattertool.rotation_y_max = self.rotation_max_y_btn.value()
         self.scattertool.rotation_z_max = self.rotation_max_z_btn.value()
         self.scattertool.normal_aligned = self.normal_chbx.isChecked()
+        self.scattertool.avoid_overlaps = self.overlap_chbx.isChecked()
+        self.scattertool.overlap_retries = self.overlap_retries_sbx.value()
+        self.scattertool.camera = self.camera_le.text() or None
+        self.scattertool.frame_range = None
+        if self.frame_range_chbx.isChecked():
+            self.scattertool.frame_range = (self.frame_start_sbx.value(),
+                                            self.frame_end_sbx.value())
+        self.scattertool.camera_margin = self.camera_margin_sbx.value()
+        self.scattertool.thin_distance = self.thin_distance_sbx.value()
+        self.scattertool.proxy_object = self.proxy_le.text() or None
+        self.scattertool.proxy_distance = self.proxy_distance_sbx.value()
         self.scattertool.percent_to_scatter = self.percent_sbx.value()
+        self.scattertool.seed = self.seed_sbx.value()
+        self.scattertool.workers = self.workers_sbx.value()
+        self.scattertool.output_mode = self.output_cmb.currentData()
+        self.scattertool.distribution = self.distribution_cmb.currentData()
+        self.scattertool.surface_count = self.surface_count_sbx.value()
+        self.scattertool.min_spacing = self.min_spacing_sbx.value()
+        self.scattertool.density_mode = self.density_cmb.currentData()
+        if self.scattertool.density_mode == DENSITY_TEXTURE:
+            self.scattertool.density_texture = self.density_source_le.text()
+            self.scattertool.density_uv_set = self.density_set_le.text()
+        else:
+            self.scattertool.density_color_set = self.density_set_le.text()
+        self.scattertool.density_scale = self.density_scale_chbx.isChecked()
         self.scattertool.location_x_max = self.location_max_x_btn.value()
         self.scattertool.location_y_max = self.location_max_y_btn.value()
         self.scattertool.location_z_max = self.location_max_z_btn.value()
@@ -115,12 +317,94 @@ class ScatterUI(QtWidgets.QDialog):
         self.scattertool.location_y_min = self.location_min_y_btn.value()
         self.scattertool.location_z_min = self.location_min_z_btn.value()
 
+    def _set_ui_from_scattertool_properties(self):
+        """Shows the settings of the scatter tool, such as a loaded cache's"""
+        tool = self.scattertool
+        for kind in ("scale", "rotation", "location"):
+            for bound in ("min", "max"):
+                for axis in "xyz":
+                    spin_box = getattr(
+                        self, "{}_{}_{}_btn".format(kind, bound, axis))
+                    spin_box.setValue(
+                        getattr(tool, "{}_{}_{}".format(kind, axis, bound)))
+        self.variants_tbl.setRowCount(0)
+        for name, weight in tool.sources:
+            self._add_variant_row(name, weight)
+        self.normal_chbx.setChecked(tool.normal_aligned)
+        self.overlap_chbx.setChecked(tool.avoid_overlaps)
+        self.overlap_retries_sbx.setValue(tool.overlap_retries)
+        self.camera_le.setText(tool.camera or "")
+        self.frame_range_chbx.setChecked(tool.frame_range is not None)
+        if tool.frame_range is not None:
+            self.frame_start_sbx.setValue(int(tool.frame_range[0]))
+            self.frame_end_sbx.setValue(int(tool.frame_range[1]))
+        self.camera_margin_sbx.setValue(tool.camera_margin)
+        self.thin_distance_sbx.setValue(tool.thin_distance)
+        self.proxy_le.setText(tool.proxy_object or "")
+        self.proxy_distance_sbx.setValue(tool.proxy_distance)
+        self.percent_sbx.setValue(int(tool.percent_to_scatter))
+        self.seed_sbx.setValue(int(tool.seed))
+        self.distribution_cmb.setCurrentIndex(
+            self.distribution_cmb.findData(tool.distribution))
+        self.surface_count_sbx.setValue(int(tool.surface_count))
+        self.min_spacing_sbx.setValue(tool.min_spacing)
+        self.density_cmb.setCurrentIndex(
+            self.density_cmb.findData(tool.density_mode))
+        if tool.density_mode == DENSITY_TEXTURE:
+            self.density_source_le.setText(tool.density_texture)
+            self.density_set_le.setText(tool.density_uv_set)
+        else:
+            self.density_set_le.setText(tool.density_color_set)
+        self.density_scale_chbx.setChecked(tool.density_scale)
+
+    def _variant_sources(self):
+        """Returns the (name, weight) rows of the variants table
+
+        Raises:
+            ValueError: if a weight is not a number, is negative or all
+                weights are 0
+        """
+        sources = []
+        for row in range(self.variants_tbl.rowCount()):
+            name = self.variants_tbl.item(row, 0).text()
+            text = self.variants_tbl.item(row, 1).text().strip()
+            try:
+                weight = float(text or 0)
+            except ValueError:
+                raise ValueError("The weight of {} is not a number: {!r}".format(
+                    name, text))
+            sources.append((name, weight))
+        check_sources(sources)
+        return sources
+
     def _line_edit_ui(self):
         self.scatter_what_le = QtWidgets.QLineEdit("Object to scatter")
-        self.scatter_where_lw = QtWidgets.QListWidget()
+        self.scatter_where_model = TargetListModel()
+        self.scatter_where_lv = QtWidgets.QListView()
+        self.scatter_where_lv.setUniformItemSizes(True)
+        self.scatter_where_lv.setModel(self.scatter_where_model)
         layout = self._create_headers()
         layout.addWidget(self.scatter_what_le, 0, 1)
-        layout.addWidget(self.scatter_where_lw, 1, 1)
+        layout.addWidget(self.scatter_where_lv, 1, 1)
+        return layout
+
+    def _variants_ui(self):
+        self.variants_header_lbl = QtWidgets.QLabel("Variants")
+        self.variants_header_lbl.setStyleSheet("font: bold")
+        self.variants_tbl = QtWidgets.QTableWidget(0, 2)
+        self.variants_tbl.setHorizontalHeaderLabels(["Object", "Weight"])
+        self.variants_tbl.setItemDelegateForColumn(
+            1, WeightDelegate(self.variants_tbl))
+        self.add_variants_btn = QtWidgets.QPushButton("Add Selected")
+        self.remove_variants_btn = QtWidgets.QPushButton("Remove")
+        button_lay = QtWidgets.QVBoxLayout()
+        button_lay.addWidget(self.add_variants_btn)
+        button_lay.addWidget(self.remove_variants_btn)
+        button_lay.addStretch()
+        layout = QtWidgets.QHBoxLayout()
+        layout.addWidget(self.variants_header_lbl)
+        layout.addWidget(self.variants_tbl)
+        layout.addLayout(button_lay)
         return layout
 
     def _percent_vertices_ui(self):
@@ -128,8 +412,23 @@ class ScatterUI(QtWidgets.QDialog):
         self.percent_lbl.setStyleSheet("font: bold")
         self.percent_sbx = QtWidgets.QSpinBox()
         self.percent_sbx.setRange(1, 100)
+        self.seed_lbl = QtWidgets.QLabel("Seed")
+        self.seed_lbl.setStyleSheet("font: bold")
+        self.seed_sbx = QtWidgets.QSpinBox()
+        self.seed_sbx.setRange(0, 999999)
+        self.seed_sbx.setValue(self.scattertool.seed)
+        self.workers_lbl = QtWidgets.QLabel("Workers")
+        self.workers_lbl.setStyleSheet("font: bold")
+        self.workers_sbx = QtWidgets.QSpinBox()
+        self.workers_sbx.setRange(1, 4 * multiprocessing.cpu_count())
+        self.workers_sbx.setValue(self.scattertool.workers)
+        self.workers_sbx.setToolTip(
+            "Processes computing the instance matrices of scatters of at "
+            "least {} instances".format(self.scattertool.parallel_min_count))
         layout = QtWidgets.QFormLayout()
         layout.addRow(self.percent_lbl, self.percent_sbx)
+        layout.addRow(self.seed_lbl, self.seed_sbx)
+        layout.addRow(self.workers_lbl, self.workers_sbx)
         return layout
 
     def _normal_checkbox_ui(self):
@@ -140,6 +439,127 @@ class ScatterUI(QtWidgets.QDialog):
         layout.addRow(self.normal_header_lbl, self.normal_chbx)
         return layout
 
+    def _overlap_ui(self):
+        self.overlap_header_lbl = QtWidgets.QLabel("Avoid overlaps?")
+        self.overlap_header_lbl.setStyleSheet("font: bold")
+        self.overlap_chbx = QtWidgets.QCheckBox()
+        self.overlap_retries_lbl = QtWidgets.QLabel("Retries")
+        self.overlap_retries_sbx = QtWidgets.QSpinBox()
+        self.overlap_retries_sbx.setRange(0, 10)
+        layout = QtWidgets.QFormLayout()
+        layout.addRow(self.overlap_header_lbl, self.overlap_chbx)
+        layout.addRow(self.overlap_retries_lbl, self.overlap_retries_sbx)
+        return layout
+
+    def _camera_ui(self):
+        self.camera_header_lbl = QtWidgets.QLabel("Camera")
+        self.camera_header_lbl.setStyleSheet("font: bold")
+        self.camera_le = QtWidgets.QLineEdit()
+        self.camera_le.setPlaceholderText("No culling")
+        self.camera_btn = QtWidgets.QPushButton("Selected")
+        camera_lay = QtWidgets.QHBoxLayout()
+        camera_lay.addWidget(self.camera_le)
+        camera_lay.addWidget(self.camera_btn)
+        self.frame_range_chbx = QtWidgets.QCheckBox("Frame Range")
+        self.frame_start_sbx = QtWidgets.QSpinBox()
+        self.frame_end_sbx = QtWidgets.QSpinBox()
+        frame_lay = QtWidgets.QHBoxLayout()
+        for spin_box, frame in ((self.frame_start_sbx, 1),
+                                (self.frame_end_sbx, 120)):
+            spin_box.setRange(-100000, 100000)
+            spin_box.setValue(frame)
+            frame_lay.addWidget(spin_box)
+        self.camera_margin_lbl = QtWidgets.QLabel("Frame Margin")
+        self.camera_margin_sbx = QtWidgets.QDoubleSpinBox()
+        self.camera_margin_sbx.setRange(0, 10)
+        self.camera_margin_sbx.setSingleStep(0.05)
+        self.camera_margin_sbx.setValue(self.scattertool.camera_margin)
+        self.thin_distance_lbl = QtWidgets.QLabel("Thin Beyond")
+        self.thin_distance_sbx = QtWidgets.QDoubleSpinBox()
+        self.thin_distance_sbx.setRange(0, 1000000)
+        self.proxy_lbl = QtWidgets.QLabel("Proxy Object")
+        self.proxy_le = QtWidgets.QLineEdit()
+        self.proxy_le.setPlaceholderText("None")
+        self.proxy_distance_lbl = QtWidgets.QLabel("Proxy Beyond")
+        self.proxy_distance_sbx = QtWidgets.QDoubleSpinBox()
+        self.proxy_distance_sbx.setRange(0, 1000000)
+        layout = QtWidgets.QFormLayout()
+        layout.addRow(self.camera_header_lbl, camera_lay)
+        layout.addRow(self.frame_range_chbx, frame_lay)
+        layout.addRow(self.camera_margin_lbl, self.camera_margin_sbx)
+        layout.addRow(self.thin_distance_lbl, self.thin_distance_sbx)
+        layout.addRow(self.proxy_lbl, self.proxy_le)
+        layout.addRow(self.proxy_distance_lbl, self.proxy_distance_sbx)
+        return layout
+
+    def _output_mode_ui(self):
+        self.output_header_lbl = QtWidgets.QLabel("Output")
+        self.output_header_lbl.setStyleSheet("font: bold")
+        self.output_cmb = QtWidgets.QComboBox()
+        self.output_cmb.addItem("Transforms", OUTPUT_TRANSFORMS)
+        self.output_cmb.addItem("Particle Instancer", OUTPUT_INSTANCER)
+        layout = QtWidgets.QFormLayout()
+        layout.addRow(self.output_header_lbl, self.output_cmb)
+        return layout
+
+    def _cache_ui(self):
+        self.save_cache_btn = QtWidgets.QPushButton("Save Cache...")
+        self.load_cache_btn = QtWidgets.QPushButton("Load Cache...")
+        layout = QtWidgets.QHBoxLayout()
+        layout.addWidget(self.save_cache_btn)
+        layout.addWidget(self.load_cache_btn)
+        return layout
+
+    def _progress_ui(self):
+        self.progress_bar = QtWidgets.QProgressBar()
+        self.progress_bar.setFormat("%v / %m")
+        self.cancel_btn = QtWidgets.QPushButton("Cancel")
+        self.cancel_btn.setEnabled(False)
+        layout = QtWidgets.QHBoxLayout()
+        layout.addWidget(self.progress_bar)
+        layout.addWidget(self.cancel_btn)
+        return layout
+
+    def _distribution_ui(self):
+        self.distribution_header_lbl = QtWidgets.QLabel("Distribution")
+        self.distribution_header_lbl.setStyleSheet("font: bold")
+        self.distribution_cmb = QtWidgets.QComboBox()
+        self.distribution_cmb.addItem("Vertices", DISTRIBUTE_VERTICES)
+        self.distribution_cmb.addItem("Surface (area weighted)", DISTRIBUTE_SURFACE)
+        self.surface_count_lbl = QtWidgets.QLabel("Surface Count")
+        self.surface_count_sbx = QtWidgets.QSpinBox()
+        self.surface_count_sbx.setRange(1, 10000000)
+        self.surface_count_sbx.setValue(1000)
+        self.min_spacing_lbl = QtWidgets.QLabel("Min Spacing")
+        self.min_spacing_sbx = QtWidgets.QDoubleSpinBox()
+        self.min_spacing_sbx.setRange(0, 1000)
+        layout = QtWidgets.QFormLayout()
+        layout.addRow(self.distribution_header_lbl, self.distribution_cmb)
+        layout.addRow(self.surface_count_lbl, self.surface_count_sbx)
+        layout.addRow(self.min_spacing_lbl, self.min_spacing_sbx)
+        return layout
+
+    def _density_ui(self):
+        self.density_header_lbl = QtWidgets.QLabel("Density Map")
+        self.density_header_lbl.setStyleSheet("font: bold")
+        self.density_cmb = QtWidgets.QComboBox()
+        self.density_cmb.addItem("None", DENSITY_NONE)
+        self.density_cmb.addItem("Vertex Color", DENSITY_VERTEX_COLOR)
+        self.density_cmb.addItem("Texture", DENSITY_TEXTURE)
+        self.density_source_lbl = QtWidgets.QLabel("Texture File")
+        self.density_source_le = QtWidgets.QLineEdit()
+        self.density_set_lbl = QtWidgets.QLabel("Color/UV Set")
+        self.density_set_le = QtWidgets.QLineEdit()
+        self.density_set_le.setPlaceholderText("Current")
+        self.density_scale_lbl = QtWidgets.QLabel("Density Drives Scale")
+        self.density_scale_chbx = QtWidgets.QCheckBox()
+        layout = QtWidgets.QFormLayout()
+        layout.addRow(self.density_header_lbl, self.density_cmb)
+        layout.addRow(self.density_source_lbl, self.density_source_le)
+        layout.addRow(self.density_set_lbl, self.density_set_le)
+        layout.addRow(self.density_scale_lbl, self.density_scale_chbx)
+        return layout
+
     def _random_location_ui(self):
         self.location_x_lbl = QtWidgets.QLabel("x")
         self.location_y_lbl = QtWidgets.QLabel("y")
@@ -276,9 +696,280 @@ class ScatterUI(QtWidgets.QDialog):
         return layout
 
 
+class WeightDelegate(QtWidgets.QStyledItemDelegate):
+    """Edits variant weights with a line edit that only takes numbers from 0 up"""
+
+    def createEditor(self, parent, option, index):
+        editor = QtWidgets.QLineEdit(parent)
+        validator = QtGui.QDoubleValidator(0.0, 1e9, 6, editor)
+        validator.setNotation(QtGui.QDoubleValidator.StandardNotation)
+        # float() reads what is typed, so no decimal commas
+        validator.setLocale(QtCore.QLocale.c())
+        editor.setValidator(validator)
+        return editor
+
+
+class TargetListModel(QtCore.QAbstractListModel):
+    """Shows the scatter targets without creating an item per vertex
+
+    Object targets get one row each. Vertex targets get one summary row
+    per mesh, like "pPlane1: 482,113 verts".
+    """
+
+    def __init__(self, parent=None):
+        super(TargetListModel, self).__init__(parent)
+        self.targets = []
+
+    def set_targets(self, targets):
+        self.beginResetModel()
+        self.targets = targets
+        self.endResetModel()
+
+    def _rows(self):
+        if isinstance(self.targets, scattercore.VertexSet):
+            return self.targets.meshes
+        return self.targets
+
+    def rowCount(self, parent=QtCore.QModelIndex()):
+        if parent.isValid():
+            return 0
+        return len(self._rows())
+
+    def data(self, index, role=QtCore.Qt.DisplayRole):
+        if not index.isValid() or role != QtCore.Qt.DisplayRole:
+            return None
+        row = self._rows()[index.row()]
+        if isinstance(self.targets, scattercore.VertexSet):
+            return self.targets.summary(row)
+        return row
+
+
+class PointCache(object):
+    """Caches the world space vertex positions, normals, triangles, colors and UVs of meshes
+
+    Each is read with one bulk query per mesh. A cached mesh is read again
+    when its vertex count or world matrix change, or when its shape reports
+    a change to outMesh.
+    """
+
+    def __init__(self):
+        self._points = {}
+        self._normals = {}
+        self._triangles = {}
+        self._colors = {}
+        self._uvs = {}
+        self._fingerprints = {}
+        # outMesh script job ids of every watched mesh
+        self._jobs = {}
+
+    def points(self, mesh):
+        """Returns the (n, 3) world space vertex positions of the mesh"""
+        self._validate(mesh)
+        if mesh not in self._points:
+            values = cmds.xform(mesh + ".vtx[*]", query=True, translation=True,
+                                worldSpace=True)
+            self._points[mesh] = np.array(values, dtype=np.float64).reshape(-1, 3)
+        return self._points[mesh]
+
+    def normals(self, mesh):
+        """Returns the (n, 3) world space unit vertex normals of the mesh"""
+        self._validate(mesh)
+        if mesh not in self._normals:
+            selection = om.MSelectionList()
+            selection.add(mesh)
+            mesh_fn = om.MFnMesh(selection.getDagPath(0))
+            normals = mesh_fn.getVertexNormals(False, om.MSpace.kWorld)
+            self._normals[mesh] = np.array(
+                [(normal.x, normal.y, normal.z) for normal in normals],
+                dtype=np.float64).reshape(-1, 3)
+        return self._normals[mesh]
+
+    def triangles(self, mesh):
+        """Returns the (n, 3) vertex ids of every triangle of the mesh"""
+        self._validate(mesh)
+        if mesh not in self._triangles:
+            selection = om.MSelectionList()
+            selection.add(mesh)
+            mesh_fn = om.MFnMesh(selection.getDagPath(0))
+            _, vertex_ids = mesh_fn.getTriangles()
+            self._triangles[mesh] = np.array(
+                list(vertex_ids), dtype=np.int64).reshape(-1, 3)
+        return self._triangles[mesh]
+
+    def colors(self, mesh, color_set=""):
+        """Returns the (n, 4) RGBA vertex colors of a color set, -1 where unpainted
+
+        An empty color_set reads the current one.
+        """
+        self._validate(mesh)
+        colors = self._colors.setdefault(mesh, {})
+        if color_set not in colors:
+            selection = om.MSelectionList()
+            selection.add(mesh)
+            mesh_fn = om.MFnMesh(selection.getDagPath(0))
+            colors[color_set] = np.array(
+                [(color.r, color.g, color.b, color.a)
+                 for color in mesh_fn.getVertexColors(color_set)],
+                dtype=np.float64).reshape(-1, 4)
+        return colors[color_set]
+
+    def uvs(self, mesh, uv_set=""):
+        """Returns the (n, 2) UV of every vertex of a UV set, (0, 0) where unmapped
+
+        A vertex on a UV seam gets the UV of one of its faces. An empty
+        uv_set reads the current one.
+        """
+        self._validate(mesh)
+        uvs = self._uvs.setdefault(mesh, {})
+        if uv_set not in uvs:
+            selection = om.MSelectionList()
+            selection.add(mesh)
+            mesh_fn = om.MFnMesh(selection.getDagPath(0))
+            us, vs = mesh_fn.getUVs(uv_set)
+            uv_counts, uv_ids = mesh_fn.getAssignedUVs(uv_set)
+            vertex_counts, vertex_ids = mesh_fn.getVertices()
+            # faces without UVs have no uv ids, skip their face vertices
+            vertex_counts = np.array(list(vertex_counts), dtype=np.int64)
+            mapped = np.repeat(np.array(list(uv_counts)) == vertex_counts,
+                               vertex_counts)
+            vertex_ids = np.array(list(vertex_ids), dtype=np.int64)[mapped]
+            table = np.vstack([np.zeros((1, 2)),
+                               np.column_stack([list(us), list(vs)])])
+            vertex_uvs = np.zeros(mesh_fn.numVertices, dtype=np.int64)
+            vertex_uvs[vertex_ids] = np.array(list(uv_ids), dtype=np.int64) + 1
+            uvs[uv_set] = table[vertex_uvs]
+        return uvs[uv_set]
+
+    def invalidate(self, mesh):
+        """Drops the cached data of the mesh"""
+        self._points.pop(mesh, None)
+        self._normals.pop(mesh, None)
+        self._triangles.pop(mesh, None)
+        self._colors.pop(mesh, None)
+        self._uvs.pop(mesh, None)
+        self._fingerprints.pop(mesh, None)
+        for job in self._jobs.pop(mesh, []):
+            if cmds.scriptJob(exists=job):
+                cmds.scriptJob(kill=job, force=True)
+
+    def clear(self):
+        for mesh in list(self._jobs):
+            self.invalidate(mesh)
+        self._points.clear()
+        self._normals.clear()
+        self._triangles.clear()
+        self._colors.clear()
+        self._uvs.clear()
+        self._fingerprints.clear()
+
+    def _validate(self, mesh):
+        fingerprint = self._fingerprint(mesh)
+        if self._fingerprints.get(mesh) != fingerprint:
+            self.invalidate(mesh)
+            self._fingerprints[mesh] = fingerprint
+            self._watch(mesh)
+
+    def _fingerprint(self, mesh):
+        vertex_count = cmds.polyEvaluate(mesh, vertex=True)
+        matrix = cmds.xform(mesh, query=True, matrix=True, worldSpace=True)
+        return vertex_count, tuple(matrix)
+
+    def _watch(self, mesh):
+        self._jobs[mesh] = [
+            cmds.scriptJob(attributeChange=[shape + ".outMesh",
+                                            partial(self._mesh_changed, mesh)],
+                           runOnce=True)
+            for shape in cmds.listRelatives(mesh, shapes=True, fullPath=True)
+            or [mesh]]
+
+    def _mesh_changed(self, mesh):
+        # the job that calls this ends by itself, it must not be killed
+        self._jobs.pop(mesh, None)
+        self.invalidate(mesh)
+
+
+class SharedProgress(object):
+    """Reports the progress of several outputs against their combined total
+
+    Pass part(count) as the progress of each output in turn. Once the
+    progress callable returns False, cancelled is set and the caller stops
+    creating outputs.
+
+    Attributes:
+        total (int): instances of all outputs together
+        done (int): instances of the outputs before the current one
+        cancelled (bool): the progress callable asked to stop
+    """
+
+    def __init__(self, progress, total):
+        self.progress = progress
+        self.total = total
+        self.done = 0
+        self.cancelled = False
+        self._count = 0
+
+    def part(self, count):
+        """Starts the next output of count instances and returns its progress"""
+        self.done += self._count
+        self._count = count
+        return self._report
+
+    def _report(self, done, total):
+        if self.progress is None:
+            return True
+        if self.progress(self.done + done, self.total) is False:
+            self.cancelled = True
+            return False
+        return True
+
+
+class ScatterResult(object):
+    """Remembers the instances a scatter created so they can be updated later
+
+    Attributes:
+        group (str): group node the instances are parented under
+        source (str): the scattered object
+        keys (numpy.ndarray): packed instance key of every instance
+        instances (list): instance names in the order of keys, empty for
+            an instancer
+        seed (int): seed the scatter used
+        matrices (numpy.ndarray): (n, 4, 4) world matrix of every instance
+        parameters (dict): the ScatterTool settings the scatter used
+        targets (list): names of the meshes or objects scattered onto
+        instancer (str): particle shape of an instancer scatter, else None
+    """
+
+    def __init__(self, group, source, keys, instances, seed, matrices=None,
+                 parameters=None, targets=None, instancer=None):
+        self.group = group
+        self.source = source
+        self.keys = keys
+        self.instances = instances
+        self.seed = seed
+        self.matrices = matrices
+        self.parameters = parameters
+        self.targets = targets
+        self.instancer = instancer
+
+
 class ScatterTool(object):
     """Gets an object and place to scatter and gives random rotation and scale to them"""
 
+    # settings saved with a scatter cache, see parameters
+    parameter_names = (
+        "scale_x_min", "scale_y_min", "scale_z_min",
+        "scale_x_max", "scale_y_max", "scale_z_max",
+        "rotation_x_min", "rotation_y_min", "rotation_z_min",
+        "rotation_x_max", "rotation_y_max", "rotation_z_max",
+        "location_x_min", "location_y_min", "location_z_min",
+        "location_x_max", "location_y_max", "location_z_max",
+        "percent_to_scatter", "normal_aligned", "distribution",
+        "surface_count", "min_spacing", "seed", "avoid_overlaps",
+        "overlap_retries", "camera", "frame_range", "camera_margin",
+        "thin_distance", "proxy_object", "proxy_distance", "density_mode",
+        "density_color_set", "density_texture", "density_uv_set",
+        "density_scale", "sources")
+
     def __init__(self):
         self.selected_object = "pCube1"
         self.selected_location = ["pCube1"]
@@ -306,31 +997,80 @@ class ScatterTool(object):
         self.y_location_offset = 0.0
         self.z_location_offset = 0.0
         self.vertices_selected = True
+        self.batch_mode = True
+        self.output_mode = OUTPUT_TRANSFORMS
+        self.distribution = DISTRIBUTE_VERTICES
+        self.surface_count = 1000
+        self.min_spacing = 0.0
+        self.chunk_size = 1000
+        self.seed = 1234
+        self.chunk_timings = []
+        self.instancer = None
+        self.rescatter_in_place = True
+        self.avoid_overlaps = False
+        self.overlap_retries = 0
+        self.overlap_rejected = 0
+        self.overlap_seconds = 0.0
+        self.camera = None
+        self.frame_range = None
+        self.camera_margin = 0.1
+        self.thin_distance = 0.0
+        self.proxy_object = None
+        self.proxy_distance = 0.0
+        self.camera_culled = 0
+        self.density_mode = DENSITY_NONE
+        self.density_color_set = ""
+        self.density_texture = ""
+        self.density_uv_set = ""
+        self.density_scale = False
+        self.density_rejected = 0
+        self._density_images = {}
+        self.sources = []
+        self.scatter_results = {}
+        self._last_source = None
+        self.workers = multiprocessing.cpu_count()
+        self.parallel_min_count = 20000
+        self.pool = None
+        self.point_cache = PointCache()
+
+    @property
+    def last_scatter(self):
+        """ScatterResult: the last scatter of selected_object, else the last of any object"""
+        return self.scatter_results.get(
+            self.selected_object, self.scatter_results.get(self._last_source))
+
+    @last_scatter.setter
+    def last_scatter(self, result):
+        if result is None:
+            self.scatter_results = {}
+            self._last_source = None
+        else:
+            self.scatter_results[result.source] = result
+            self._last_source = result.source
 
     def create(self, scatter_location):
         instance_object = cmds.instance(self.selected_object, name=self.selected_object)
         self.get_xyz_location(scatter_location)
         cmds.move(self.x_location, self.y_location, self.z_location, instance_object)
-        if self.normal_aligned:
-            constraint = cmds.normalConstraint(scatter_location, instance_object, aimVector=[0.0, 1.0, 0.0])
-            #cmds.delete(constraint)
-        self.randomize()
+        self.randomize(scatter_location)
+        rotation = [self.rotation_x, self.rotation_y, self.rotation_z]
+        if self.normal_aligned and self.vertices_selected:
+            matrix = np.dot(scattercore.euler_to_matrices([rotation])[0],
+                            self.get_alignments([scatter_location])[0])
+            rotation = scattercore.matrix_to_euler(matrix)
         cmds.scale(self.scale_x, self.scale_y, self.scale_z, instance_object)
-        cmds.rotate(self.rotation_x, self.rotation_y, self.rotation_z, instance_object)
+        cmds.rotate(rotation[0], rotation[1], rotation[2], instance_object)
         cmds.move(self.x_location + self.x_location_offset, self.y_location + self.y_location_offset,
                   self.z_location + self.z_location_offset, instance_object)
+        return instance_object[0]
 
-    def randomize(self):
-        """Randomizes the scale, rotation, and location within the range"""
-        self.scale_x = random.uniform(self.scale_x_min, self.scale_x_max)
-        self.scale_y = random.uniform(self.scale_y_min, self.scale_y_max)
-        self.scale_z = random.uniform(self.scale_z_min, self.scale_z_max)
-        self.rotation_x = random.uniform(self.rotation_x_min, self.rotation_x_max)
-        self.rotation_y = random.uniform(self.rotation_y_min, self.rotation_y_max)
-        self.rotation_z = random.uniform(self.rotation_z_min, self.rotation_z_max)
-        self.x_location_offset = random.uniform(self.location_x_min, self.location_x_max)
-        self.y_location_offset = random.uniform(self.location_y_min, self.location_y_max)
-        self.y_location_offset = random.uniform(self.location_z_min, self.location_z_max)
+    def randomize(self, location):
+        """Randomizes the scale, rotation, and location of the instance at location"""
+        scales, rotations, offsets = self.randomize_batch([location])
+        self.scale_x, self.scale_y, self.scale_z = scales[0].tolist()
+        self.rotation_x, self.rotation_y, self.rotation_z = rotations[0].tolist()
+        (self.x_location_offset, self.y_location_offset,
+         self.z_location_offset) = offsets[0].tolist()
 
     def get_xyz_location(self, location):
         if(self.vertices_selected):
@@ -344,9 +1084,977 @@ class ScatterTool(object):
             self.z_location = cmds.getAttr(location + ".translateZ")
 
 
-    def scatter_each(self):
+    def scatter_each(self, progress=None):
+        """Scatters the selected object, or each of sources, onto the selected locations
+
+        Runs as one undo step with viewport refresh suspended. Instances are
+        created in chunks of chunk_size. With a camera, locations it never
+        sees are culled first, see cull_to_camera, after a density map
+        thinned them out, see apply_density. With avoid_overlaps,
+        instances whose bounds would overlap an earlier one are dropped
+        next, see reject_overlaps. With sources every instance picks one of
+        them, and with a proxy_object too, instances beyond proxy_distance
+        instance it instead, see create_sources. Either way the locations
+        are sampled and their matrices built once for every source.
+
+        Args:
+            progress (callable): called as progress(done, total) after every
+                chunk, returning False cancels the rest of the scatter
+
+        Returns:
+            list or str: the created instances, or the instancer particle
+            shape, a list of shapes with sources or a proxy
+
+        Raises:
+            ValueError: if the weights of sources cannot be picked from,
+                checked before anything is scattered
+        """
+        check_sources(self.sources)
+        with metrics.operation("scatter", output_mode=self.output_mode,
+                               distribution=self.distribution), \
+                undo_chunk("scatter"):
+            with metrics.phase("sampling"):
+                if self.distribution == DISTRIBUTE_SURFACE:
+                    selected_verts = self.sample_surface()
+                else:
+                    selected_verts = self.sample_locations()
+                if self.density_mode != DENSITY_NONE:
+                    selected_verts = self.apply_density(selected_verts)
+            views = None
+            if self.camera:
+                with metrics.phase("camera_cull"):
+                    views = self.camera_views()
+                    selected_verts = self.cull_to_camera(selected_verts, views)
+            matrices = None
+            if self.avoid_overlaps:
+                selected_verts, matrices = self.reject_overlaps(
+                    selected_verts, self.build_matrices(selected_verts))
+            metrics.count("instances", len(selected_verts))
+            if self.sources or self._use_proxy(views):
+                return self.create_sources(selected_verts, views, progress,
+                                           matrices)
+            return self.create_output(selected_verts, progress, matrices)
+
+    def create_output(self, locations, progress=None, matrices=None,
+                      source=None):
+        """Instances source, the selected object by default, at locations in output_mode
+
+        Returns:
+            list or str: the created instances, or the instancer particle shape
+        """
+        if self.output_mode == OUTPUT_INSTANCER:
+            shape = self.create_instancer(locations, matrices, source)
+            if progress is not None:
+                progress(len(locations), len(locations))
+            return shape
+        if (self.batch_mode or self.distribution == DISTRIBUTE_SURFACE or
+                matrices is not None or source is not None):
+            return self.create_batch(locations, progress, matrices, source)
+        return self.create_chunked(list(locations), self.create, progress)
+
+    def create_sources(self, locations, views=None, progress=None,
+                       matrices=None):
+        """Instances every source at its share of the locations, one batch each
+
+        Each location picks a source of source_names by weight, see
+        pick_sources. With a proxy_object and views, locations further
+        than proxy_distance from the nearest camera position over
+        frame_range instance the proxy instead. Every source gets its own
+        group or instancer, and a source without locations is skipped
+        unless it has instances of an earlier scatter to remove. Progress
+        counts the instances of all sources, and a cancel stops at the
+        source it happens in, later sources keep their earlier scatter.
+
+        Returns:
+            list: the created instances, or the instancer particle shapes
+        """
+        if matrices is None:
+            matrices = self.build_matrices(locations)
+        names = self.source_names()
+        picked = self.pick_sources(locations)
+        if self._use_proxy(views):
+            far = scattercull.min_distances(matrices[:, 3, :3],
+                                            views) > self.proxy_distance
+            picked[far] = len(names)
+            names = names + [self.proxy_object]
+        created = []
+        shared = SharedProgress(progress, len(locations))
+        for index, source in enumerate(names):
+            indices = np.flatnonzero(picked == index)
+            if not len(indices) and not self._can_rescatter(source):
+                continue
+            output = self.create_output(self.take_locations(locations, indices),
+                                        shared.part(len(indices)),
+                                        matrices[indices], source)
+            if self.output_mode == OUTPUT_INSTANCER:
+                created.append(output)
+            else:
+                created.extend(output)
+            if shared.cancelled:
+                log.warning("Scatter cancelled at source %s", source)
+                break
+        counts = np.bincount(picked, minlength=len(names))
+        log.info("Scatter: %s", ", ".join(
+            "{} {}".format(count, name) for name, count in zip(names, counts)))
+        return created
+
+    def source_names(self):
+        """Returns the objects to scatter, the names in sources or the selected object"""
+        return [name for name, _ in self.sources] or [self.selected_object]
+
+    def pick_sources(self, locations):
+        """Returns the (n,) index into source_names of the source of every location
+
+        Picks are weighted by the weights in sources and keyed like every
+        other random value, so a location keeps its source on re-scatter.
+        """
+        if len(self.sources) < 2:
+            return np.zeros(len(locations), dtype=np.int64)
+        streams, counters = self.instance_keys(locations)
+        random_values = scattercore.counter_random(
+            self.seed, streams, counters, 1,
+            offset=scattercore.SOURCE_CHANNEL)[:, 0]
+        return scattercore.weighted_choice(
+            random_values, [weight for _, weight in self.sources])
+
+    def _use_proxy(self, views):
+        return bool(views) and bool(self.proxy_object) and self.proxy_distance > 0
+
+    def camera_views(self):
+        """Returns a scattercull.CameraView of camera on every frame of frame_range
+
+        Without a frame_range only the current frame is used. The film gate
+        is used as is, fit and overscan are not applied.
+        """
+        shapes = cmds.listRelatives(self.camera, shapes=True,
+                                    type="camera") or [self.camera]
+        if self.frame_range is None:
+            frames = [None]
+        else:
+            frames = range(int(self.frame_range[0]),
+                           int(self.frame_range[1]) + 1)
+        views = []
+        for frame in frames:
+            time_flag = {} if frame is None else {"time": frame}
+            matrix = cmds.getAttr(self.camera + ".worldMatrix", **time_flag)
+            lens = [cmds.getAttr(shapes[0] + "." + attribute, **time_flag)
+                    for attribute in ("focalLength", "horizontalFilmAperture",
+                                      "verticalFilmAperture", "nearClipPlane",
+                                      "farClipPlane")]
+            views.append(scattercull.CameraView.from_lens(matrix, *lens))
+        return views
+
+    def cull_to_camera(self, locations, views):
+        """Drops the locations outside the camera's view on every frame
+
+        The frustum is widened by camera_margin so instances just off frame
+        still cast into it. With a thin_distance the kept locations further
+        than that from the camera are thinned out too, see
+        scattercull.thin_by_distance, keyed like every other random value.
+        The dropped count is logged and left in camera_culled.
+
+        Args:
+            views (list): scattercull.CameraView of every frame
+
+        Returns:
+            the kept locations, of the same kind as locations
+        """
+        start = time.time()
+        positions = self.get_locations(locations)
+        kept = np.flatnonzero(scattercull.cull(positions, views,
+                                               self.camera_margin))
+        if self.thin_distance > 0 and len(kept):
+            streams, counters = self.instance_keys(
+                self.take_locations(locations, kept))
+            random_values = scattercore.counter_random(
+                self.seed, streams, counters, 1,
+                offset=scattercore.THIN_CHANNEL)[:, 0]
+            kept = kept[scattercull.thin_by_distance(
+                scattercull.min_distances(positions[kept], views),
+                self.thin_distance, random_values)]
+        self.camera_culled = len(positions) - len(kept)
+        log.info("Camera pass dropped %d of %d locations in %.3fs",
+                 self.camera_culled, len(positions), time.time() - start)
+        return self.take_locations(locations, kept)
+
+    def create_chunked(self, items, create_one, progress=None):
+        """Calls create_one on every item, chunk_size items at a time
+
+        Times every chunk into chunk_timings and logs its throughput.
+
+        Returns:
+            list: what create_one returned for each item that was processed
+        """
+        created = []
+        self.chunk_timings = []
+        total = len(items)
+        for start in range(0, total, self.chunk_size):
+            chunk_start = time.time()
+            for item in items[start:start + self.chunk_size]:
+                created.append(create_one(item))
+            seconds = time.time() - chunk_start
+            count = min(self.chunk_size, total - start)
+            self.chunk_timings.append((count, seconds))
+            log.info("Scattered %d/%d instances, %d in %.3fs (%.0f instances/sec)",
+                     len(created), total, count, seconds,
+                     count / max(seconds, 1e-9))
+            if progress is not None and progress(len(created), total) is False:
+                log.warning("Scatter cancelled after %d of %d instances",
+                            len(created), total)
+                break
+        return created
+
+    def sample_locations(self):
+        """Picks percent_to_scatter of the selected locations at random
+
+        Every location gets a random key from the seed and its own id and
+        the lowest keys win, so the same locations are picked no matter how
+        the selection is ordered. Vertex sets are sampled by index, so no
+        component strings are made.
+
+        Returns:
+            list or scattercore.VertexSamples: the picked locations
+        """
+        targets = self.selected_location
         multiplier = self.percent_to_scatter/100.0
-        amount = int(round(len(self.selected_location) * multiplier))
-        selected_verts = random.sample(self.selected_location, k=amount)
-        for location in selected_verts:
-            self.create(location)
+        amount = int(round(len(targets) * multiplier))
+        if isinstance(targets, scattercore.VertexSet):
+            candidates = targets.take(np.arange(len(targets)))
+        else:
+            candidates = targets
+        streams, counters = self.instance_keys(candidates)
+        keys = scattercore.counter_random(self.seed, streams, counters, 1,
+                                          offset=scattercore.SELECT_CHANNEL)[:, 0]
+        indices = np.sort(np.argsort(keys, kind="stable")[:amount])
+        if isinstance(targets, scattercore.VertexSet):
+            return targets.take(indices)
+        return [targets[index] for index in indices]
+
+    def instance_keys(self, locations):
+        """Returns the (stream, counter) id arrays that key each location's randoms
+
+        Vertices are keyed by mesh and vertex id, objects by name and
+        surface points by their candidate index.
+        """
+        if isinstance(locations, scattersample.SurfaceSamples):
+            return (np.full(len(locations), locations.stream, dtype=np.uint64),
+                    locations.ids)
+        if not self.vertices_selected:
+            return (np.array([scattercore.stream_id(name) for name in locations],
+                             dtype=np.uint64),
+                    np.zeros(len(locations), dtype=np.uint64))
+        samples = self._vertex_samples(locations)
+        mesh_streams = np.array([scattercore.stream_id(mesh)
+                                 for mesh in samples.meshes], dtype=np.uint64)
+        return mesh_streams[samples.mesh_indices], samples.vertex_ids
+
+    def packed_keys(self, locations):
+        """Returns one uint64 per location combining its stream and counter ids"""
+        streams, counters = self.instance_keys(locations)
+        return (np.asarray(streams, dtype=np.uint64) << np.uint64(32) |
+                np.asarray(counters, dtype=np.uint64))
+
+    def sample_surface(self):
+        """Picks surface_count points on the faces of the targets, weighted by area
+
+        Vertex targets limit sampling to triangles whose corners are all
+        selected. A min_spacing above zero keeps points at least that far
+        apart.
+
+        Returns:
+            scattersample.SurfaceSamples: the picked points
+        """
+        targets = self.selected_location
+        if isinstance(targets, scattercore.VertexSet):
+            meshes = targets.meshes
+        else:
+            meshes = list(targets)
+        points, normals, triangles, densities = [], [], [], []
+        vertex_offset = 0
+        for mesh in meshes:
+            mesh_triangles = self.point_cache.triangles(mesh)
+            if isinstance(targets, scattercore.VertexSet):
+                selected = np.isin(mesh_triangles, targets.ids(mesh))
+                mesh_triangles = mesh_triangles[selected.all(axis=1)]
+            points.append(self.point_cache.points(mesh))
+            if self.normal_aligned:
+                normals.append(self.point_cache.normals(mesh))
+            if self.density_mode != DENSITY_NONE:
+                densities.append(self.vertex_densities(mesh))
+            triangles.append(mesh_triangles + vertex_offset)
+            vertex_offset += len(points[-1])
+        if not triangles:
+            return scattersample.SurfaceSamples(np.empty((0, 3)))
+        stream = scattercore.stream_id("|".join(meshes))
+
+        def random_values(count, channels):
+            return scattercore.counter_random(
+                self.seed, np.full(count, stream), np.arange(count), channels,
+                offset=scattercore.SURFACE_CHANNEL)
+
+        samples = scattersample.sample_surface(
+            np.concatenate(points), np.concatenate(triangles),
+            self.surface_count, random_values, min_spacing=self.min_spacing,
+            normals=np.concatenate(normals) if normals else None,
+            densities=np.concatenate(densities) if densities else None)
+        samples.stream = stream
+        return samples
+
+    def randomize_batch(self, locations):
+        """Randomizes the scale, rotation, and location offset of many instances at once
+
+        Each instance's values only depend on the seed and the instance's
+        own key, so any subset or chunk of locations gets the same values.
+
+        Returns:
+            tuple: (n, 3) numpy arrays of scales, rotations and offsets
+        """
+        streams, counters = self.instance_keys(locations)
+        values = scattercore.counter_random(
+            self.seed, streams, counters, len(scattercore.RANDOM_CHANNELS))
+        values = scattercore.uniform_from(values, *self.random_ranges())
+        return values[:, 0:3], values[:, 3:6], values[:, 6:9]
+
+    def random_ranges(self):
+        """Returns the (mins, maxs) lists of every RANDOM_CHANNELS value"""
+        mins = [self.scale_x_min, self.scale_y_min, self.scale_z_min,
+                self.rotation_x_min, self.rotation_y_min, self.rotation_z_min,
+                self.location_x_min, self.location_y_min, self.location_z_min]
+        maxs = [self.scale_x_max, self.scale_y_max, self.scale_z_max,
+                self.rotation_x_max, self.rotation_y_max, self.rotation_z_max,
+                self.location_x_max, self.location_y_max, self.location_z_max]
+        return mins, maxs
+
+    def get_locations(self, locations):
+        """Returns the positions of many vertices or objects as a (n, 3) array
+
+        Vertex positions come from the point cache, object translations from
+        one xform query for the whole list.
+        """
+        if not len(locations):
+            return np.empty((0, 3))
+        if isinstance(locations, scattersample.SurfaceSamples):
+            return locations.positions
+        if not self.vertices_selected:
+            values = cmds.xform(locations, query=True, translation=True)
+            return np.array(values, dtype=np.float64).reshape(-1, 3)
+        return self._vertex_samples(locations).gather(self.point_cache.points)
+
+    def get_alignments(self, locations):
+        """Returns (n, 3, 3) rotations that point +Y along each vertex normal"""
+        if isinstance(locations, scattersample.SurfaceSamples):
+            normals = locations.normals
+        else:
+            normals = self._vertex_samples(locations).gather(
+                self.point_cache.normals)
+        return scattercore.normal_alignment_matrices(normals)
+
+    def _vertex_samples(self, locations):
+        if isinstance(locations, scattercore.VertexSamples):
+            return locations
+        return scattercore.parse_vertex_components(locations)
+
+    def build_matrices(self, locations, attempt=0):
+        """Returns one (4, 4) world matrix per location as a numpy array
+
+        With workers above 1 and at least parallel_min_count locations the
+        matrices are computed across a scatterpool.ScatterPool, which gives
+        the same result.
+
+        Args:
+            attempt (int): overlap retry to draw the random values of, the
+                first draw is 0
+        """
+        streams, counters = self.instance_keys(locations)
+        mins, maxs = self.random_ranges()
+        with metrics.phase("position_fetch"):
+            points, rows, normals = self.export_points(locations)
+        offset = scattercore.retry_offset(attempt)
+        with metrics.phase("matrices"):
+            if self._use_pool(len(rows)):
+                matrices = self.pool.compute(self.seed, mins, maxs, points,
+                                             rows, streams, counters, normals,
+                                             offset)
+            else:
+                matrices = scattercore.instance_matrices(
+                    self.seed, streams, counters, points[rows], mins, maxs,
+                    None if normals is None else normals[rows], offset)
+        if self.density_scale and self.density_mode != DENSITY_NONE:
+            scattercore.scale_by_density(
+                matrices, self.location_densities(locations), mins[:3])
+        return matrices
+
+    def apply_density(self, locations):
+        """Keeps each location with the probability of its density
+
+        The keep test is keyed like every other random value, so a location
+        stays or goes the same way on every scatter. The dropped count is
+        logged and left in density_rejected.
+
+        Returns:
+            the kept locations, of the same kind as locations
+        """
+        densities = self.location_densities(locations)
+        streams, counters = self.instance_keys(locations)
+        random_values = scattercore.counter_random(
+            self.seed, streams, counters, 1,
+            offset=scattercore.DENSITY_CHANNEL)[:, 0]
+        kept = np.flatnonzero(random_values < densities)
+        self.density_rejected = len(densities) - len(kept)
+        log.info("Density map dropped %d of %d locations",
+                 self.density_rejected, len(densities))
+        return self.take_locations(locations, kept)
+
+    def location_densities(self, locations):
+        """Returns the (n,) density map value of every location
+
+        Vertices look theirs up in one array per mesh and surface points
+        carry theirs from sampling. Objects have no map and get 1.
+        """
+        if isinstance(locations, scattersample.SurfaceSamples):
+            if locations.densities is None:
+                return np.ones(len(locations))
+            return locations.densities
+        if not self.vertices_selected or not len(locations):
+            return np.ones(len(locations))
+        return self._vertex_samples(locations).gather(self.vertex_densities)
+
+    def vertex_densities(self, mesh):
+        """Returns the (n,) density of every vertex of the mesh, in [0, 1]
+
+        Vertex colors give their brightness, unpainted vertices 1. Textures
+        are sampled at each vertex's UV and interpolated across faces, so
+        detail finer than the mesh is lost.
+        """
+        if self.density_mode == DENSITY_VERTEX_COLOR:
+            colors = self.point_cache.colors(mesh, self.density_color_set)
+            return np.where(colors[:, 0] < 0.0, 1.0,
+                            np.clip(colors[:, :3].dot(_LUMINANCE), 0.0, 1.0))
+        if self.density_mode == DENSITY_TEXTURE:
+            return scattersample.sample_image(
+                self.density_image(),
+                self.point_cache.uvs(mesh, self.density_uv_set))
+        return np.ones(len(self.point_cache.points(mesh)))
+
+    def density_image(self):
+        """Returns density_texture as a (h, w) array of brightness in [0, 1]
+
+        The file is read once and again only when it changes on disk. Row 0
+        is the bottom of the image, where v is 0. Float images, such as
+        EXRs, are read as floats and clipped to [0, 1].
+
+        Raises:
+            ValueError: if the image has pixels of an unknown type
+        """
+        path = self.density_texture
+        modified = os.path.getmtime(path)
+        cached = self._density_images.get(path)
+        if cached is None or cached[0] != modified:
+            image = om.MImage()
+            image.readFromFile(path)
+            width, height = image.getSize()
+            pixel_type = image.pixelType()
+            if pixel_type == om.MImage.kByte:
+                ctype, scale = ctypes.c_ubyte, 1.0 / 255.0
+            elif pixel_type == om.MImage.kFloat:
+                ctype, scale = ctypes.c_float, 1.0
+            else:
+                raise ValueError("Cannot read the pixels of {}, their type "
+                                 "is {}".format(path, pixel_type))
+            # pixels() is the address of memory the image owns, copy it out
+            buffer = (ctype * (width * height * 4)).from_address(image.pixels())
+            pixels = np.ctypeslib.as_array(buffer).reshape(height, width, 4)
+            brightness = pixels[:, :, :3].dot(_LUMINANCE) * scale
+            cached = modified, np.clip(brightness, 0.0, 1.0)
+            self._density_images = {path: cached}
+        return cached[1]
+
+    def reject_overlaps(self, locations, matrices):
+        """Drops the instances whose bounds overlap an earlier kept instance
+
+        Each instance is bounded by a sphere around its pivot holding the
+        bounds of its source at the instance's scale. Instances are kept in
+        the random order of their selection keys while they overlap nothing
+        kept, so no side of the targets is favoured and the same instances
+        win every time. A rejected instance gets up to
+        overlap_retries new draws of its scale, rotation and offset to fit in
+        among the kept ones. The rejected count and time are logged and left
+        in overlap_rejected and overlap_seconds.
+
+        Returns:
+            tuple: the kept locations and their (n, 4, 4) matrices
+        """
+        start = time.time()
+        extents = self.instance_extents(locations)
+        radii = scattersample.bounding_radii(matrices, extents)
+        streams, counters = self.instance_keys(locations)
+        order = np.argsort(scattercore.counter_random(
+            self.seed, streams, counters, 1,
+            offset=scattercore.SELECT_CHANNEL)[:, 0], kind="stable")
+        keep = np.zeros(len(order), dtype=bool)
+        keep[order] = scattersample.reject_overlaps(matrices[order, 3, :3],
+                                                    radii[order])
+        for attempt in range(1, self.overlap_retries + 1):
+            retry = order[~keep[order]]
+            if not len(retry):
+                break
+            retried = self.build_matrices(self.take_locations(locations, retry),
+                                          attempt)
+            retried_radii = scattersample.bounding_radii(retried,
+                                                         extents[retry])
+            fits = scattersample.reject_overlaps(
+                retried[:, 3, :3], retried_radii,
+                matrices[keep][:, 3, :3], radii[keep])
+            matrices[retry[fits]] = retried[fits]
+            radii[retry[fits]] = retried_radii[fits]
+            keep[retry[fits]] = True
+        self.overlap_rejected = int(len(keep) - keep.sum())
+        self.overlap_seconds = time.time() - start
+        log.info("Overlap pass rejected %d of %d instances in %.3fs",
+                 self.overlap_rejected, len(keep), self.overlap_seconds)
+        kept = np.flatnonzero(keep)
+        return self.take_locations(locations, kept), matrices[kept]
+
+    def source_extent(self, source=None):
+        """Returns how far an object's bounds reach from its pivot on each axis
+
+        Args:
+            source (str): the object, defaults to the selected one
+        """
+        bounds = np.array(cmds.xform(source or self.selected_object,
+                                     query=True, boundingBox=True,
+                                     objectSpace=True),
+                          dtype=np.float64)
+        return np.maximum(np.abs(bounds[:3]), np.abs(bounds[3:]))
+
+    def instance_extents(self, locations):
+        """Returns the (n, 3) source_extent of the source each location picked"""
+        extents = np.array([self.source_extent(name)
+                            for name in self.source_names()])
+        return extents[self.pick_sources(locations)]
+
+    def take_locations(self, locations, indices):
+        """Returns the locations at indices, of the same kind as locations"""
+        if isinstance(locations, scattersample.SurfaceSamples):
+            return scattersample.SurfaceSamples(
+                locations.positions[indices],
+                None if locations.normals is None
+                else locations.normals[indices],
+                locations.ids[indices], locations.stream,
+                None if locations.densities is None
+                else locations.densities[indices])
+        if isinstance(locations, scattercore.VertexSamples):
+            return scattercore.VertexSamples(locations.meshes,
+                                             locations.mesh_indices[indices],
+                                             locations.vertex_ids[indices])
+        return [locations[index] for index in indices]
+
+    def export_points(self, locations):
+        """Returns the points of the targets and which point each location is on
+
+        Vertex locations export every point of their meshes, one mesh after
+        the other, so the arrays can be handed to worker processes as is.
+
+        Returns:
+            tuple: (v, 3) points, (n,) row of each location in them and
+            (v, 3) normals, or None when not normal aligned
+        """
+        aligned = self.normal_aligned and (
+            self.vertices_selected or
+            isinstance(locations, scattersample.SurfaceSamples))
+        if not len(locations) or not self.vertices_selected or isinstance(
+                locations, scattersample.SurfaceSamples):
+            points = self.get_locations(locations)
+            normals = (locations.normals if aligned and len(locations)
+                       else None)
+            return points, np.arange(len(points)), normals
+        samples = self._vertex_samples(locations)
+        points = [self.point_cache.points(mesh) for mesh in samples.meshes]
+        offsets = np.cumsum([0] + [len(mesh_points) for mesh_points in points])
+        rows = offsets[samples.mesh_indices] + samples.vertex_ids
+        normals = None
+        if aligned:
+            normals = np.concatenate([self.point_cache.normals(mesh)
+                                      for mesh in samples.meshes])
+        return np.concatenate(points), rows, normals
+
+    def _use_pool(self, count):
+        if self.workers <= 1 or count < self.parallel_min_count:
+            return False
+        if not scatterpool.ScatterPool.available():
+            log.debug("No shared memory in this Python, computing on the "
+                      "main thread")
+            return False
+        if self.pool is None or self.pool.workers != self.workers:
+            self.close_pool()
+            self.pool = scatterpool.ScatterPool(self.workers)
+        return True
+
+    def close_pool(self):
+        """Stops the worker processes of parallel scatters, if any"""
+        if self.pool is not None:
+            self.pool.close()
+            self.pool = None
+
+    def create_batch(self, locations, progress=None, matrices=None,
+                     source=None):
+        """Creates an instance at every location with one transform write each
+
+        When the last scatter of the same source still exists and
+        rescatter_in_place is on, its instances are reused instead. Each
+        instance is matched by its location key: matching instances get
+        their new transform in place, missing ones are created and unmatched
+        old ones are deleted. A cancelled re-scatter deletes nothing: the old
+        instances it did not get to stay in the result with their old keys
+        and matrices, so the next re-scatter still finds them.
+
+        Args:
+            matrices (numpy.ndarray): the (n, 4, 4) matrices of locations,
+                built when not given
+            source (str): object to instance, defaults to the selected one
+
+        Returns:
+            list: names of the instances, in the order of locations
+        """
+        source = source or self.selected_object
+        if matrices is None:
+            matrices = self.build_matrices(locations)
+        keys = self.packed_keys(locations)
+        names = [None] * len(keys)
+        old_indices = np.full(len(keys), -1, dtype=np.int64)
+        removed = []
+        previous = (self.scatter_results[source]
+                    if self._can_rescatter(source) else None)
+        if previous is None:
+            with metrics.phase("node_creation"):
+                group = cmds.group(empty=True, name=source + "_scatter_grp")
+        else:
+            group = previous.group
+            alive = set(cmds.ls(previous.instances) or [])
+            _, new_index, old_index = np.intersect1d(
+                keys, previous.keys, return_indices=True)
+            for new, old in zip(new_index, old_index):
+                if previous.instances[old] in alive:
+                    names[new] = previous.instances[old]
+                    old_indices[new] = old
+            kept = set(old_index.tolist())
+            removed = [index for index, name in enumerate(previous.instances)
+                       if index not in kept and name in alive]
+        items = list(zip(names, matrices))
+        instances = self.create_chunked(
+            items, partial(self._update_transform, source=source), progress)
+        done = len(instances)
+        created = [index for index, (name, _) in enumerate(items[:done])
+                   if name is None]
+        if created:
+            # not relative, so the world matrices written stay as they are
+            with metrics.phase("node_creation"):
+                parented = cmds.parent([instances[index] for index in created],
+                                       group)
+            for index, name in zip(created, parented):
+                instances[index] = name
+        untouched = np.zeros(0, dtype=np.int64)
+        if done == len(items) and removed:
+            with metrics.phase("node_creation"):
+                cmds.delete([previous.instances[index] for index in removed])
+        elif done < len(items) and previous is not None:
+            rest = old_indices[done:]
+            untouched = np.concatenate([rest[rest >= 0],
+                                        np.array(removed, dtype=np.int64)])
+            removed = []
+        log.info("Scatter: %d updated, %d created, %d deleted",
+                 done - len(created), len(created), len(removed))
+        self.last_scatter = ScatterResult(
+            group, source,
+            np.concatenate([keys[:done], previous.keys[untouched]])
+            if len(untouched) else keys[:done],
+            instances + [previous.instances[index] for index in untouched],
+            self.seed,
+            np.concatenate([matrices[:done], previous.matrices[untouched]])
+            if len(untouched) else matrices[:done],
+            self.parameters(), self.target_names())
+        return instances
+
+    def _can_rescatter(self, source):
+        previous = self.scatter_results.get(source)
+        return (self.rescatter_in_place and previous is not None and
+                previous.group is not None and
+                cmds.objExists(previous.group))
+
+    def parameters(self):
+        """Returns the settings in parameter_names as a dict"""
+        return {name: getattr(self, name) for name in self.parameter_names}
+
+    def set_parameters(self, parameters):
+        """Sets the settings in parameter_names from a dict, skipping unknown keys"""
+        for name in self.parameter_names:
+            if name in parameters:
+                setattr(self, name, parameters[name])
+
+    def target_names(self):
+        """Returns the names of the meshes or objects scattered onto"""
+        targets = self.selected_location
+        if isinstance(targets, scattercore.VertexSet):
+            return list(targets.meshes)
+        names = []
+        for target in targets:
+            name = target.split(".", 1)[0]
+            if name not in names:
+                names.append(name)
+        return names
+
+    def save_cache(self, path):
+        """Saves every scatter in scatter_results to a scattercache file
+
+        Every instance is saved with the index of its source, so a scatter
+        of several sources or with a proxy loads back whole. The seed and
+        settings saved are those of the last scatter.
+
+        Raises:
+            ValueError: if nothing was scattered with the batched path yet
+        """
+        results = [result for _, result in sorted(self.scatter_results.items())
+                   if result.matrices is not None and self._exists(result)]
+        if not results:
+            raise ValueError("There is no scatter to save")
+        last = self.last_scatter if self.last_scatter in results else results[0]
+        targets = []
+        for result in results:
+            targets.extend(target for target in result.targets or []
+                           if target not in targets)
+        scattercache.save(
+            path, np.concatenate([result.matrices for result in results]),
+            np.concatenate([result.keys for result in results]),
+            [result.source for result in results], last.seed, targets,
+            last.parameters,
+            np.repeat(np.arange(len(results)),
+                      [len(result.keys) for result in results]))
+        log.info("Saved %s to %s", ", ".join(
+            "{} {}".format(len(result.keys), result.source)
+            for result in results), path)
+
+    def _exists(self, result):
+        node = result.group if result.group is not None else result.instancer
+        return bool(node) and cmds.objExists(node)
+
+    def load_cache(self, path, progress=None, sources=None):
+        """Rebuilds a saved scatter in output_mode
+
+        Every saved source gets its own group or instancer, like a scatter,
+        so the result can be saved again or updated by a re-scatter of the
+        same objects, and the settings the cache was saved with are
+        restored, see set_parameters. Transforms are read chunk_size
+        instances at a time from the mapped file.
+
+        Args:
+            path (str): the scattercache file
+            progress (callable): see scatter_each, counts the instances of
+                all sources
+            sources (dict): saved source to the object to instance instead,
+                the saved ones by default
+
+        Returns:
+            list or str: the created instances, or the instancer particle
+            shape, a list of shapes with several sources
+
+        Raises:
+            ValueError: if path is not a scatter cache, or an object to
+                instance is not in the scene, checked before anything is
+                created
+        """
+        sources = sources or {}
+        with scattercache.ScatterCache(path) as cache, \
+                undo_chunk("load scatter cache"):
+            missing = [sources.get(saved, saved) for saved in cache.sources
+                       if not cmds.objExists(sources.get(saved, saved))]
+            if missing:
+                raise ValueError("The cached objects are not in the scene: "
+                                 "{}".format(", ".join(missing)))
+            self.set_parameters(cache.parameters)
+            shared = SharedProgress(progress, len(cache))
+            created = []
+            for index, saved in enumerate(cache.sources):
+                rows = np.flatnonzero(cache.source_ids == index)
+                count = len(rows)
+                if not count:
+                    continue
+                if rows[-1] - rows[0] + 1 == count:
+                    # sources are saved one after another, and a slice of
+                    # the mapped arrays is only read as it is used
+                    rows = slice(rows[0], rows[-1] + 1)
+                output = self._load_rows(cache, rows, sources.get(saved, saved),
+                                         shared.part(count))
+                if self.output_mode == OUTPUT_INSTANCER:
+                    created.append(output)
+                else:
+                    created.extend(output)
+                if shared.cancelled:
+                    break
+            if self.output_mode == OUTPUT_INSTANCER and len(created) == 1:
+                return created[0]
+            return created
+
+    def _load_rows(self, cache, rows, source, progress):
+        """Rebuilds the instances of one source from rows of a cache"""
+        if self.output_mode == OUTPUT_INSTANCER:
+            matrices = np.array(cache.matrices[rows])
+            shape = self._create_instancer_node(matrices, source)
+            self.last_scatter = ScatterResult(
+                None, source, np.array(cache.keys[rows]), [], cache.seed,
+                matrices, cache.parameters, cache.targets, shape)
+            progress(len(matrices), len(matrices))
+            return shape
+        instances = self.create_chunked(
+            cache.matrices[rows],
+            partial(self._create_transform, source=source), progress)
+        group = cmds.group(empty=True, name=source + "_scatter_grp")
+        if instances:
+            instances = cmds.parent(instances, group)
+        self.last_scatter = ScatterResult(
+            group, source, np.array(cache.keys[rows][:len(instances)]),
+            instances, cache.seed,
+            np.array(cache.matrices[rows][:len(instances)]), cache.parameters,
+            cache.targets)
+        return instances
+
+    def _update_transform(self, item, source=None):
+        name, matrix = item
+        if name is None:
+            return self._create_transform(matrix, source)
+        with metrics.phase("transform_apply"):
+            cmds.xform(name, matrix=matrix.ravel().tolist(), worldSpace=True)
+        return name
+
+    def create_transforms(self, matrices, progress=None, source=None):
+        """Creates one instance of source per (4, 4) world matrix
+
+        Args:
+            source (str): object to instance, defaults to the selected one
+
+        Returns:
+            list: names of the created instances
+        """
+        return self.create_chunked(
+            matrices, partial(self._create_transform, source=source), progress)
+
+    def _create_transform(self, matrix, source=None):
+        source = source or self.selected_object
+        with metrics.phase("node_creation"):
+            instance_object = cmds.instance(source, name=source)[0]
+        with metrics.phase("transform_apply"):
+            cmds.xform(instance_object, matrix=matrix.ravel().tolist(),
+                       worldSpace=True)
+        return instance_object
+
+    def create_instancer(self, locations, matrices=None, source=None):
+        """Scatters onto one particle instancer instead of one transform per location
+
+        Positions, rotations and scales are written as per-particle arrays so
+        the node count stays the same no matter how many points there are.
+        With rescatter_in_place the instancer of the last scatter of the
+        same source is deleted first, so re-scatters do not pile them up.
+
+        Args:
+            matrices (numpy.ndarray): the (n, 4, 4) matrices of locations,
+                built when not given
+            source (str): object to instance, defaults to the selected one
+
+        Returns:
+            str: the name of the particle shape
+        """
+        source = source or self.selected_object
+        if matrices is None:
+            matrices = self.build_matrices(locations)
+        previous = self.scatter_results.get(source)
+        with metrics.phase("node_creation"):
+            if (self.rescatter_in_place and previous is not None and
+                    previous.instancer and cmds.objExists(previous.instancer)):
+                self._delete_instancer(previous.instancer)
+            shape = self._create_instancer_node(matrices, source)
+        self.last_scatter = ScatterResult(
+            None, source, self.packed_keys(locations), [], self.seed,
+            matrices, self.parameters(), self.target_names(), shape)
+        return shape
+
+    def _create_instancer_node(self, matrices, source):
+        scales, rotations, positions = scattercore.decompose_matrices(matrices)
+        particle, shape = cmds.particle(position=positions.tolist(),
+                                        name=source + "_scatter")
+        for attribute, values in (("rotationPP", rotations), ("scalePP", scales)):
+            cmds.addAttr(shape, longName=attribute, dataType="vectorArray")
+            cmds.addAttr(shape, longName=attribute + "0", dataType="vectorArray")
+            cmds.setAttr(shape + "." + attribute, len(values),
+                         *[tuple(value) for value in values.tolist()],
+                         type="vectorArray")
+        cmds.saveInitialState(shape)
+        cmds.particleInstancer(shape, addObject=True, object=source,
+                               position="worldPosition",
+                               rotation="rotationPP", scale="scalePP")
+        self.instancer = shape
+        return shape
+
+    def _delete_instancer(self, shape):
+        cmds.delete(cmds.listConnections(shape, type="instancer") or [])
+        cmds.delete(cmds.listRelatives(shape, parent=True))
+        if shape == self.instancer:
+            self.instancer = None
+
+    def bake_instancer(self, shape=None, delete_instancer=True):
+        """Replaces scatter instancers with real instances of what they instanced
+
+        Without a shape every instancer in scatter_results is baked. Each
+        one is baked to the source its ScatterResult recorded, or for other
+        shapes to the object their particleInstancer instances. A deleted
+        instancer's result becomes a grouped transform scatter, so a
+        re-scatter updates the baked instances in place.
+
+        Returns:
+            list: names of the created instances
+        """
+        if shape:
+            shapes = [shape]
+        else:
+            shapes = [result.instancer
+                      for result in self.scatter_results.values()
+                      if result.instancer]
+            if self.instancer and self.instancer not in shapes:
+                shapes.append(self.instancer)
+        instances = []
+        with undo_chunk("bake scatter instancer"):
+            for name in shapes:
+                if cmds.objExists(name):
+                    instances.extend(self._bake(name, delete_instancer))
+        return instances
+
+    def _bake(self, shape, delete_instancer):
+        result = next((result for result in self.scatter_results.values()
+                       if result.instancer == shape), None)
+        source = (result.source if result is not None
+                  else self._instanced_object(shape))
+        positions = np.array(cmds.getAttr(shape + ".position"),
+                             dtype=np.float64).reshape(-1, 3)
+        rotations = np.array(cmds.getAttr(shape + ".rotationPP"),
+                             dtype=np.float64).reshape(-1, 3)
+        scales = np.array(cmds.getAttr(shape + ".scalePP"),
+                          dtype=np.float64).reshape(-1, 3)
+        matrices = scattercore.compose_matrices(
+            scales, scattercore.euler_to_matrices(rotations), positions)
+        instances = self.create_transforms(matrices, source=source)
+        if not delete_instancer:
+            return instances
+        self._delete_instancer(shape)
+        if result is not None and len(instances) == len(result.keys):
+            group = cmds.group(empty=True, name=source + "_scatter_grp")
+            instances = cmds.parent(instances, group)
+            self.scatter_results[source] = ScatterResult(
+                group, source, result.keys, instances, result.seed, matrices,
+                result.parameters, result.targets)
+        return instances
+
+    def _instanced_object(self, shape):
+        for instancer in cmds.listConnections(shape, type="instancer") or []:
+            objects = cmds.particleInstancer(shape, query=True, name=instancer,
+                                             object=True)
+            if objects:
+                return objects[0]
+        return self.selected_object
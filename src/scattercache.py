@@ -0,0 +1,152 @@
+"""Saves scatter results to a binary file and streams them back
+
+A cache is an uncompressed .npz file, so numpy and any zip tool can read
+it, but its arrays are stored as plain .npy members. ScatterCache maps the
+members straight from the file, so a cache of a million instances opens
+without reading it and is read one chunk at a time.
+
+Members:
+    header: JSON with the source objects, seed, targets and parameters
+    keys: (n,) uint64 instance keys, target stream << 32 | counter
+    matrices: (n, 4, 4) float64 world matrices
+    source_ids: (n,) uint32 index into the header's sources of every
+        instance, missing from version 1 caches of a single source
+"""
+import json
+import struct
+import zipfile
+
+import numpy as np
+
+VERSION = 2
+
+# Size of the fixed part of a zip local file header, before name and extra
+_LOCAL_HEADER_SIZE = 30
+
+
+def save(path, matrices, keys, source, seed, targets=(), parameters=None,
+         source_ids=None):
+    """Writes a scatter result to path
+
+    Args:
+        path (str): file to write, written as is without adding .npz
+        matrices (numpy.ndarray): (n, 4, 4) world matrix of every instance
+        keys (numpy.ndarray): (n,) packed key of every instance
+        source (str or list): the scattered object, or the list of them
+            source_ids index into
+        seed (int): seed of the scatter
+        targets (list): names of the scattered onto meshes or objects
+        parameters (dict): settings of the scatter, see
+            ScatterTool.parameters
+        source_ids (numpy.ndarray): (n,) index into source of the object
+            of every instance, all the first one by default
+    """
+    sources = [source] if isinstance(source, str) else list(source)
+    if source_ids is None:
+        source_ids = np.zeros(len(keys), dtype=np.uint32)
+    header = {"version": VERSION, "source": sources[0], "sources": sources,
+              "seed": seed, "targets": list(targets),
+              "parameters": parameters or {}}
+    with open(path, "wb") as stream:
+        np.savez(stream, header=np.array(json.dumps(header)),
+                 keys=np.asarray(keys, dtype=np.uint64),
+                 matrices=np.asarray(matrices, dtype=np.float64).reshape(-1, 4, 4),
+                 source_ids=np.asarray(source_ids, dtype=np.uint32))
+
+
+class ScatterCache(object):
+    """A saved scatter result with its arrays memory mapped
+
+    Attributes:
+        source (str): the first scattered object
+        sources (list): every scattered object
+        seed (int): seed of the scatter
+        targets (list): names of the scattered onto meshes or objects
+        parameters (dict): settings of the scatter
+        keys (numpy.memmap): (n,) packed key of every instance
+        matrices (numpy.memmap): (n, 4, 4) world matrix of every instance
+        source_ids (numpy.memmap): (n,) index into sources of the object
+            of every instance
+
+    Raises:
+        ValueError: if path is not a scatter cache or is a newer version
+    """
+
+    def __init__(self, path):
+        self.path = path
+        try:
+            with np.load(path) as archive:
+                header = json.loads(str(archive["header"]))
+                members = archive.files
+            if header.get("version", 0) > VERSION:
+                raise ValueError("Scatter cache {} is version {}, newer than "
+                                 "{}".format(path, header["version"], VERSION))
+            self.source = header["source"]
+            self.seed = header["seed"]
+            self.targets = header["targets"]
+            self.parameters = header["parameters"]
+            self.keys = map_member(path, "keys")
+            self.matrices = map_member(path, "matrices")
+        except KeyError as err:
+            raise ValueError("{} is not a scatter cache: {}".format(
+                path, err.args[0]))
+        self.sources = header.get("sources") or [self.source]
+        if "source_ids" in members:
+            self.source_ids = map_member(path, "source_ids")
+        else:
+            self.source_ids = np.broadcast_to(np.uint32(0), self.keys.shape)
+
+    def __len__(self):
+        return len(self.keys)
+
+    def chunks(self, chunk_size):
+        """Yields (keys, matrices) arrays of at most chunk_size instances
+
+        Only the yielded chunk is read from the file.
+        """
+        for start in range(0, len(self), chunk_size):
+            yield (np.array(self.keys[start:start + chunk_size]),
+                   np.array(self.matrices[start:start + chunk_size]))
+
+    def close(self):
+        """Drops the mapped arrays
+
+        The file is unmapped once no view taken from them is left, so
+        callers copy what they keep, as chunks does.
+        """
+        self.keys = self.matrices = self.source_ids = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def map_member(path, name):
+    """Memory maps the array stored as name.npy in an uncompressed .npz file
+
+    Raises:
+        ValueError: if the member is compressed and cannot be mapped
+    """
+    with zipfile.ZipFile(path) as archive:
+        info = archive.getinfo(name + ".npy")
+    if info.compress_type != zipfile.ZIP_STORED:
+        raise ValueError("{} in {} is compressed".format(name, path))
+    with open(path, "rb") as stream:
+        stream.seek(info.header_offset)
+        local_header = stream.read(_LOCAL_HEADER_SIZE)
+        name_size, extra_size = struct.unpack("<HH", local_header[26:30])
+        stream.seek(name_size + extra_size, 1)
+        version = np.lib.format.read_magic(stream)
+        if version == (1, 0):
+            shape, fortran_order, dtype = \
+                np.lib.format.read_array_header_1_0(stream)
+        else:
+            shape, fortran_order, dtype = \
+                np.lib.format.read_array_header_2_0(stream)
+        offset = stream.tell()
+    if not np.prod(shape):
+        return np.empty(shape, dtype=dtype)
+    return np.memmap(path, dtype=dtype, mode="r", offset=offset, shape=shape,
+                     order="F" if fortran_order else "C")
@@ -0,0 +1,423 @@
+import re
+import zlib
+
+import numpy as np
+
+# Order of the random values drawn for each instance
+RANDOM_CHANNELS = ("scale_x", "scale_y", "scale_z",
+                   "rotation_x", "rotation_y", "rotation_z",
+                   "location_x", "location_y", "location_z")
+# First counter_random channel of each other use, clear of RANDOM_CHANNELS
+SELECT_CHANNEL = 32
+SURFACE_CHANNEL = 33
+THIN_CHANNEL = 34
+DENSITY_CHANNEL = 35
+SOURCE_CHANNEL = 36
+# First channel of the redrawn values of overlap retries, see retry_offset
+RETRY_CHANNEL = 64
+
+_GOLDEN = np.uint64(0x9E3779B97F4A7C15)
+
+VERTEX_RE = re.compile(r"^(?P<mesh>.+)\.vtx\[(?P<id>\d+)\]$")
+VERTEX_RANGE_RE = re.compile(
+    r"^(?P<mesh>.+)\.vtx\[(?P<start>\*|\d+)(?::(?P<end>\d+))?\]$")
+
+
+class VertexSamples(object):
+    """An ordered list of vertices, stored as mesh names plus two int arrays
+
+    Attributes:
+        meshes (list): names of the meshes the vertices belong to
+        mesh_indices (numpy.ndarray): index into meshes for every vertex
+        vertex_ids (numpy.ndarray): vertex id of every vertex
+    """
+
+    def __init__(self, meshes, mesh_indices, vertex_ids):
+        self.meshes = meshes
+        self.mesh_indices = mesh_indices
+        self.vertex_ids = vertex_ids
+
+    def __len__(self):
+        return len(self.vertex_ids)
+
+    def __iter__(self):
+        """Yields component strings like "pCube1.vtx[12]" for each vertex"""
+        for mesh_index, vertex_id in zip(self.mesh_indices, self.vertex_ids):
+            yield "{}.vtx[{}]".format(self.meshes[mesh_index], vertex_id)
+
+    def gather(self, arrays_by_mesh):
+        """Looks up a per-vertex row for every vertex
+
+        Args:
+            arrays_by_mesh (callable): returns the (vertex count, k) array of a mesh
+
+        Returns:
+            numpy.ndarray: (n, k) array in the order of the samples
+        """
+        result = None
+        for mesh_index, mesh in enumerate(self.meshes):
+            mask = self.mesh_indices == mesh_index
+            if not mask.any():
+                continue
+            values = arrays_by_mesh(mesh)
+            if result is None:
+                result = np.empty((len(self),) + values.shape[1:], values.dtype)
+            result[mask] = values[self.vertex_ids[mask]]
+        if result is None:
+            result = np.empty((0, 3))
+        return result
+
+
+class VertexSet(object):
+    """Vertex ids of one or more meshes kept as sorted unique int arrays
+
+    Replaces lists of "pCube1.vtx[12]" strings, which cost a python string
+    per vertex. Selections of hundreds of thousands of vertices only take a
+    few bytes per vertex.
+    """
+
+    def __init__(self):
+        self._ids = {}
+        self.meshes = []
+
+    @classmethod
+    def from_components(cls, components, vertex_count=None):
+        """Builds a set from component strings such as "pPlane1.vtx[0:99]"
+
+        Args:
+            components (list): vertex components, single ids, ranges or "*"
+            vertex_count (callable): returns the vertex count of a mesh, only
+                needed for "*" components
+        """
+        starts = {}
+        for component in components or []:
+            match = VERTEX_RANGE_RE.match(component)
+            if not match:
+                raise ValueError("Not a vertex component: {}".format(component))
+            mesh = match.group("mesh")
+            if match.group("start") == "*":
+                start, end = 0, vertex_count(mesh) - 1
+            else:
+                start = int(match.group("start"))
+                end = int(match.group("end") or start)
+            starts.setdefault(mesh, []).append((start, end))
+        vertex_set = cls()
+        for mesh, ranges in starts.items():
+            vertex_set.add(mesh, np.concatenate(
+                [np.arange(start, end + 1, dtype=np.int32)
+                 for start, end in ranges]))
+        return vertex_set
+
+    def add(self, mesh, vertex_ids):
+        """Adds vertex ids of a mesh to the set"""
+        vertex_ids = np.unique(np.asarray(vertex_ids, dtype=np.int32))
+        if mesh in self._ids:
+            vertex_ids = np.union1d(self._ids[mesh], vertex_ids)
+        else:
+            self.meshes.append(mesh)
+        self._ids[mesh] = vertex_ids
+
+    def ids(self, mesh):
+        """Returns the sorted vertex ids of a mesh"""
+        return self._ids[mesh]
+
+    def ranges(self, mesh):
+        """Returns the vertex ids of a mesh as (n, 2) inclusive start, end runs"""
+        vertex_ids = self._ids[mesh]
+        if not len(vertex_ids):
+            return np.empty((0, 2), dtype=np.int32)
+        breaks = np.flatnonzero(np.diff(vertex_ids) != 1)
+        starts = np.concatenate([vertex_ids[:1], vertex_ids[breaks + 1]])
+        ends = np.concatenate([vertex_ids[breaks], vertex_ids[-1:]])
+        return np.stack([starts, ends], axis=1)
+
+    def __len__(self):
+        return sum(len(vertex_ids) for vertex_ids in self._ids.values())
+
+    def summary(self, mesh):
+        """Returns a short description such as: pPlane1: 482,113 verts"""
+        return "{}: {:,} verts".format(mesh, len(self._ids[mesh]))
+
+    def take(self, indices):
+        """Returns the vertices at flat indices into the set, in that order
+
+        Indices count through the meshes in order, then through each mesh's
+        sorted ids.
+
+        Returns:
+            VertexSamples: the picked vertices
+        """
+        indices = np.asarray(indices, dtype=np.int64)
+        counts = [len(self._ids[mesh]) for mesh in self.meshes]
+        offsets = np.cumsum([0] + counts)
+        mesh_indices = np.searchsorted(offsets, indices, side="right") - 1
+        vertex_ids = np.empty(len(indices), dtype=np.int32)
+        for mesh_index, mesh in enumerate(self.meshes):
+            mask = mesh_indices == mesh_index
+            vertex_ids[mask] = self._ids[mesh][indices[mask] - offsets[mesh_index]]
+        return VertexSamples(list(self.meshes), mesh_indices.astype(np.int32),
+                             vertex_ids)
+
+
+def parse_vertex_components(components):
+    """Splits vertex component strings like "pCube1.vtx[12]" into mesh and id.
+
+    Returns:
+        VertexSamples: the vertices in the order of the components
+    """
+    meshes = []
+    mesh_lookup = {}
+    mesh_indices = np.empty(len(components), dtype=np.int32)
+    vertex_ids = np.empty(len(components), dtype=np.int64)
+    for index, component in enumerate(components):
+        match = VERTEX_RE.match(component)
+        if not match:
+            raise ValueError("Not a vertex component: {}".format(component))
+        mesh = match.group("mesh")
+        if mesh not in mesh_lookup:
+            mesh_lookup[mesh] = len(meshes)
+            meshes.append(mesh)
+        mesh_indices[index] = mesh_lookup[mesh]
+        vertex_ids[index] = int(match.group("id"))
+    return VertexSamples(meshes, mesh_indices, vertex_ids)
+
+
+def stream_id(name):
+    """Returns a stable 32 bit id for a target name, the same in every session"""
+    return zlib.crc32(name.encode("utf-8")) & 0xffffffff
+
+
+def _mix64(values):
+    """SplitMix64 finalizer, scrambles every bit of uint64 values"""
+    values = values ^ (values >> np.uint64(30))
+    values = values * np.uint64(0xBF58476D1CE4E5B9)
+    values = values ^ (values >> np.uint64(27))
+    values = values * np.uint64(0x94D049BB133111EB)
+    return values ^ (values >> np.uint64(31))
+
+
+def counter_random(seed, streams, counters, channels, offset=0):
+    """Returns uniform [0, 1) values that only depend on their key
+
+    Value (i, c) is a hash of (seed, streams[i], counters[i], offset + c),
+    so instance i of a target gets the same values whatever else is drawn,
+    in whatever order or process, for the same seed.
+
+    Args:
+        seed (int): the scatter seed
+        streams (numpy.ndarray): (n,) target ids, see stream_id
+        counters (numpy.ndarray): (n,) instance ids within each target
+        channels (int): number of values per instance
+        offset (int): first channel, keeps different uses independent
+
+    Returns:
+        numpy.ndarray: (n, channels) array of floats
+    """
+    streams = np.asarray(streams, dtype=np.uint64)
+    counters = np.asarray(counters, dtype=np.uint64)
+    channel_ids = np.arange(offset + 1, offset + channels + 1, dtype=np.uint64)
+    with np.errstate(over="ignore"):
+        key = _mix64(np.uint64(seed & 0xffffffffffffffff) * _GOLDEN + streams)
+        key = _mix64(key + counters * _GOLDEN)
+        bits = _mix64(key[:, np.newaxis] + channel_ids * _GOLDEN)
+    return (bits >> np.uint64(11)).astype(np.float64) * (1.0 / (1 << 53))
+
+
+def weighted_choice(values, weights):
+    """Picks an index into weights per value, in proportion to the weights
+
+    Args:
+        values (numpy.ndarray): (n,) uniform [0, 1) values
+        weights (list): non-negative weight of every choice, not all 0
+
+    Returns:
+        numpy.ndarray: (n,) int64 chosen indices
+    """
+    cumulative = np.cumsum(np.asarray(weights, dtype=np.float64))
+    if not cumulative.size or cumulative[-1] <= 0.0:
+        raise ValueError("Weights must have a positive sum")
+    picked = np.searchsorted(cumulative, np.asarray(values) * cumulative[-1],
+                             side="right")
+    return np.minimum(picked, len(cumulative) - 1).astype(np.int64)
+
+
+def uniform_from(values, mins, maxs):
+    """Scales [0, 1) values into per-column ranges the way random.uniform does"""
+    mins = np.asarray(mins, dtype=np.float64)
+    maxs = np.asarray(maxs, dtype=np.float64)
+    return mins + (maxs - mins) * values
+
+
+def euler_to_matrices(rotations):
+    """Converts xyz rotate order euler angles in degrees to 3x3 matrices.
+
+    Matrices use Maya's row vector convention, so a point is transformed
+    with ``point * matrix``.
+
+    Args:
+        rotations (numpy.ndarray): (n, 3) array of angles in degrees
+
+    Returns:
+        numpy.ndarray: (n, 3, 3) rotation matrices
+    """
+    radians = np.radians(np.asarray(rotations, dtype=np.float64))
+    cos = np.cos(radians)
+    sin = np.sin(radians)
+    cx, cy, cz = cos[:, 0], cos[:, 1], cos[:, 2]
+    sx, sy, sz = sin[:, 0], sin[:, 1], sin[:, 2]
+    matrices = np.empty((len(radians), 3, 3))
+    matrices[:, 0, 0] = cy * cz
+    matrices[:, 0, 1] = cy * sz
+    matrices[:, 0, 2] = -sy
+    matrices[:, 1, 0] = sx * sy * cz - cx * sz
+    matrices[:, 1, 1] = sx * sy * sz + cx * cz
+    matrices[:, 1, 2] = sx * cy
+    matrices[:, 2, 0] = cx * sy * cz + sx * sz
+    matrices[:, 2, 1] = cx * sy * sz - sx * cz
+    matrices[:, 2, 2] = cx * cy
+    return matrices
+
+
+def compose_matrices(scales, rotations, translations):
+    """Builds one 4x4 world matrix per instance from scale, rotation and translation.
+
+    Args:
+        scales (numpy.ndarray): (n, 3) scale values
+        rotations (numpy.ndarray): (n, 3, 3) rotation matrices
+        translations (numpy.ndarray): (n, 3) world positions
+
+    Returns:
+        numpy.ndarray: (n, 4, 4) matrices in Maya's row vector layout
+    """
+    count = len(translations)
+    matrices = np.zeros((count, 4, 4))
+    matrices[:, :3, :3] = np.asarray(scales)[:, :, np.newaxis] * rotations
+    matrices[:, 3, :3] = translations
+    matrices[:, 3, 3] = 1.0
+    return matrices
+
+
+def scale_by_density(matrices, densities, scale_mins):
+    """Pulls the scale of every instance toward the lower end of its range
+
+    A density of 1 keeps the drawn scale, 0 gives the minimum scale and
+    values between interpolate. Rows 0 to 2 of a matrix are its scaled
+    axes, so they are rescaled in place whatever the rotation.
+
+    Args:
+        matrices (numpy.ndarray): (n, 4, 4) instance matrices, changed in place
+        densities (numpy.ndarray): (n,) densities in [0, 1]
+        scale_mins (list): lower bound of the x, y and z scale
+
+    Returns:
+        numpy.ndarray: matrices
+    """
+    densities = np.clip(np.asarray(densities, dtype=np.float64), 0.0, 1.0)
+    scales = np.linalg.norm(matrices[:, :3, :3], axis=2)
+    mins = np.asarray(scale_mins, dtype=np.float64)
+    wanted = mins + (scales - mins) * densities[:, np.newaxis]
+    factors = np.where(scales > 0.0, wanted / np.maximum(scales, 1e-300), 0.0)
+    matrices[:, :3, :3] *= factors[:, :, np.newaxis]
+    return matrices
+
+
+def normal_alignment_matrices(normals):
+    """Builds rotations that point each instance's +Y axis along a normal.
+
+    Matches a normalConstraint with aimVector (0, 1, 0): the twist about the
+    normal keeps +X as close to world +X as possible, falling back to world
+    +Z when the normal is parallel to X. Multiply a random rotation on the
+    left to spin the instance about the normal.
+
+    Args:
+        normals (numpy.ndarray): (n, 3) world space normals
+
+    Returns:
+        numpy.ndarray: (n, 3, 3) rotation matrices in row vector layout
+    """
+    normals = np.asarray(normals, dtype=np.float64)
+    lengths = np.linalg.norm(normals, axis=1)
+    aim = np.where(lengths[:, np.newaxis] > 1e-12,
+                   normals / np.maximum(lengths, 1e-12)[:, np.newaxis],
+                   [0.0, 1.0, 0.0])
+    reference = np.zeros_like(aim)
+    parallel = np.abs(aim[:, 0]) > 0.999
+    reference[~parallel, 0] = 1.0
+    reference[parallel, 2] = 1.0
+    side = np.cross(reference, aim)
+    side /= np.linalg.norm(side, axis=1)[:, np.newaxis]
+    matrices = np.empty((len(aim), 3, 3))
+    matrices[:, 0] = np.cross(aim, side)
+    matrices[:, 1] = aim
+    matrices[:, 2] = side
+    return matrices
+
+
+def retry_offset(attempt):
+    """Returns the counter_random offset of the values of a retry attempt
+
+    Attempt 0 is the first draw, every retry gets RANDOM_CHANNELS of its own.
+    """
+    if not attempt:
+        return 0
+    return RETRY_CHANNEL + (attempt - 1) * len(RANDOM_CHANNELS)
+
+
+def instance_matrices(seed, streams, counters, positions, mins, maxs,
+                      normals=None, offset=0):
+    """Returns the (n, 4, 4) world matrix of every instance from its keys
+
+    Only depends on its arguments, so any split of the instances, computed
+    in any process, gives the same matrices.
+
+    Args:
+        seed (int): the scatter seed
+        streams (numpy.ndarray): (n,) target ids of the instances
+        counters (numpy.ndarray): (n,) instance ids within each target
+        positions (numpy.ndarray): (n, 3) world positions before offsets
+        mins (list): lower bound of every RANDOM_CHANNELS value
+        maxs (list): upper bound of every RANDOM_CHANNELS value
+        normals (numpy.ndarray): (n, 3) normals to align +Y to, optional
+        offset (int): first random channel, see retry_offset
+    """
+    values = uniform_from(
+        counter_random(seed, streams, counters, len(RANDOM_CHANNELS),
+                       offset=offset),
+        mins, maxs)
+    rotations = euler_to_matrices(values[:, 3:6])
+    if normals is not None and len(positions):
+        rotations = np.matmul(rotations, normal_alignment_matrices(normals))
+    return compose_matrices(values[:, 0:3], rotations,
+                            np.asarray(positions) + values[:, 6:9])
+
+
+def matrices_to_euler(rotations):
+    """Returns the xyz rotate order euler angles in degrees of (n, 3, 3) rotations"""
+    rotations = np.asarray(rotations, dtype=np.float64)
+    sin_y = np.clip(-rotations[:, 0, 2], -1.0, 1.0)
+    gimbal = np.abs(sin_y) >= 1.0 - 1e-12
+    angles = np.empty((len(rotations), 3))
+    angles[:, 0] = np.where(
+        gimbal, np.arctan2(-rotations[:, 2, 1], rotations[:, 1, 1]),
+        np.arctan2(rotations[:, 1, 2], rotations[:, 2, 2]))
+    angles[:, 1] = np.arcsin(sin_y)
+    angles[:, 2] = np.where(
+        gimbal, 0.0, np.arctan2(rotations[:, 0, 1], rotations[:, 0, 0]))
+    return np.degrees(angles)
+
+
+def matrix_to_euler(matrix):
+    """Returns the xyz rotate order euler angles in degrees of a 3x3 rotation"""
+    return matrices_to_euler([matrix])[0].tolist()
+
+
+def decompose_matrices(matrices):
+    """Splits (n, 4, 4) world matrices without shear back into their parts
+
+    Returns:
+        tuple: (n, 3) arrays of scales, euler rotations in degrees and translations
+    """
+    matrices = np.asarray(matrices, dtype=np.float64)
+    scales = np.linalg.norm(matrices[:, :3, :3], axis=2)
+    rotations = matrices[:, :3, :3] / scales[:, :, np.newaxis]
+    return scales, matrices_to_euler(rotations), matrices[:, 3, :3].copy()
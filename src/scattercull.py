@@ -0,0 +1,136 @@
+"""Camera frustum culling and distance thinning of scatter points
+
+Cameras are described by CameraView, one per frame, so nothing here needs
+Maya. Matrices use Maya's row vector layout and cameras look down -Z.
+"""
+import numpy as np
+
+import scattersample
+
+# Millimetres per inch, Maya gives focal lengths in mm and apertures in inches
+_MM_PER_INCH = 25.4
+
+
+class CameraView(object):
+    """A camera at one moment: where it is and what its frustum spans
+
+    Attributes:
+        matrix (numpy.ndarray): (4, 4) world matrix of the camera
+        tan_x (float): tangent of half the horizontal field of view
+        tan_y (float): tangent of half the vertical field of view
+        near (float): near clip distance
+        far (float): far clip distance
+    """
+
+    def __init__(self, matrix, tan_x, tan_y, near, far):
+        self.matrix = np.asarray(matrix, dtype=np.float64).reshape(4, 4)
+        self.tan_x = float(tan_x)
+        self.tan_y = float(tan_y)
+        self.near = float(near)
+        self.far = float(far)
+        self._inverse = np.linalg.inv(self.matrix)
+
+    @classmethod
+    def from_lens(cls, matrix, focal_length, horizontal_aperture,
+                  vertical_aperture, near, far):
+        """Makes a view from Maya camera attributes
+
+        Args:
+            focal_length (float): focal length in mm
+            horizontal_aperture (float): film gate width in inches
+            vertical_aperture (float): film gate height in inches
+        """
+        return cls(matrix,
+                   horizontal_aperture * _MM_PER_INCH / (2.0 * focal_length),
+                   vertical_aperture * _MM_PER_INCH / (2.0 * focal_length),
+                   near, far)
+
+    @property
+    def position(self):
+        return self.matrix[3, :3]
+
+    def camera_space(self, points):
+        """Returns (n, 3) points in the camera's space, in view along -Z"""
+        return np.asarray(points).dot(self._inverse[:3, :3]) + self._inverse[3, :3]
+
+    def contains(self, points, margin=0.0, radius=0.0):
+        """Returns a (n,) bool mask of the spheres touching the frustum
+
+        Args:
+            points (numpy.ndarray): (n, 3) sphere centers
+            margin (float): widens the frustum sides by this fraction of
+                the frame, 0.1 keeps a tenth more on every side
+            radius (float or numpy.ndarray): sphere radius, a negative one
+                tests that the whole sphere is inside instead
+        """
+        local = self.camera_space(points)
+        depth = -local[:, 2]
+        inside = (depth >= self.near - radius) & (depth <= self.far + radius)
+        for axis, tangent in ((0, self.tan_x), (1, self.tan_y)):
+            tangent *= 1.0 + margin
+            # distance to the side plane through the eye, positive outside
+            outside = ((np.abs(local[:, axis]) - depth * tangent) /
+                       np.sqrt(1.0 + tangent * tangent))
+            inside &= outside <= radius
+        return inside
+
+
+def cull(points, views, margin=0.0, cell_size=None):
+    """Returns a (n,) bool mask of the points inside the frustum of any view
+
+    Points are put in a grid and whole cells are tested by their bounding
+    sphere first, so only the points of cells on a frustum side are tested
+    one by one.
+
+    Args:
+        points (numpy.ndarray): (n, 3) world positions
+        views (list): CameraView of every frame
+        margin (float): see CameraView.contains
+        cell_size (float): grid cell size, by default a 64th of the bounds
+    """
+    points = np.asarray(points, dtype=np.float64).reshape(-1, 3)
+    visible = np.zeros(len(points), dtype=bool)
+    if not len(points) or not views:
+        return visible
+    if cell_size is None:
+        cell_size = np.ptp(points, axis=0).max() / 64.0
+    grid = scattersample.SpatialGrid(points, max(cell_size, 1e-6), 0)
+    centers = grid.origin + (grid.cell_coords + 0.5) * grid.cell_size
+    radius = 0.5 * np.sqrt(3.0) * grid.cell_size
+    for view in views:
+        touching = view.contains(centers, margin, radius)
+        inside = view.contains(centers, margin, -radius)
+        visible[grid.members(np.flatnonzero(inside))[1]] = True
+        _, edge = grid.members(np.flatnonzero(touching & ~inside))
+        edge = edge[~visible[edge]]
+        visible[edge[view.contains(points[edge], margin)]] = True
+    return visible
+
+
+def min_distances(points, views):
+    """Returns the (n,) distance of every point to the nearest camera position"""
+    points = np.asarray(points, dtype=np.float64).reshape(-1, 3)
+    distances = np.full(len(points), np.inf)
+    for view in views:
+        np.minimum(distances, np.linalg.norm(points - view.position, axis=1),
+                   out=distances)
+    return distances
+
+
+def thin_by_distance(distances, thin_distance, random_values):
+    """Returns a (n,) bool mask keeping fewer points the further they are
+
+    Points closer than thin_distance are all kept, further ones with
+    probability (thin_distance / distance) ** 2, which keeps about as many
+    points per area of the screen at any distance.
+
+    Args:
+        distances (numpy.ndarray): (n,) distance of every point to the camera
+        thin_distance (float): distance thinning starts at, 0 keeps all
+        random_values (numpy.ndarray): (n,) uniform [0, 1) value per point
+    """
+    distances = np.asarray(distances, dtype=np.float64)
+    if thin_distance <= 0.0:
+        return np.ones(len(distances), dtype=bool)
+    ratio = thin_distance / np.maximum(distances, 1e-12)
+    return random_values < np.minimum(ratio * ratio, 1.0)
@@ -0,0 +1,215 @@
+"""Computes scatter matrices in worker processes
+
+Target points, normals and instance keys are copied once into a shared
+memory block, workers attach to it by name, compute the matrices of their
+slice with scattercore.instance_matrices and write them straight back into
+the block. Only slice bounds travel through the pool, so the main thread's
+work is the export and applying the result.
+
+Nothing here imports Maya. Inside Maya the workers are started with mayapy,
+since Maya's own executable cannot run them.
+"""
+import logging
+import multiprocessing
+import os
+import sys
+import time
+
+import numpy as np
+
+try:
+    from multiprocessing import shared_memory
+except ImportError:  # Python 2 and 3.7 based Maya versions
+    shared_memory = None
+
+import scattercore
+
+log = logging.getLogger(__name__)
+
+_ALIGNMENT = 64
+
+
+class SharedArrays(object):
+    """Named numpy arrays laid out in one shared memory block
+
+    Create it in the main process with the arrays to share, pass spec to
+    other processes and call attach there to map the same memory.
+    """
+
+    def __init__(self, arrays):
+        self.layout = {}
+        size = 0
+        for name, array in arrays.items():
+            array = np.asarray(array)
+            self.layout[name] = (size, array.dtype.str, array.shape)
+            size += -(-array.nbytes // _ALIGNMENT) * _ALIGNMENT
+        self.memory = shared_memory.SharedMemory(create=True, size=max(size, 1))
+        self.arrays = _views(self.memory, self.layout)
+        for name, array in arrays.items():
+            self.arrays[name][...] = array
+
+    @property
+    def spec(self):
+        """tuple: (block name, layout) that attach needs"""
+        return self.memory.name, self.layout
+
+    def close(self):
+        """Releases and removes the block, views of it become invalid"""
+        self.arrays = {}
+        self.memory.close()
+        self.memory.unlink()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def attach(spec):
+    """Maps a SharedArrays block created by another process
+
+    Returns:
+        tuple: the SharedMemory to close when done and a dict of array views
+    """
+    name, layout = spec
+    memory = shared_memory.SharedMemory(name=name)
+    return memory, _views(memory, layout)
+
+
+def _views(memory, layout):
+    return {name: np.ndarray(shape, dtype=dtype, buffer=memory.buf,
+                             offset=offset)
+            for name, (offset, dtype, shape) in layout.items()}
+
+
+def worker_executable():
+    """Returns the python executable for worker processes
+
+    Inside Maya sys.executable is maya(.exe) itself, so the mayapy next to
+    it is used instead.
+    """
+    folder, name = os.path.split(sys.executable)
+    base, ext = os.path.splitext(name)
+    if base.lower() == "maya":
+        return os.path.join(folder, "mayapy" + ext)
+    return sys.executable
+
+
+def compute_slice(spec, start, stop, seed, mins, maxs, aligned, offset=0):
+    """Computes the matrices of instances start to stop of a shared block
+
+    Runs in the workers. The block holds the points of every target, the
+    row of each instance's point, its stream and counter ids and the
+    (n, 4, 4) matrices array the result is written to.
+
+    Returns:
+        tuple: (start, stop, seconds spent)
+    """
+    started = time.time()
+    memory, arrays = attach(spec)
+    try:
+        _compute_into(arrays, start, stop, seed, mins, maxs, aligned, offset)
+    finally:
+        arrays.clear()
+        memory.close()
+    return start, stop, time.time() - started
+
+
+def _compute_into(arrays, start, stop, seed, mins, maxs, aligned, offset):
+    rows = arrays["rows"][start:stop]
+    arrays["matrices"][start:stop] = scattercore.instance_matrices(
+        seed, arrays["streams"][start:stop], arrays["counters"][start:stop],
+        arrays["points"][rows], mins, maxs,
+        arrays["normals"][rows] if aligned else None, offset)
+
+
+def _compute_slice_args(args):
+    return compute_slice(*args)
+
+
+class ScatterPool(object):
+    """A pool of worker processes that computes instance matrices
+
+    The processes are started on first use and kept until close, so
+    repeated scatters do not pay the start up again.
+
+    Attributes:
+        workers (int): number of processes, defaults to the cpu count
+        slices_per_worker (int): jobs each worker gets on average, more
+            evens out uneven targets at a little overhead per job
+        last_timings (list): (start, stop, seconds) of every job of the
+            last compute
+    """
+
+    def __init__(self, workers=None, slices_per_worker=4):
+        self.workers = workers or multiprocessing.cpu_count()
+        self.slices_per_worker = slices_per_worker
+        self.last_timings = []
+        self._pool = None
+
+    @staticmethod
+    def available():
+        """Returns True if this Python has the shared memory the pool needs"""
+        return shared_memory is not None
+
+    def start(self):
+        if self._pool is None:
+            context = multiprocessing.get_context("spawn")
+            context.set_executable(worker_executable())
+            self._pool = context.Pool(self.workers)
+        return self._pool
+
+    def close(self):
+        if self._pool is not None:
+            self._pool.close()
+            self._pool.join()
+            self._pool = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def compute(self, seed, mins, maxs, points, rows, streams, counters,
+                normals=None, offset=0):
+        """Computes the matrix of every instance across the pool
+
+        Args:
+            seed (int): the scatter seed
+            mins (list): lower bound of every RANDOM_CHANNELS value
+            maxs (list): upper bound of every RANDOM_CHANNELS value
+            points (numpy.ndarray): (v, 3) points of all targets
+            rows (numpy.ndarray): (n,) index into points of every instance
+            streams (numpy.ndarray): (n,) target ids of the instances
+            counters (numpy.ndarray): (n,) instance ids within each target
+            normals (numpy.ndarray): (v, 3) normals to align to, optional
+            offset (int): first random channel, see scattercore.retry_offset
+
+        Returns:
+            numpy.ndarray: (n, 4, 4) matrices, the same as computing them
+            on the main thread
+        """
+        count = len(rows)
+        if not count:
+            return np.empty((0, 4, 4))
+        arrays = {"points": np.asarray(points, dtype=np.float64),
+                  "rows": np.asarray(rows, dtype=np.int64),
+                  "streams": np.asarray(streams, dtype=np.uint64),
+                  "counters": np.asarray(counters, dtype=np.uint64),
+                  "matrices": np.empty((count, 4, 4))}
+        if normals is not None:
+            arrays["normals"] = np.asarray(normals, dtype=np.float64)
+        pool = self.start()
+        bounds = np.linspace(0, count, self.workers * self.slices_per_worker + 1)
+        bounds = np.unique(bounds.astype(np.int64))
+        with SharedArrays(arrays) as shared:
+            jobs = [(shared.spec, int(start), int(stop), seed, list(mins),
+                     list(maxs), normals is not None, offset)
+                    for start, stop in zip(bounds[:-1], bounds[1:])]
+            started = time.time()
+            self.last_timings = pool.map(_compute_slice_args, jobs)
+            log.debug("Computed %d matrices in %d jobs on %d workers in %.3fs",
+                      count, len(jobs), self.workers, time.time() - started)
+            return shared.arrays["matrices"].copy()
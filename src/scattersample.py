@@ -0,0 +1,505 @@
+import itertools
+
+import numpy as np
+
+# Bits used for each axis when packing a grid cell into one int64 key
+_CELL_BITS = 21
+_CELL_MASK = (1 << _CELL_BITS) - 1
+# Radius levels sphere_pairs splits spheres into, each half the one before
+_RADIUS_LEVELS = 12
+# Query spheres sphere_pairs tests at once, bounds the memory of its pairs
+_PAIR_BLOCK = 1 << 16
+
+
+class SurfaceSamples(object):
+    """Points sampled on the faces of meshes
+
+    Attributes:
+        positions (numpy.ndarray): (n, 3) world space positions
+        normals (numpy.ndarray): (n, 3) interpolated unit normals or None
+        ids (numpy.ndarray): (n,) index of each point among the candidates
+        stream (int): id of the sampled targets for counter based randoms
+        densities (numpy.ndarray): (n,) interpolated densities or None
+    """
+
+    def __init__(self, positions, normals=None, ids=None, stream=0,
+                 densities=None):
+        self.positions = positions
+        self.normals = normals
+        self.ids = np.arange(len(positions)) if ids is None else ids
+        self.stream = stream
+        self.densities = densities
+
+    def __len__(self):
+        return len(self.positions)
+
+
+class SpatialGrid(object):
+    """Uniform grid over 3d points
+
+    Points are sorted by cell once, so the points of any cell are found
+    without a scan of every point. When the grid spans few enough cells a
+    dense table, padded by reach cells on every side, maps cell coordinates
+    straight to the cell. Otherwise packed int64 cell keys are searched.
+    """
+
+    dense_limit = 1 << 24
+
+    def __init__(self, points, cell_size, reach=2):
+        self.points = np.asarray(points, dtype=np.float64).reshape(-1, 3)
+        self.cell_size = float(cell_size)
+        self.origin = (self.points.min(axis=0) if len(self.points)
+                       else np.zeros(3))
+        cells = self.cells(self.points)
+        keys = self.keys(cells)
+        self.order = np.argsort(keys, kind="stable")
+        self.cell_keys, self.cell_starts, self.cell_counts = np.unique(
+            keys[self.order], return_index=True, return_counts=True)
+        self.cell_coords = cells[self.order[self.cell_starts]]
+        self.reach = reach
+        self._table = None
+        self._shape = ((self.cell_coords.max(axis=0) if len(cells)
+                        else np.zeros(3, dtype=np.int64)) + 1 + 2 * reach)
+        self._strides = np.array([self._shape[1] * self._shape[2],
+                                  self._shape[2], 1], dtype=np.int64)
+        if np.prod(self._shape) <= self.dense_limit:
+            self._table = np.full(int(np.prod(self._shape)), -1, dtype=np.int64)
+            self._table[(self.cell_coords + reach).dot(self._strides)] = \
+                np.arange(len(self.cell_keys))
+
+    def cells(self, points):
+        """Returns the integer (n, 3) cell coordinates of points"""
+        return np.floor((np.asarray(points) - self.origin) /
+                        self.cell_size).astype(np.int64)
+
+    @staticmethod
+    def keys(cells):
+        """Packs (..., 3) cell coordinates into int64 keys
+
+        Coordinates are offset so that neighbours a few cells below the
+        origin still get a valid key.
+        """
+        cells = np.asarray(cells, dtype=np.int64) + 4
+        return ((cells[..., 0] & _CELL_MASK) << (2 * _CELL_BITS) |
+                (cells[..., 1] & _CELL_MASK) << _CELL_BITS |
+                (cells[..., 2] & _CELL_MASK))
+
+    def lookup(self, cells):
+        """Returns the grid cell index of (..., 3) cell coordinates, -1 if empty"""
+        cells = np.asarray(cells, dtype=np.int64)
+        if self._table is not None:
+            padded = cells + self.reach
+            inside = ((padded >= 0) & (padded < self._shape)).all(axis=-1)
+            flat = np.where(inside, padded.dot(self._strides), 0)
+            return np.where(inside, self._table[flat], -1)
+        keys = self.keys(cells)
+        if not len(self.cell_keys):
+            return np.full(keys.shape, -1, dtype=np.int64)
+        index = np.minimum(np.searchsorted(self.cell_keys, keys),
+                           len(self.cell_keys) - 1)
+        return np.where(self.cell_keys[index] == keys, index, -1)
+
+    def neighbours(self, cell_indices, offsets):
+        """Returns the (n, k) cell indices next to grid cells, -1 if empty
+
+        Args:
+            cell_indices (numpy.ndarray): indices of occupied grid cells
+            offsets (numpy.ndarray): (k, 3) offsets no larger than reach
+        """
+        if self._table is None:
+            # packed keys are linear in the coordinates, so shifting a key
+            # by a packed offset gives the key of the neighbouring cell
+            offset_keys = self.keys(offsets) - self.keys(np.zeros(3))
+            keys = self.cell_keys[cell_indices][:, np.newaxis] + offset_keys
+            index = np.minimum(np.searchsorted(self.cell_keys, keys),
+                               len(self.cell_keys) - 1)
+            return np.where(self.cell_keys[index] == keys, index, -1)
+        flat = (self.cell_coords[cell_indices] + self.reach).dot(self._strides)
+        return self._table[flat[:, np.newaxis] + offsets.dot(self._strides)]
+
+    def members(self, cell_indices):
+        """Returns the points in grid cells as (position, point index) arrays
+
+        position is the index into cell_indices of each point's cell.
+        """
+        cell_indices = np.asarray(cell_indices, dtype=np.int64)
+        counts = self.cell_counts[cell_indices]
+        first = np.repeat(np.cumsum(counts) - counts, counts)
+        within = np.arange(counts.sum()) - first
+        return (np.repeat(np.arange(len(cell_indices)), counts),
+                self.order[np.repeat(self.cell_starts[cell_indices], counts) +
+                           within])
+
+
+def neighbour_offsets(reach):
+    """Returns the (k, 3) offsets of every cell within reach cells of a cell"""
+    steps = range(-reach, reach + 1)
+    return np.array(list(itertools.product(steps, steps, steps)), dtype=np.int64)
+
+
+def triangle_areas(points, triangles):
+    """Returns the area of every (n, 3) vertex id triangle"""
+    corners = points[triangles]
+    cross = np.cross(corners[:, 1] - corners[:, 0], corners[:, 2] - corners[:, 0])
+    return 0.5 * np.linalg.norm(cross, axis=1)
+
+
+def sample_triangles(points, triangles, values, normals=None, densities=None):
+    """Places points on triangles with probability proportional to their area
+
+    Args:
+        points (numpy.ndarray): (v, 3) vertex positions
+        triangles (numpy.ndarray): (t, 3) vertex ids of each triangle
+        values (numpy.ndarray): (n, 3) uniform [0, 1) values, one row per sample
+        normals (numpy.ndarray): (v, 3) vertex normals to interpolate, optional
+        densities (numpy.ndarray): (v,) vertex densities to interpolate,
+            optional
+
+    Returns:
+        SurfaceSamples: n points on the surface
+    """
+    areas = triangle_areas(points, triangles)
+    cumulative = np.cumsum(areas)
+    picked = np.searchsorted(cumulative, values[:, 0] * cumulative[-1],
+                             side="right")
+    picked = np.minimum(picked, len(triangles) - 1)
+    root = np.sqrt(values[:, 1])
+    weights = np.stack([1.0 - root, root * (1.0 - values[:, 2]),
+                        root * values[:, 2]], axis=1)
+    corners = triangles[picked]
+    positions = np.einsum("nk,nkd->nd", weights, points[corners])
+    samples = SurfaceSamples(positions)
+    if normals is not None:
+        interpolated = np.einsum("nk,nkd->nd", weights, normals[corners])
+        lengths = np.linalg.norm(interpolated, axis=1)[:, np.newaxis]
+        samples.normals = interpolated / np.maximum(lengths, 1e-12)
+    if densities is not None:
+        samples.densities = np.einsum("nk,nk->n", weights, densities[corners])
+    return samples
+
+
+def sample_image(pixels, uvs):
+    """Bilinearly samples a single channel image at UV coordinates
+
+    UVs outside [0, 1] wrap around, like a repeating texture.
+
+    Args:
+        pixels (numpy.ndarray): (h, w) values, row 0 at v = 0
+        uvs (numpy.ndarray): (n, 2) UV coordinates
+
+    Returns:
+        numpy.ndarray: (n,) interpolated values
+    """
+    height, width = pixels.shape
+    uvs = np.asarray(uvs, dtype=np.float64).reshape(-1, 2)
+    # pixel centers sit at half pixels, so (0, 0) is the corner of the image
+    x = np.mod(uvs[:, 0], 1.0) * width - 0.5
+    y = np.mod(uvs[:, 1], 1.0) * height - 0.5
+    x0, y0 = np.floor(x), np.floor(y)
+    fx, fy = x - x0, y - y0
+    x0 = x0.astype(np.int64) % width
+    y0 = y0.astype(np.int64) % height
+    x1, y1 = (x0 + 1) % width, (y0 + 1) % height
+    top = pixels[y0, x0] * (1.0 - fx) + pixels[y0, x1] * fx
+    bottom = pixels[y1, x0] * (1.0 - fx) + pixels[y1, x1] * fx
+    return top * (1.0 - fy) + bottom * fy
+
+
+def poisson_disk(points, radius):
+    """Picks points so that no two picked points are closer than radius
+
+    Points are taken in order and a point is picked unless it is closer
+    than radius to a point picked before it, so give them in random order.
+    This is dart throwing with spheres of radius / 2 through
+    reject_overlaps, which picks the same points as testing one at a time.
+
+    Returns:
+        numpy.ndarray: sorted indices of the picked points
+    """
+    points = np.asarray(points, dtype=np.float64).reshape(-1, 3)
+    if not len(points) or radius <= 0.0:
+        return np.arange(len(points))
+    return np.flatnonzero(reject_overlaps(
+        points, np.full(len(points), 0.5 * radius)))
+
+
+def sample_surface(points, triangles, count, random_values, min_spacing=0.0,
+                   normals=None, oversample=4, densities=None):
+    """Scatters count points over triangles weighted by area
+
+    With a min_spacing the points are thinned into a Poisson-disk set, so
+    fewer than count points come back when the surface is too small to fit
+    them all.
+
+    Args:
+        points (numpy.ndarray): (v, 3) vertex positions
+        triangles (numpy.ndarray): (t, 3) vertex ids of each triangle
+        count (int): number of points wanted
+        random_values (callable): returns a (n, k) array of uniform values,
+            row i must only depend on i
+        min_spacing (float): minimum distance between any two points
+        normals (numpy.ndarray): (v, 3) vertex normals to interpolate, optional
+        oversample (int): candidates drawn per wanted point with min_spacing
+        densities (numpy.ndarray): (v,) vertex densities to interpolate,
+            optional
+
+    Returns:
+        SurfaceSamples: the sampled points
+    """
+    triangles = np.asarray(triangles, dtype=np.int64).reshape(-1, 3)
+    if not count or not len(triangles):
+        return SurfaceSamples(np.empty((0, 3)),
+                              None if normals is None else np.empty((0, 3)),
+                              densities=None if densities is None
+                              else np.empty(0))
+    candidate_count = count * oversample if min_spacing > 0.0 else count
+    samples = sample_triangles(points, triangles,
+                               random_values(candidate_count, 3), normals,
+                               densities)
+    if min_spacing <= 0.0:
+        return samples
+    picked = poisson_disk(samples.positions, min_spacing)[:count]
+    return SurfaceSamples(samples.positions[picked],
+                          None if samples.normals is None
+                          else samples.normals[picked], ids=picked,
+                          densities=None if samples.densities is None
+                          else samples.densities[picked])
+
+
+def bounding_radii(matrices, extent):
+    """Returns the radius of a sphere around each instance pivot holding its bounds
+
+    Args:
+        matrices (numpy.ndarray): (n, 4, 4) instance world matrices
+        extent (numpy.ndarray): (3,) largest distance of the source bounds
+            from its pivot along each axis, or (n, 3) one per instance
+    """
+    scales = np.linalg.norm(np.asarray(matrices)[:, :3, :3], axis=2)
+    return np.linalg.norm(scales * extent, axis=1)
+
+
+def _radius_levels(radii, top):
+    ratio = top / np.maximum(radii, top * 2.0 ** -_RADIUS_LEVELS)
+    return np.minimum(np.floor(np.log2(ratio)).astype(np.int64),
+                      _RADIUS_LEVELS - 1)
+
+
+def _grid_pairs(grid, points, reach):
+    """Returns (point, grid point) index pairs of points at most reach apart
+
+    Only the grid points in the neighbouring cells that come within reach
+    of a point are returned, some of them further than reach.
+    """
+    offsets = neighbour_offsets(1)
+    query_parts, member_parts = [], []
+    for start in range(0, len(points), _PAIR_BLOCK):
+        block = points[start:start + _PAIR_BLOCK]
+        cells = grid.cells(block)
+        # squared distance to the cell below, the own cell and the cell
+        # above on each axis, summed into the 27 neighbours in offset order
+        low = block - (grid.origin + cells * grid.cell_size)
+        gaps = np.stack([low * low, np.zeros_like(low),
+                         (grid.cell_size - low) ** 2], axis=2)
+        gap = (gaps[:, 0, :, np.newaxis, np.newaxis] +
+               gaps[:, 1, np.newaxis, :, np.newaxis] +
+               gaps[:, 2, np.newaxis, np.newaxis, :]).reshape(len(block), 27)
+        block_reach = reach[start:start + _PAIR_BLOCK, np.newaxis]
+        rows, columns = np.nonzero(gap < block_reach * block_reach)
+        found = grid.lookup(cells[rows] + offsets[columns])
+        rows, found = rows[found >= 0], found[found >= 0]
+        positions, members = grid.members(found)
+        query_parts.append(rows[positions] + start)
+        member_parts.append(members)
+    if not query_parts:
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64)
+    return np.concatenate(query_parts), np.concatenate(member_parts)
+
+
+class SphereSet(object):
+    """Spheres split into levels of radii a factor of two apart
+
+    Level l holds the radii in (top / 2 ** (l + 1), top / 2 ** l] and the
+    last level everything smaller. Every level gets a grid with cells twice
+    its largest radius on first use, so spheres no larger than that only
+    have to look in the 27 cells around them for overlaps.
+    """
+
+    def __init__(self, centers, radii, top):
+        self.centers = np.asarray(centers, dtype=np.float64).reshape(-1, 3)
+        self.radii = np.asarray(radii, dtype=np.float64)
+        self.top = float(top)
+        levels = _radius_levels(self.radii, self.top)
+        self.members = [np.flatnonzero(levels == level)
+                        for level in range(_RADIUS_LEVELS)]
+        self._grids = {}
+
+    def __len__(self):
+        return len(self.radii)
+
+    def bound(self, level):
+        """Returns the largest radius a sphere of level can have"""
+        return self.top * 0.5 ** level
+
+    def grid(self, level):
+        if level not in self._grids:
+            self._grids[level] = SpatialGrid(
+                self.centers[self.members[level]], 2.0 * self.bound(level), 1)
+        return self._grids[level]
+
+    def subset(self, indices):
+        """Returns a SphereSet of some of the spheres, indexed from zero"""
+        return SphereSet(self.centers[indices], self.radii[indices], self.top)
+
+
+def _level_pairs(spheres, level, queries, query_level):
+    """Returns the overlapping (query, sphere) pairs of one level of each set
+
+    The level with the larger radii is looked up in its grid by the other.
+    """
+    members = spheres.members[level]
+    asked = queries.members[query_level]
+    if not len(members) or not len(asked):
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64)
+    if level <= query_level:
+        found, hit = _grid_pairs(spheres.grid(level), queries.centers[asked],
+                                 queries.radii[asked] + spheres.bound(level))
+    else:
+        hit, found = _grid_pairs(queries.grid(query_level),
+                                 spheres.centers[members],
+                                 spheres.radii[members] +
+                                 queries.bound(query_level))
+    found, hit = asked[found], members[hit]
+    delta = queries.centers[found] - spheres.centers[hit]
+    reach = queries.radii[found] + spheres.radii[hit]
+    close = np.einsum("nd,nd->n", delta, delta) < reach * reach
+    return found[close], hit[close]
+
+
+def sphere_pairs(spheres, queries):
+    """Returns every overlapping pair of a query sphere and a sphere
+
+    Args:
+        spheres (SphereSet): the spheres
+        queries (SphereSet): the query spheres, with the same top
+
+    Returns:
+        tuple: (k,) indices into the query spheres and into the spheres
+    """
+    query_parts, member_parts = [np.empty(0, dtype=np.int64)], \
+        [np.empty(0, dtype=np.int64)]
+    for level in range(_RADIUS_LEVELS):
+        for query_level in range(_RADIUS_LEVELS):
+            found, hit = _level_pairs(spheres, level, queries, query_level)
+            query_parts.append(found)
+            member_parts.append(hit)
+    return np.concatenate(query_parts), np.concatenate(member_parts)
+
+
+def overlapping(spheres, queries):
+    """Returns a (n,) bool mask of the query spheres that overlap any sphere
+
+    Levels of larger spheres are tested first and queries already known to
+    overlap are left out of the rest. Crowded queries mostly overlap a large
+    sphere, so they skip the many small ones around them.
+    """
+    hit = np.zeros(len(queries), dtype=bool)
+    for level in range(_RADIUS_LEVELS):
+        if not len(spheres.members[level]):
+            continue
+        remaining = np.flatnonzero(~hit)
+        if not len(remaining):
+            break
+        subset = queries.subset(remaining)
+        for query_level in range(_RADIUS_LEVELS):
+            found, _ = _level_pairs(spheres, level, subset, query_level)
+            hit[remaining[found]] = True
+    return hit
+
+
+def greedy_independent(count, first, second):
+    """Picks items in index order, skipping any that conflict with an earlier pick
+
+    Gives the same picks as a loop over the items, but resolves every item
+    whose earlier conflicts are all decided in one vectorized round.
+
+    Args:
+        count (int): number of items
+        first (numpy.ndarray): (k,) earlier item of every conflict
+        second (numpy.ndarray): (k,) later item of every conflict
+
+    Returns:
+        numpy.ndarray: (count,) bool mask of the picked items
+    """
+    undecided, picked, dropped = 0, 1, -1
+    state = np.zeros(count, dtype=np.int8)
+    while True:
+        pending = state[second] == undecided
+        first, second = first[pending], second[pending]
+        waiting = np.zeros(count, dtype=bool)
+        waiting[second[state[first] == undecided]] = True
+        state[(state == undecided) & ~waiting] = picked
+        state[second[state[first] == picked]] = dropped
+        if not (state == undecided).any():
+            return state == picked
+
+
+def reject_overlaps(centers, radii, fixed_centers=None, fixed_radii=None,
+                    pair_budget=1 << 20):
+    """Keeps the spheres that overlap no fixed sphere and no earlier kept sphere
+
+    Give the spheres in random order: chains of overlapping spheres in
+    order take a round each to resolve. Spheres are taken a batch at a time
+    in order. Each batch is tested against everything kept so far, then its
+    own conflicts are resolved in order, which gives the same result as
+    testing one sphere at a time. The batch size adapts so a batch finds
+    about pair_budget overlaps, which keeps memory bounded however crowded
+    the spheres are.
+
+    Returns:
+        numpy.ndarray: (n,) bool mask of the kept spheres
+    """
+    centers = np.asarray(centers, dtype=np.float64).reshape(-1, 3)
+    radii = np.asarray(radii, dtype=np.float64)
+    keep = np.zeros(len(centers), dtype=bool)
+    if not len(centers):
+        return keep
+    settled_centers = (np.empty((0, 3)) if fixed_centers is None
+                       else np.asarray(fixed_centers).reshape(-1, 3))
+    settled_radii = (np.empty(0) if fixed_radii is None
+                     else np.asarray(fixed_radii, dtype=np.float64))
+    top = max(radii.max(), settled_radii.max() if len(settled_radii) else 0.0)
+    if top <= 0.0:
+        keep[:] = True
+        return keep
+    settled = SphereSet(settled_centers, settled_radii, top)
+    recent = []
+    batch_size = 1024
+    start = 0
+    while start < len(centers):
+        batch = np.arange(start, min(start + batch_size, len(centers)))
+        start += len(batch)
+        queries = SphereSet(centers[batch], radii[batch], top)
+        blocked = overlapping(settled, queries)
+        if recent:
+            blocked |= overlapping(
+                SphereSet(centers[np.concatenate(recent)],
+                          radii[np.concatenate(recent)], top), queries)
+        batch = batch[~blocked]
+        candidates = SphereSet(centers[batch], radii[batch], top)
+        found, hit = sphere_pairs(candidates, candidates)
+        distinct = found != hit
+        picked = batch[greedy_independent(
+            len(batch), np.minimum(found, hit)[distinct],
+            np.maximum(found, hit)[distinct])]
+        keep[picked] = True
+        recent.append(picked)
+        if sum(map(len, recent)) > max(1024, len(settled) // 4):
+            kept = np.concatenate(recent)
+            settled = SphereSet(np.concatenate([settled.centers, centers[kept]]),
+                                np.concatenate([settled.radii, radii[kept]]),
+                                top)
+            recent = []
+        batch_size = int(np.clip(
+            batch_size * min(2.0, pair_budget / max(len(found), 1.0)),
+            64, 1 << 16))
+    return keep
@@ -0,0 +1,270 @@
+"""A project wide SQLite catalog of scene file versions
+
+Every scene file named descriptor_task_vNNN.ext, see smartsave.SceneFile,
+is a row of (folder, descriptor, task, ver, ext, size, mtime), so the
+latest versions of a whole project or the history of one name are a
+single indexed query instead of a crawl of every scenes folder.
+
+The catalog is kept up to date by SceneFile saving through record and by
+scan, which walks a tree but only lists the folders whose modification
+time changed since they were last listed. The subfolders of an unchanged
+folder are taken from the catalog, so walking an unchanged project costs
+one stat per folder.
+
+Versions kept as a chunk manifest only are cataloged with the size and
+mtime of the file they stand for, see chunkstore.
+"""
+import collections
+import logging
+import os
+import sqlite3
+import time
+
+import chunkstore
+import fileutil
+import versionindex
+
+log = logging.getLogger(__name__)
+
+VERSION = 1
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS scenes (
+    folder TEXT NOT NULL,
+    descriptor TEXT NOT NULL,
+    task TEXT NOT NULL,
+    ver INTEGER NOT NULL,
+    ext TEXT NOT NULL,
+    size INTEGER,
+    mtime REAL,
+    PRIMARY KEY (folder, descriptor, task, ext, ver)
+);
+CREATE INDEX IF NOT EXISTS scenes_by_name ON scenes (descriptor, task, ext, ver);
+CREATE TABLE IF NOT EXISTS folders (
+    folder TEXT PRIMARY KEY,
+    parent TEXT,
+    mtime REAL
+);
+CREATE INDEX IF NOT EXISTS folders_by_parent ON folders (parent);
+"""
+
+Entry = collections.namedtuple(
+    "Entry", "folder descriptor task ver ext size mtime")
+
+
+class Catalog(object):
+    """An open catalog database
+
+    Use it as a context manager or close it, a connection can only be used
+    on the thread that opened it.
+
+    Attributes:
+        path (str): the database file
+        listed (int): folders listed by scans of this instance
+    """
+
+    def __init__(self, path):
+        self.path = str(path)
+        folder = os.path.dirname(self.path)
+        if folder and not os.path.isdir(folder):
+            try:
+                os.makedirs(folder)
+            except OSError:  # made by another process meanwhile
+                if not os.path.isdir(folder):
+                    raise
+        self.listed = 0
+        self._connection = sqlite3.connect(self.path, timeout=10.0)
+        self._connection.executescript(_SCHEMA)
+        version = self._connection.execute("PRAGMA user_version").fetchone()[0]
+        if version > VERSION:
+            self.close()
+            raise ValueError("Catalog {} is version {}, newer than {}".format(
+                self.path, version, VERSION))
+        self._connection.execute("PRAGMA user_version = {}".format(VERSION))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        self._connection.close()
+
+    def record(self, path):
+        """Adds or updates the row of a saved scene or manifest file
+
+        Returns:
+            bool: False if path is not named like a scene file
+        """
+        path = str(path)
+        parsed = versionindex.parse_name(os.path.basename(path))
+        if parsed is None:
+            return False
+        folder = _normalized(os.path.dirname(path))
+        if path.endswith(versionindex.MANIFEST_SUFFIX):
+            stats = _manifest_stats(path)
+        else:
+            stats = _file_stats(path)
+        with self._connection:
+            self._connection.execute(
+                "INSERT OR REPLACE INTO scenes VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (folder,) + parsed + stats)
+        return True
+
+    def scan(self, root):
+        """Brings the rows under root up to date, listing changed folders only
+
+        Folders that are gone are dropped with everything under them.
+
+        Returns:
+            int: number of folders listed
+        """
+        listed = self.listed
+        started = time.time()
+        pending = [_normalized(root)]
+        with self._connection:
+            while pending:
+                pending.extend(self._scan_folder(pending.pop()))
+        log.debug("Scanned %s in %.3fs, listed %d folders", root,
+                  time.time() - started, self.listed - listed)
+        return self.listed - listed
+
+    def scan_folder(self, folder):
+        """Brings the rows of one folder up to date, not its subfolders"""
+        with self._connection:
+            self._scan_folder(_normalized(folder))
+
+    def latest_version(self, folder, descriptor, task, ext):
+        """Returns the highest version of a name in folder, 0 when there is none"""
+        row = self._connection.execute(
+            "SELECT MAX(ver) FROM scenes WHERE folder = ? AND descriptor = ? "
+            "AND task = ? AND ext = ?",
+            (_normalized(folder), descriptor, task,
+             fileutil.dotted(ext))).fetchone()
+        return row[0] or 0
+
+    def latest(self, descriptor=None, task=None, ext=None, root=None):
+        """Returns the Entry of the latest version of every matching name
+
+        Args:
+            descriptor (str): only this descriptor, any by default
+            task (str): only this task, any by default
+            ext (str): only this extension, any by default
+            root (str): only folders under root, the whole catalog by default
+        """
+        where, values = _filters(descriptor, task, ext, root)
+        # SQLite fills the bare columns from the row holding the MAX
+        rows = self._connection.execute(
+            "SELECT folder, descriptor, task, MAX(ver), ext, size, mtime "
+            "FROM scenes" + where + " GROUP BY folder, descriptor, task, ext "
+            "ORDER BY folder, descriptor, task, ext", values)
+        return [Entry(*row) for row in rows]
+
+    def history(self, descriptor, task, ext=None, folder=None):
+        """Returns the Entry of every version of a name, oldest first"""
+        where, values = _filters(descriptor, task, ext)
+        if folder is not None:
+            where += " AND folder = ?"
+            values.append(_normalized(folder))
+        rows = self._connection.execute(
+            "SELECT folder, descriptor, task, ver, ext, size, mtime "
+            "FROM scenes" + where + " ORDER BY folder, ext, ver", values)
+        return [Entry(*row) for row in rows]
+
+    def _scan_folder(self, folder):
+        """Updates folder if it changed and returns its subfolders"""
+        connection = self._connection
+        row = connection.execute("SELECT mtime FROM folders WHERE folder = ?",
+                                 (folder,)).fetchone()
+        try:
+            mtime = os.stat(folder).st_mtime
+        except OSError:
+            if row is not None:
+                self._forget(folder)
+            return []
+        if row is not None and row[0] == mtime:
+            return [child for child, in connection.execute(
+                "SELECT folder FROM folders WHERE parent = ?", (folder,))]
+
+        self.listed += 1
+        files, subfolders = fileutil.list_folder(folder)
+        rows = {}
+        for name in files:
+            parsed = versionindex.parse_name(name)
+            if parsed is None:
+                continue
+            manifest = name.endswith(versionindex.MANIFEST_SUFFIX)
+            if manifest and parsed in rows:
+                continue
+            path = os.path.join(folder, name)
+            rows[parsed] = _manifest_stats(path) if manifest else _file_stats(path)
+        connection.execute("DELETE FROM scenes WHERE folder = ?", (folder,))
+        connection.executemany(
+            "INSERT INTO scenes VALUES (?, ?, ?, ?, ?, ?, ?)",
+            [(folder,) + parsed + stats for parsed, stats in rows.items()])
+
+        subfolders = [os.path.join(folder, name) for name in subfolders]
+        known = set(child for child, in connection.execute(
+            "SELECT folder FROM folders WHERE parent = ?", (folder,)))
+        for child in known.difference(subfolders):
+            self._forget(child)
+        connection.executemany(
+            "INSERT OR IGNORE INTO folders VALUES (?, ?, NULL)",
+            [(child, folder) for child in subfolders])
+        # a racy folder keeps no mtime, so it is listed again next time
+        if time.time() - mtime < fileutil.RACY_SECONDS:
+            mtime = None
+        connection.execute("INSERT OR REPLACE INTO folders VALUES (?, "
+                           "(SELECT parent FROM folders WHERE folder = ?), ?)",
+                           (folder, folder, mtime))
+        return subfolders
+
+    def _forget(self, folder):
+        clause, values = _under(folder)
+        for table in ("scenes", "folders"):
+            self._connection.execute(
+                "DELETE FROM {} WHERE {}".format(table, clause), values)
+
+
+def _filters(descriptor=None, task=None, ext=None, root=None):
+    clauses = []
+    values = []
+    for column, value in (("descriptor", descriptor), ("task", task),
+                          ("ext", fileutil.dotted(ext)
+                           if ext is not None else None)):
+        if value is not None:
+            clauses.append(column + " = ?")
+            values.append(value)
+    if root is not None:
+        clause, root_values = _under(_normalized(root))
+        clauses.append(clause)
+        values.extend(root_values)
+    return (" WHERE " + " AND ".join(clauses) if clauses else " WHERE 1"), values
+
+
+def _under(folder):
+    """Returns a WHERE clause and its values matching folder and all below it"""
+    prefix = folder.rstrip(os.sep) + os.sep
+    return ("(folder = ? OR substr(folder, 1, ?) = ?)",
+            [folder, len(prefix), prefix])
+
+
+def _file_stats(path):
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None, None
+    return stat.st_size, stat.st_mtime
+
+
+def _manifest_stats(path):
+    try:
+        manifest = chunkstore.read_manifest(path)
+    except (IOError, OSError, ValueError):
+        return None, None
+    return manifest.get("size"), manifest.get("mtime")
+
+
+def _normalized(folder):
+    return os.path.normpath(os.path.abspath(str(folder)))
@@ -1,6 +1,206 @@
-import maya.cmds as cmds
+"""Registers the tools as Maya menu and shelf entries without importing them
+
+Importing a tool pulls in PySide2 and PyMEL, which takes seconds, so the
+entries only name the module and the window class of every tool in TOOLS.
+The module is imported the first time its entry is used. To add the menu
+at startup, put this in userSetup.py:
+
+    import maya.utils
+    import simplemaya
+    maya.utils.executeDeferred(simplemaya.install_menu)
+
+What importing every tool costs is measured in a fresh interpreter, run
+it with mayapy to include the real Maya modules:
+
+    mayapy simplemaya.py
+    mayapy simplemaya.py --output imports.json
+    mayapy simplemaya.py --baseline imports.json
+"""
+import argparse
+import collections
+import importlib
+import json
+import os
+import re
+import subprocess
+import sys
+
+try:
+    import maya.cmds as cmds
+except ImportError:  # measuring imports outside of Maya, see main
+    cmds = None
+
+Tool = collections.namedtuple("Tool", "label module window annotation")
+
+TOOLS = (
+    Tool("Scatter", "scatter", "ScatterUI",
+         "Scatter instances of an object on vertices and faces"),
+    Tool("Smart Save", "smartsave", "SmartSaveUI",
+         "Save versioned scene files"),
+)
+MENU_NAME = "simpleMayaToolsMenu"
+SHELF_NAME = "SimpleMaya"
+
+_IMPORT_TIME_RE = re.compile(
+    r"^import time:\s+(?P<self>\d+)\s+\|\s+(?P<cumulative>\d+)\s+\|"
+    r"(?P<indent>\s+)(?P<module>\S+)$")
+
+# Open windows by tool label, Qt deletes a window nothing refers to
+_windows = {}
 
 
 def create_sphere():
     print("creating a sphere")
-    cmds.polysphere()
\ No newline at end of file
+    cmds.polysphere()
+
+
+def launch(label):
+    """Shows the window of a tool, importing the tool on first use
+
+    Returns:
+        QtWidgets.QDialog: the window, reused while it exists
+    """
+    tool = _tool(label)
+    window = _windows.get(label)
+    if window is None:
+        module = importlib.import_module(tool.module)
+        window = getattr(module, tool.window)()
+        _windows[label] = window
+    window.show()
+    window.raise_()
+    return window
+
+
+def install_menu(label="Tools"):
+    """Adds a menu with an item per tool to Maya's main window"""
+    if cmds.menu(MENU_NAME, exists=True):
+        cmds.deleteUI(MENU_NAME)
+    menu = cmds.menu(MENU_NAME, label=label, parent="MayaWindow",
+                     tearOff=True)
+    for tool in TOOLS:
+        cmds.menuItem(parent=menu, label=tool.label,
+                      annotation=tool.annotation, sourceType="python",
+                      command=_launch_command(tool))
+    return menu
+
+
+def install_shelf(name=SHELF_NAME):
+    """Adds a shelf with a button per tool, replacing one of the same name"""
+    if cmds.shelfLayout(name, exists=True):
+        cmds.deleteUI(name)
+    shelf = cmds.shelfLayout(name, parent="ShelfLayout")
+    for tool in TOOLS:
+        cmds.shelfButton(parent=shelf, label=tool.label,
+                         annotation=tool.annotation, image="pythonFamily.png",
+                         imageOverlayLabel=tool.label[:5], sourceType="python",
+                         command=_launch_command(tool))
+    return shelf
+
+
+def import_costs(module, fake=False):
+    """Imports module in a fresh interpreter and returns what every import cost
+
+    Uses python -X importtime, which needs Python 3.7 or later.
+
+    Args:
+        module (str): the module to import
+        fake (bool): install fakemaya first, for measuring outside of Maya
+
+    Returns:
+        list: (module, self seconds, cumulative seconds, depth) of every
+            module imported, in the order they finished
+    """
+    setup = "import fakemaya; fakemaya.install(); " if fake else ""
+    process = subprocess.Popen(
+        [sys.executable, "-X", "importtime", "-c", setup + "import " + module],
+        cwd=os.path.dirname(os.path.abspath(__file__)),
+        stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+        universal_newlines=True)
+    _, errors = process.communicate()
+    if process.returncode:
+        raise RuntimeError("Importing {} failed:\n{}".format(module, errors))
+    costs = []
+    for line in errors.splitlines():
+        match = _IMPORT_TIME_RE.match(line)
+        if match is not None:
+            costs.append((match.group("module"),
+                          int(match.group("self")) * 1e-6,
+                          int(match.group("cumulative")) * 1e-6,
+                          (len(match.group("indent")) - 1) // 2))
+    return costs
+
+
+def measure_imports(modules=None, fake=False, top=10):
+    """Returns the import cost of every tool module and its slowest imports
+
+    Returns:
+        dict: module name to {"seconds": cumulative seconds, "slowest":
+            [module, self seconds] of the top slowest imports}
+    """
+    report = {}
+    for module in modules or [tool.module for tool in TOOLS]:
+        costs = import_costs(module, fake)
+        total = next(cumulative for name, _, cumulative, _ in reversed(costs)
+                     if name == module)
+        slowest = sorted(costs, key=lambda cost: cost[1], reverse=True)[:top]
+        report[module] = {"seconds": total,
+                          "slowest": [[name, seconds]
+                                      for name, seconds, _, _ in slowest]}
+    return report
+
+
+def compare_imports(report, baseline, tolerance=0.2):
+    """Lists the modules that got slower to import than their baseline allows"""
+    regressions = []
+    for module, entry in sorted(report.items()):
+        base = baseline.get(module)
+        if (base is not None and
+                entry["seconds"] > base["seconds"] * (1.0 + tolerance)):
+            regressions.append("{}: {:.3f}s, baseline {:.3f}s".format(
+                module, entry["seconds"], base["seconds"]))
+    return regressions
+
+
+def _tool(label):
+    for tool in TOOLS:
+        if tool.label == label:
+            return tool
+    raise KeyError("No tool named {}".format(label))
+
+
+def _launch_command(tool):
+    return "import simplemaya; simplemaya.launch({!r})".format(tool.label)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Measures tool import times")
+    parser.add_argument("modules", nargs="*",
+                        help="modules to import, the tools by default")
+    parser.add_argument("--fake", action="store_true",
+                        help="import against fakemaya, outside of Maya")
+    parser.add_argument("--top", type=int, default=10)
+    parser.add_argument("--output", help="write the report to this JSON file")
+    parser.add_argument("--baseline", help="JSON report to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.2)
+    args = parser.parse_args(argv)
+
+    report = measure_imports(args.modules, args.fake, args.top)
+    for module, entry in sorted(report.items()):
+        print("{:>20} {:9.3f}s".format(module, entry["seconds"]))
+        for name, seconds in entry["slowest"]:
+            print("{:>20}   {:9.3f}s {}".format("", seconds, name))
+    if args.output:
+        with open(args.output, "w") as output:
+            json.dump(report, output, indent=2, sort_keys=True)
+    if args.baseline:
+        with open(args.baseline) as baseline:
+            regressions = compare_imports(report, json.load(baseline),
+                                          args.tolerance)
+        for regression in regressions:
+            print("REGRESSION " + regression)
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,4 +1,8 @@
 import logging
+import os
+import sqlite3
+import tempfile
+import uuid
 
 from PySide2 import QtWidgets, QtCore
 from shiboken2 import wrapInstance
@@ -7,6 +11,12 @@ import maya.cmds as cmds
 import pymel.core as pmc
 from pymel.core.system import Path
 
+import chunkstore
+import metrics
+import scenecatalog
+import stagedcopy
+import versionindex
+
 log = logging.getLogger(__name__)
 
 
@@ -27,20 +37,31 @@ class SmartSaveUI(QtWidgets.QDialog):
         self.setWindowFlags(self.windowFlags() ^
                             QtCore.Qt.WindowContextHelpButtonHint)
         self.scenefile = SceneFile()
+        self._prefill_next_ver()
         self.create_ui()
         self.create_connections()
 
+    def _prefill_next_ver(self):
+        """Starts the UI on the next free version, looked up in the catalog"""
+        try:
+            self.scenefile.ver = self.scenefile.catalog_next_ver()
+        except (sqlite3.Error, OSError, ValueError) as err:
+            log.warning("Could not read the scene catalog: %s", err)
+            self.scenefile.ver = self.scenefile.next_available_ver()
+
     def create_ui(self):
         self.title_lbl = QtWidgets.QLabel("Smart Save")
         self.title_lbl.setStyleSheet("font: bold 20px")
         self.folder_lay = self._create_folder_ui()
         self.filename_lay = self._create_filename_ui()
+        self.staged_lay = self._create_staged_ui()
         self.button_lay = self._create_button_ui()
         self.main_lay = QtWidgets.QVBoxLayout()
         self.main_lay.addWidget(self.title_lbl)
         self.main_lay.addLayout(self.folder_lay)
         self.main_lay.addLayout(self.filename_lay)
         self.main_lay.addStretch()
+        self.main_lay.addLayout(self.staged_lay)
         self.main_lay.addLayout(self.button_lay)
         self.setLayout(self.main_lay)
 
@@ -49,6 +70,8 @@ class SmartSaveUI(QtWidgets.QDialog):
         self.folder_browse_btn.clicked.connect(self._browse_folder)
         self.save_btn.clicked.connect(self._save)
         self.save_increment_btn.clicked.connect(self._save_increment)
+        self.copy_timer.timeout.connect(self._update_copy_progress)
+        self.restore_btn.clicked.connect(self._restore)
 
     @QtCore.Slot()
     def _save_increment(self):
@@ -56,12 +79,51 @@ class SmartSaveUI(QtWidgets.QDialog):
         self._set_scenefile_properties_from_ui()
         self.scenefile.save_increment()
         self.ver_sbx.setValue(self.scenefile.ver)
+        self._watch_copy()
 
     @QtCore.Slot()
     def _save(self):
         """Save the scene"""
         self._set_scenefile_properties_from_ui()
         self.scenefile.save()
+        self._watch_copy()
+
+    @QtCore.Slot()
+    def _restore(self):
+        """Rebuilds the version in the UI from its manifest"""
+        self._set_scenefile_properties_from_ui()
+        try:
+            self.scenefile.restore()
+        except (IOError, OSError, ValueError) as err:
+            QtWidgets.QMessageBox.warning(
+                self, "Smart Save", "Could not restore {}:\n{}".format(
+                    self.scenefile.path, err))
+
+    def _watch_copy(self):
+        """Shows the progress of a staged save's background copy"""
+        if self.scenefile.staged and self.scenefile.last_copy is not None:
+            self.copy_bar.setValue(0)
+            self.copy_bar.setFormat("Publishing %p%")
+            self.copy_timer.start()
+
+    @QtCore.Slot()
+    def _update_copy_progress(self):
+        copy = self.scenefile.last_copy
+        self.copy_bar.setValue(1000 * copy.copied // max(copy.total, 1))
+        if not copy.done.is_set():
+            return
+        self.copy_timer.stop()
+        if copy.error is None:
+            self.copy_bar.setFormat("Published")
+            return
+        if isinstance(copy.error, stagedcopy.CopyCancelled):
+            self.copy_bar.setFormat("Replaced by a newer save")
+            return
+        self.copy_bar.setFormat("Failed")
+        QtWidgets.QMessageBox.warning(
+            self, "Smart Save",
+            "Could not publish {}:\n{}\n\nThe scene is kept at {}".format(
+                copy.destination, copy.error, copy.source))
 
     def _set_scenefile_properties_from_ui(self):
         self.scenefile.folder_path = self.folder_le.text()
@@ -69,6 +131,8 @@ class SmartSaveUI(QtWidgets.QDialog):
         self.scenefile.task = self.task_le.text()
         self.scenefile.ver = self.ver_sbx.value()
         self.scenefile.ext = self.ext_lbl.text()
+        self.scenefile.staged = self.staged_chbx.isChecked()
+        self.scenefile.dedup = self.dedup_chbx.isChecked()
 
     @QtCore.Slot()
     def _browse_folder(self):
@@ -79,12 +143,28 @@ class SmartSaveUI(QtWidgets.QDialog):
                     QtWidgets.QFileDialog.DontResolveSymlinks)
         self.folder_le.setText(folder)
 
+    def _create_staged_ui(self):
+        self.staged_chbx = QtWidgets.QCheckBox("Save locally, publish in background")
+        self.copy_bar = QtWidgets.QProgressBar()
+        self.copy_bar.setRange(0, 1000)
+        self.copy_bar.setFormat("")
+        self.copy_timer = QtCore.QTimer(self)
+        self.copy_timer.setInterval(100)
+        self.dedup_chbx = QtWidgets.QCheckBox("Deduplicate versions")
+        layout = QtWidgets.QHBoxLayout()
+        layout.addWidget(self.staged_chbx)
+        layout.addWidget(self.copy_bar)
+        layout.addWidget(self.dedup_chbx)
+        return layout
+
     def _create_button_ui(self):
         self.save_btn = QtWidgets.QPushButton("Save")
         self.save_increment_btn = QtWidgets.QPushButton("Save Increment")
         layout = QtWidgets.QHBoxLayout()
         layout.addWidget(self.save_btn)
         layout.addWidget(self.save_increment_btn)
+        self.restore_btn = QtWidgets.QPushButton("Restore")
+        layout.addWidget(self.restore_btn)
         return layout
 
     def _create_filename_ui(self):
@@ -132,9 +212,19 @@ class SmartSaveUI(QtWidgets.QDialog):
 
 class SceneFile(object):
     """An abstract representation of a Scene File."""
+
+    # keep a sidecar version index in scene folders, see versionindex
+    version_sidecar = False
+
     def __init__(self, path=None):
-        self._folder_path = Path(cmds.workspace(query=True,
-                                               rootDirectory=True)) / "scenes"
+        workspace = Path(cmds.workspace(query=True, rootDirectory=True))
+        self._folder_path = workspace / "scenes"
+        self.staged = False
+        self.dedup = False
+        self.chunk_store = workspace / ".smartsave" / "chunks"
+        self.catalog_path = workspace / ".smartsave" / "catalog.sqlite"
+        self.scratch_folder = Path(tempfile.gettempdir()) / "smartsave"
+        self.last_copy = None
         self.descriptor = 'main'
         self.task = 'model'
         self.ver = 1
@@ -175,31 +265,182 @@ class SceneFile(object):
     def save(self):
         """Saves the scene file
 
+        With staged on the scene is published in the background, see
+        save_staged. With dedup on the saved file is also stored in
+        chunk_store, see store_version. The saved version is recorded in
+        the catalog at catalog_path unless that is None.
+
+        Copies of earlier staged saves still publishing to path are
+        cancelled first, so none of them puts an older file over this one.
+        Every save is a "save" operation of metrics.
+
         Returns:
             Path: the path to the scene file if successful
         """
+        with metrics.operation("save", folder=str(self.folder_path),
+                               staged=self.staged, dedup=self.dedup):
+            with metrics.phase("settle"):
+                stagedcopy.settle(self.path)
+            if self.staged:
+                return self.save_staged()
+            try:
+                with metrics.phase("write"):
+                    saved = pmc.system.saveAs(self.path)
+            except RuntimeError as err:
+                log.warning("Missing directories in path. "
+                            "Creating directories...")
+                with metrics.phase("directory_creation"):
+                    self.folder_path.makedirs_p()
+                with metrics.phase("write"):
+                    saved = pmc.system.saveAs(self.path)
+            if metrics.enabled():
+                metrics.count("bytes_written", os.path.getsize(self.path))
+            self._published(self.path)
+            return saved
+
+    def save_staged(self):
+        """Saves the scene to scratch_folder and publishes it to path in the background
+
+        Returns as soon as the local write is done, with the scene already
+        renamed to path. The file appears at path once the copy in
+        last_copy is verified, see stagedcopy.StagedCopy. A failed copy
+        leaves path as it was and keeps the local file.
+
+        Returns:
+            Path: the path the scene file is published to
+        """
+        with metrics.phase("directory_creation"):
+            if not self.folder_path.exists():
+                log.warning("Missing directories in path. "
+                            "Creating directories...")
+                self.folder_path.makedirs_p()
+            self.scratch_folder.makedirs_p()
+        local = self.scratch_folder / "{}_{}".format(uuid.uuid4().hex,
+                                                     self.filename)
+        with metrics.phase("write"):
+            pmc.system.saveAs(local)
+            pmc.system.renameFile(self.path)
+        if metrics.enabled():
+            metrics.count("bytes_written", os.path.getsize(local))
+        path = self.path
+        self.last_copy = stagedcopy.StagedCopy(
+            local, path, published=lambda: self._published(path)).start()
+        return self.path
+
+    def _published(self, path):
+        """Stores and catalogs a version once its file is in place"""
+        if self.dedup:
+            with metrics.phase("dedup"):
+                self.store_version(path)
+        with metrics.phase("catalog"):
+            self.record_version(path)
+
+    def record_version(self, path=None):
+        """Records a saved version in the catalog at catalog_path
+
+        A catalog that cannot be written is logged, the save stands.
+        """
+        if self.catalog_path is None:
+            return
         try:
-            return pmc.system.saveAs(self.path)
-        except RuntimeError as err:
-            log.warning("Missing directories in path. Creating directories...")
-            self.folder_path.makedirs_p()
-            return pmc.system.saveAs(self.path)
+            with scenecatalog.Catalog(self.catalog_path) as catalog:
+                catalog.record(path or self.path)
+        except (sqlite3.Error, OSError, ValueError) as err:
+            log.warning("Could not record %s in the scene catalog: %s",
+                        path or self.path, err)
+
+    def store_version(self, path=None):
+        """Stores a saved scene file in chunk_store next to its older versions
+
+        A manifest of the file is written to path + MANIFEST_SUFFIX. Older
+        versions of the same descriptor, task and extension are then only
+        kept as their manifest: their full file is removed if it is still
+        the one the manifest was written for and every chunk of it is in
+        the store the manifest names. The file at path stays a
+        real scene file that Maya opens as it is, older ones are rebuilt
+        with restore.
+
+        Args:
+            path (str): the saved file, path by default
+
+        Returns:
+            dict: the manifest of the file, see chunkstore
+        """
+        path = Path(path or self.path)
+        manifest = chunkstore.ChunkStore(self.chunk_store).store_file(path)
+        chunkstore.write_manifest(path + versionindex.MANIFEST_SUFFIX, manifest)
+        descriptor, task, ver, ext = versionindex.parse_name(path.name)
+        folder = path.parent
+        for name in os.listdir(folder):
+            parsed = versionindex.parse_name(name)
+            if (parsed is None or name.endswith(versionindex.MANIFEST_SUFFIX)
+                    or parsed != (descriptor, task, parsed[2], ext)
+                    or parsed[2] >= ver):
+                continue
+            older = folder / name
+            if _matches_manifest(older):
+                os.remove(older)
+                log.info("Kept %s as its manifest only", older)
+        return manifest
+
+    def restore(self):
+        """Rebuilds the scene file at path from its manifest
+
+        The rebuilt file gets the modification time it was stored with, so
+        the next store_version of a later version removes it again.
+
+        Returns:
+            Path: the path to the scene file
+
+        Raises:
+            IOError: if a chunk is missing or the rebuilt file differs
+        """
+        manifest = chunkstore.read_manifest(self.path +
+                                            versionindex.MANIFEST_SUFFIX)
+        store = chunkstore.ChunkStore(manifest.get("store") or self.chunk_store)
+        store.restore_file(manifest, self.path)
+        os.utime(self.path, (manifest["mtime"], manifest["mtime"]))
+        log.info("Restored %s", self.path)
+        return self.path
 
     def next_available_ver(self):
-        """Returns the next available version number in the folder."""
-        pattern = "{descriptor}_{task}_v*{ext}".format(
-            descriptor=self.descriptor, task=self.task, ext=self.ext)
-        matching_scenefiles = []
-        for file_ in self.folder_path.files():
-            if file_.name.fnmatch(pattern):
-                matching_scenefiles.append(file_)
-        if not matching_scenefiles:
-            return 1
-        matching_scenefiles.sort(reverse=True)
-        latest_scenefile = matching_scenefiles[0]
-        latest_scenefile = latest_scenefile.name.stripext()
-        latest_version_num = int(latest_scenefile.split("_v")[-1])
-        return latest_version_num + 1
+        """Returns the next available version number in the folder.
+
+        The folder is only listed again once it changed, see
+        versionindex.folder_index, and versions compare as numbers.
+        Versions still being published by a staged save count as taken.
+        """
+        index = versionindex.folder_index(self.folder_path,
+                                          sidecar=self.version_sidecar)
+        return max(index.latest_version(self.descriptor, self.task, self.ext),
+                   self._publishing_ver()) + 1
+
+    def catalog_next_ver(self):
+        """Returns the next available version number as the catalog has it
+
+        The folder is only listed when it changed since the catalog last
+        saw it, see scenecatalog.Catalog.scan_folder. Without a
+        catalog_path this is next_available_ver.
+
+        Raises:
+            sqlite3.Error: if the catalog cannot be read
+        """
+        if self.catalog_path is None:
+            return self.next_available_ver()
+        with scenecatalog.Catalog(self.catalog_path) as catalog:
+            catalog.scan_folder(self.folder_path)
+            latest = catalog.latest_version(self.folder_path, self.descriptor,
+                                            self.task, self.ext)
+        return max(latest, self._publishing_ver()) + 1
+
+    def _publishing_ver(self):
+        """Returns the highest version still being published by a staged save"""
+        publishing = versionindex.VersionIndex(self.folder_path)
+        folder = os.path.normpath(self.folder_path)
+        for destination in stagedcopy.in_flight():
+            if os.path.normpath(os.path.dirname(destination)) == folder:
+                publishing.add_name(os.path.basename(destination))
+        return publishing.latest_version(self.descriptor, self.task, self.ext)
 
     def save_increment(self):
         """Increments the version and saves the scene file.
@@ -210,6 +451,26 @@ class SceneFile(object):
         Returns:
             Path: The path to the scene file if successful
         """
-        self.ver = self.next_available_ver()
-        self.save()
+        with metrics.operation("save", increment=True):
+            with metrics.phase("version_lookup"):
+                self.ver = self.next_available_ver()
+            self.save()
+
+
+def _matches_manifest(path):
+    """Returns True if path can be rebuilt from its manifest alone
 
+    That is when it is the file the manifest was written for and every
+    chunk is in the store the manifest names, which may be the store of
+    another workspace. Without a store or with chunks missing the file is
+    kept.
+    """
+    try:
+        manifest = chunkstore.read_manifest(path + versionindex.MANIFEST_SUFFIX)
+        stat = os.stat(path)
+    except (IOError, OSError, ValueError):
+        return False
+    if (stat.st_size != manifest["size"] or
+            stat.st_mtime != manifest["mtime"] or not manifest.get("store")):
+        return False
+    return chunkstore.ChunkStore(manifest["store"]).has_all(manifest)
@@ -0,0 +1,205 @@
+"""Publishes a locally written file to its destination on a background thread
+
+The file is copied next to its destination under a hidden temporary name,
+checked against the size and checksum of what was read, and only then
+renamed over the destination. A reader of the destination folder sees the
+old file or the whole new one, never a part of it, and a failed copy
+leaves the destination as it was and the local file in place.
+
+A copy never puts an older file over a newer one: it refuses to replace a
+destination that changed after the copy was made, and settle cancels the
+copies to a destination before something else writes to it.
+
+Nothing here imports Maya.
+"""
+import hashlib
+import logging
+import os
+import threading
+import uuid
+
+import fileutil
+import metrics
+
+log = logging.getLogger(__name__)
+
+CHUNK_SIZE = 8 << 20
+
+_in_flight = set()
+_in_flight_lock = threading.Lock()
+
+
+class CopyCancelled(IOError):
+    """A copy was cancelled because a newer file is written to its destination"""
+
+
+class StagedCopy(object):
+    """Copies source to destination on a thread of its own
+
+    Progress is read from the attributes, which the copy thread updates
+    as it goes, so a UI can poll them from its own thread. Every copy is a
+    "publish" operation of metrics.
+
+    Attributes:
+        source (str): the local file
+        destination (str): the final path
+        total (int): size of source in bytes
+        copied (int): bytes copied so far
+        checksum (str): sha256 hex digest of source once read
+        error (Exception): what made the copy fail, None while it has not
+        done (threading.Event): set when the copy finished or failed
+        published (callable): called on the copy thread once the file is
+            in place, a failure of it is logged but the publish stands
+    """
+
+    def __init__(self, source, destination, remove_source=True,
+                 chunk_size=CHUNK_SIZE, published=None):
+        self.source = source
+        self.destination = destination
+        self.remove_source = remove_source
+        self.chunk_size = chunk_size
+        self.published = published
+        self.total = os.path.getsize(source)
+        self.copied = 0
+        self.checksum = None
+        self.error = None
+        self.done = threading.Event()
+        self._cancelled = threading.Event()
+        self._destination_stamp = _stamp(destination)
+        self._thread = threading.Thread(target=self._run,
+                                        name="StagedCopy " + destination)
+
+    def start(self):
+        """Starts the copy and returns self"""
+        with _in_flight_lock:
+            _in_flight.add(self)
+        self._thread.start()
+        return self
+
+    def cancel(self):
+        """Stops the copy before it replaces the destination, see settle"""
+        self._cancelled.set()
+
+    def wait(self, timeout=None):
+        """Blocks until the copy is done, returns True if it succeeded"""
+        self.done.wait(timeout)
+        return self.succeeded
+
+    @property
+    def succeeded(self):
+        return self.done.is_set() and self.error is None
+
+    def _run(self):
+        with metrics.operation("publish", folder=os.path.dirname(
+                self.destination)):
+            self._publish()
+            metrics.count("bytes_copied", self.copied)
+            metrics.annotate(succeeded=self.error is None)
+
+    def _publish(self):
+        folder, name = os.path.split(self.destination)
+        part = os.path.join(folder, ".{}.{}.part".format(name, uuid.uuid4().hex))
+        try:
+            digest = hashlib.sha256()
+            with metrics.phase("copy"), open(self.source, "rb") as source, \
+                    open(part, "wb") as target:
+                for chunk in iter(lambda: source.read(self.chunk_size), b""):
+                    self._check_cancelled()
+                    target.write(chunk)
+                    digest.update(chunk)
+                    self.copied += len(chunk)
+                target.flush()
+                os.fsync(target.fileno())
+            self.checksum = digest.hexdigest()
+            size = os.path.getsize(part)
+            if size != self.copied or size != self.total:
+                raise IOError("Copied {} of {} bytes to {}".format(
+                    size, self.total, self.destination))
+            with metrics.phase("verify"):
+                matches = file_checksum(part, self.chunk_size) == self.checksum
+            if not matches:
+                raise IOError("Checksum of {} does not match {}".format(
+                    self.destination, self.source))
+            self._check_cancelled()
+            # the size as well, file systems may round the mtime to seconds
+            if _stamp(self.destination) != self._destination_stamp:
+                raise IOError("{} changed since the copy started, not "
+                              "replacing it".format(self.destination))
+            fileutil.replace(part, self.destination)
+            log.info("Published %s (%d bytes)", self.destination, self.total)
+            if self.remove_source:
+                os.remove(self.source)
+            if self.published is not None:
+                try:
+                    self.published()
+                except Exception:  # the file is already published
+                    log.exception("Publish of %s succeeded but its follow up "
+                                  "failed", self.destination)
+        except CopyCancelled as err:  # a newer file goes to destination
+            self.error = err
+            log.info("%s, a newer save replaces it", err)
+            if os.path.exists(part):
+                os.remove(part)
+            if self.remove_source:
+                os.remove(self.source)
+        except Exception as err:  # reported through error, the thread ends
+            self.error = err
+            log.error("Could not publish %s, the local copy is kept at %s: %s",
+                      self.destination, self.source, err)
+            if os.path.exists(part):
+                os.remove(part)
+        finally:
+            with _in_flight_lock:
+                _in_flight.discard(self)
+            self.done.set()
+
+    def _check_cancelled(self):
+        if self._cancelled.is_set():
+            raise CopyCancelled("Publish of {} was cancelled".format(
+                self.destination))
+
+
+def file_checksum(path, chunk_size=CHUNK_SIZE):
+    """Returns the sha256 hex digest of a file, read chunk_size bytes at a time"""
+    digest = hashlib.sha256()
+    with open(path, "rb") as stream:
+        for chunk in iter(lambda: stream.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def in_flight():
+    """Returns the destinations of the copies that have not finished yet"""
+    with _in_flight_lock:
+        return set(copy.destination for copy in _in_flight)
+
+
+def copies_to(destination):
+    """Returns the copies to destination that have not finished yet"""
+    destination = os.path.normpath(str(destination))
+    with _in_flight_lock:
+        return [copy for copy in _in_flight
+                if os.path.normpath(copy.destination) == destination]
+
+
+def settle(destination, timeout=None):
+    """Cancels the copies to destination and waits until they ended
+
+    Call it before writing to destination, so no copy that is still
+    running puts its older file over the new one afterwards.
+
+    Returns:
+        bool: True if no copy to destination is running any more
+    """
+    copies = copies_to(destination)
+    for copy in copies:
+        copy.cancel()
+    return all(copy.done.wait(timeout) for copy in copies)
+
+
+def _stamp(path):
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return stat.st_mtime, stat.st_size
@@ -0,0 +1,175 @@
+"""Finds the latest version of scene files without listing their folder every time
+
+Scene files are named descriptor_task_vNNN.ext, see smartsave.SceneFile.
+A folder is listed once with os.scandir and the highest version of every
+descriptor, task and extension kept in a VersionIndex. The index is
+reused until the folder's modification time changes, which adding,
+removing or renaming a file in it always does.
+
+An index can also be written to a small sidecar file in the folder, so
+other sessions start without listing the folder either. Versions kept as
+a chunk manifest, named like the scene file plus MANIFEST_SUFFIX, count
+as versions too, see chunkstore.
+"""
+import json
+import logging
+import os
+import re
+import time
+
+import fileutil
+
+log = logging.getLogger(__name__)
+
+VERSION = 1
+SIDECAR_NAME = ".smartsave_versions.json"
+MANIFEST_SUFFIX = ".manifest"
+SCENE_FILE_RE = re.compile(
+    r"^(?P<descriptor>[^_]+)_(?P<task>[^_]+)_v(?P<ver>\d+)(?P<ext>\.[^.]*)?"
+    r"(?:" + re.escape(MANIFEST_SUFFIX) + r")?$")
+
+_indexes = {}
+
+
+class VersionIndex(object):
+    """The highest version of every descriptor, task and extension in a folder
+
+    Attributes:
+        folder (str): the listed folder
+        mtime (float): modification time of the folder when it was listed,
+            None when it did not exist
+        latest (dict): (descriptor, task, ext) to highest version number,
+            ext with its leading dot
+        racy (bool): the folder changed too shortly before the listing for
+            its mtime to be trusted, see fileutil.RACY_SECONDS
+    """
+
+    def __init__(self, folder, mtime=None, latest=None, racy=False):
+        self.folder = folder
+        self.mtime = mtime
+        self.latest = latest or {}
+        self.racy = racy
+
+    @classmethod
+    def scan(cls, folder):
+        """Lists folder once and returns its index, empty if it does not exist"""
+        mtime = _folder_mtime(folder)
+        index = cls(folder, mtime, racy=mtime is not None and
+                    time.time() - mtime < fileutil.RACY_SECONDS)
+        if mtime is None:
+            return index
+        for name in fileutil.list_folder(folder)[0]:
+            index.add_name(name)
+        return index
+
+    def add_name(self, name):
+        """Records the version of a file name, ignoring names of other files"""
+        parsed = parse_name(name)
+        if parsed is not None:
+            self.add(*parsed)
+
+    def add(self, descriptor, task, ver, ext):
+        """Records a version, keeping the highest of each name"""
+        key = (descriptor, task, fileutil.dotted(ext))
+        if ver > self.latest.get(key, 0):
+            self.latest[key] = ver
+
+    def latest_version(self, descriptor, task, ext):
+        """Returns the highest version number of a name, 0 when there is none"""
+        return self.latest.get(
+            (descriptor, task, fileutil.dotted(ext)), 0)
+
+    def is_current(self):
+        """Returns True if the folder has not changed since it was listed"""
+        return not self.racy and _folder_mtime(self.folder) == self.mtime
+
+    def write(self):
+        """Writes the index to the folder's sidecar file
+
+        The file is rewritten in place, which leaves the folder's mtime
+        alone once it exists, so the mtime stored in it stays valid.
+        """
+        path = os.path.join(self.folder, SIDECAR_NAME)
+        if not os.path.exists(path):
+            if _folder_mtime(self.folder) != self.mtime:
+                return
+            open(path, "a").close()
+            self.mtime = _folder_mtime(self.folder)
+        data = {"version": VERSION, "mtime": self.mtime,
+                "latest": [list(key) + [ver]
+                           for key, ver in sorted(self.latest.items())]}
+        with open(path, "w") as stream:
+            json.dump(data, stream)
+
+    @classmethod
+    def read(cls, folder):
+        """Returns the index in the folder's sidecar file, None if it has none
+
+        A sidecar that cannot be read or is of a newer version is ignored.
+        """
+        try:
+            with open(os.path.join(folder, SIDECAR_NAME)) as stream:
+                data = json.load(stream)
+        except (IOError, OSError, ValueError):
+            return None
+        if data.get("version") != VERSION:
+            return None
+        latest = {(descriptor, task, ext): ver
+                  for descriptor, task, ext, ver in data["latest"]}
+        return cls(folder, data["mtime"], latest)
+
+
+def folder_index(folder, sidecar=False):
+    """Returns an up to date VersionIndex of folder
+
+    The index is cached per folder and only listed again when the folder
+    changed, so repeated lookups cost one stat of the folder.
+
+    Args:
+        folder (str): the scene folder
+        sidecar (bool): read and write the folder's sidecar index file
+    """
+    folder = os.path.normpath(str(folder))
+    index = _indexes.get(folder)
+    if index is not None and index.is_current():
+        return index
+    if sidecar:
+        index = VersionIndex.read(folder)
+        if index is not None and index.is_current():
+            _indexes[folder] = index
+            return index
+    started = time.time()
+    index = VersionIndex.scan(folder)
+    log.debug("Listed %d scene names in %s in %.3fs", len(index.latest),
+              folder, time.time() - started)
+    if sidecar and index.mtime is not None and not index.racy:
+        try:
+            index.write()
+        except (IOError, OSError) as err:
+            log.warning("Could not write version index in %s: %s", folder, err)
+    _indexes[folder] = index
+    return index
+
+
+def parse_name(name):
+    """Returns (descriptor, task, ver, ext) of a scene or manifest file name
+
+    Returns None for names of other files. ext keeps its leading dot.
+    """
+    match = SCENE_FILE_RE.match(name)
+    if match is None:
+        return None
+    return (match.group("descriptor"), match.group("task"),
+            int(match.group("ver")), match.group("ext") or "")
+
+
+def clear_cache():
+    """Forgets every cached index, the next lookups list their folders again"""
+    _indexes.clear()
+
+
+def _folder_mtime(folder):
+    try:
+        return os.stat(folder).st_mtime
+    except OSError:
+        return None
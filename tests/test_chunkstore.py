@@ -0,0 +1,26 @@
+"""Checks content defined chunking does not depend on how the file is read"""
+import io
+
+import numpy as np
+import pytest
+
+import chunkstore
+
+
+def sample_data():
+    random = np.random.RandomState(5)
+    part = random.randint(0, 256, 150000).astype(np.uint8).tobytes()
+    # repeated and zero runs, as in scene files
+    return (part + bytes(100000) + part[1000:90000] +
+            random.randint(0, 4, 200000).astype(np.uint8).tobytes())
+
+
+@pytest.mark.parametrize("block_size", [31, 997, 4096, 65536, 1 << 20])
+def test_iter_chunks_cuts_do_not_depend_on_block_size(block_size):
+    data = sample_data()
+    expected = [0] + chunkstore.cut_points(data)
+    chunks = list(chunkstore.iter_chunks(io.BytesIO(data), block_size))
+    assert b"".join(chunks) == data
+    assert np.cumsum([0] + [len(chunk) for chunk in chunks]).tolist() == \
+        expected
+    assert all(len(chunk) <= chunkstore.MAX_SIZE for chunk in chunks)
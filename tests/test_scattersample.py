@@ -0,0 +1,106 @@
+"""Compares the vectorized samplers to one point at a time loops"""
+import numpy as np
+import pytest
+
+import scattersample
+
+
+def naive_reject_overlaps(centers, radii, fixed_centers, fixed_radii):
+    kept_centers = list(fixed_centers)
+    kept_radii = list(fixed_radii)
+    keep = np.zeros(len(centers), dtype=bool)
+    for index, (center, radius) in enumerate(zip(centers, radii)):
+        if kept_centers:
+            distances = np.linalg.norm(np.array(kept_centers) - center, axis=1)
+            if (distances < np.array(kept_radii) + radius).any():
+                continue
+        keep[index] = True
+        kept_centers.append(center)
+        kept_radii.append(radius)
+    return keep
+
+
+def naive_greedy_independent(count, first, second):
+    picked = np.zeros(count, dtype=bool)
+    for item in range(count):
+        earlier = first[second == item]
+        picked[item] = not picked[earlier].any()
+    return picked
+
+
+@pytest.mark.parametrize("count,pair_budget", [(200, 1 << 20), (3000, 256)])
+def test_reject_overlaps_matches_one_sphere_at_a_time(count, pair_budget):
+    random = np.random.RandomState(count)
+    centers = random.uniform(0.0, 10.0, (count, 3))
+    # radii spanning several levels, including tiny ones
+    radii = 0.6 * random.uniform(0.0, 1.0, count) ** 3
+    keep = scattersample.reject_overlaps(centers, radii,
+                                         pair_budget=pair_budget)
+    expected = naive_reject_overlaps(centers, radii, [], [])
+    np.testing.assert_array_equal(keep, expected)
+
+
+def test_reject_overlaps_avoids_fixed_spheres():
+    random = np.random.RandomState(7)
+    centers = random.uniform(0.0, 5.0, (500, 3))
+    radii = random.uniform(0.05, 0.3, 500)
+    fixed_centers = random.uniform(0.0, 5.0, (20, 3))
+    fixed_radii = random.uniform(0.1, 1.0, 20)
+    keep = scattersample.reject_overlaps(centers, radii, fixed_centers,
+                                         fixed_radii)
+    expected = naive_reject_overlaps(centers, radii, fixed_centers,
+                                     fixed_radii)
+    np.testing.assert_array_equal(keep, expected)
+
+
+def test_greedy_independent_matches_loop():
+    random = np.random.RandomState(3)
+    count = 400
+    pairs = random.randint(0, count, (1500, 2))
+    pairs = pairs[pairs[:, 0] != pairs[:, 1]]
+    first, second = pairs.min(axis=1), pairs.max(axis=1)
+    picked = scattersample.greedy_independent(count, first, second)
+    np.testing.assert_array_equal(
+        picked, naive_greedy_independent(count, first, second))
+
+
+@pytest.mark.parametrize("radius", [0.05, 0.3, 1.0])
+def test_poisson_disk_keeps_radius_between_picks(radius):
+    random = np.random.RandomState(11)
+    points = random.uniform(0.0, 4.0, (2000, 3))
+    picked = scattersample.poisson_disk(points, radius)
+    assert len(picked)
+    distances = np.linalg.norm(
+        points[:, np.newaxis] - points[picked][np.newaxis], axis=2)
+    between = distances[picked]
+    np.fill_diagonal(between, np.inf)
+    assert between.min() >= radius
+    # every point left out is too close to a picked one
+    left_out = np.setdiff1d(np.arange(len(points)), picked)
+    assert (distances[left_out].min(axis=1) < radius).all()
+
+
+def test_poisson_disk_matches_dart_throwing():
+    random = np.random.RandomState(13)
+    points = random.uniform(0.0, 6.0, (3000, 3))
+    picked = scattersample.poisson_disk(points, 0.5)
+    kept = []
+    for index, point in enumerate(points):
+        if not kept or (np.linalg.norm(points[kept] - point, axis=1) >=
+                        0.5).all():
+            kept.append(index)
+    np.testing.assert_array_equal(picked, kept)
+
+
+def test_poisson_disk_favours_no_grid_cells():
+    random = np.random.RandomState(17)
+    points = np.zeros((40000, 3))
+    points[:, [0, 2]] = random.uniform(0.0, 40.0, (40000, 2))
+    picked = scattersample.poisson_disk(points, 1.0)
+    # cells of radius / sqrt(3) in 27 phases, as a lattice would claim them
+    grid = scattersample.SpatialGrid(points, 1.0 / np.sqrt(3.0))
+    phases = (grid.cell_coords % 3).dot([9, 3, 1])
+    cells = grid.lookup(grid.cells(points[picked]))
+    rates = [len(np.unique(cells[phases[cells] == phase])) /
+             float((phases == phase).sum()) for phase in np.unique(phases)]
+    assert min(rates) > 0.8 * max(rates)